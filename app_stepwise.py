@@ -2,28 +2,27 @@
 # Each step is performed sequentially via multiple Responses API calls.
 
 import os
+import re
 import json
+import time
 import base64
 import asyncio
-from openai import AzureOpenAI
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from call_computer_use import post_purchase_invoice_header, retrieve_contract
+from call_computer_use import PrewarmedPostingPage, post_purchase_invoice_header, retrieve_contract, retrieve_contracts, invoice_exists
+from common.clients import get_client
+from common.model_calls import create_response
+from common.model_routing import FAST_IMAGE_DETAIL, get_model_router, score_business_rules, score_invoice_extraction, score_verdict
+from common.prompt_compaction import build_anomaly_prompt
+from common.safety_policy import safety_context
 
 # Load environment variables
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 MODEL = os.getenv("MODEL_NAME2")
 API_VERSION = os.getenv("AZURE_API_VERSION")
 VECTOR_STORE_ID = os.getenv("vector_store_id")
-
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
-)
-
-client = AzureOpenAI(
-    azure_endpoint=AZURE_ENDPOINT,
-    azure_ad_token_provider=token_provider,
-    api_version=API_VERSION,
-)
+# Check the invoice list page for an existing row before starting a posting CUA session
+VERIFY_BEFORE_POST = os.getenv("VERIFY_BEFORE_POST", "false").lower() in ("1", "true", "yes")
+# Open (and pre-fill) the posting form while business rules and anomaly detection are still running
+PREWARM_POSTING_PAGE = os.getenv("PREWARM_POSTING_PAGE", "true").lower() in ("1", "true", "yes")
 
 
 def encode_image_to_base64(image_path):
@@ -35,8 +34,17 @@ def encode_image_to_base64(image_path):
 
 
 async def extract_invoice_data(image_path):
+    """Extract the invoice fields, trying the fast model at low image detail first (see common/model_routing.py)."""
     base64_image = encode_image_to_base64(image_path)
-    user_prompt = """
+    return await get_model_router().run(
+        "extraction",
+        MODEL,
+        lambda model, fast: _extract_invoice_data(base64_image, model, FAST_IMAGE_DETAIL if fast else "high"),
+        score_invoice_extraction,
+    )
+
+
+EXTRACTION_PROMPT = """
 You are given a purchase invoice image. Extract the following fields and return a JSON object with these exact key names:
 {
   "contractId": <contract id>,
@@ -51,25 +59,28 @@ You are given a purchase invoice image. Extract the following fields and return
 }
 If any field is missing, set its value to null. Do not use any other key names. Only output the JSON object, nothing else.
 """
+
+
+def build_extraction_request(base64_image, model=MODEL, detail="high"):
+    """Responses API request for invoice extraction; shared by interactive runs and offline batch jobs."""
     input_messages = [
         {
             "role": "user",
             "content": [
-                {"type": "input_text", "text": user_prompt},
+                {"type": "input_text", "text": EXTRACTION_PROMPT},
                 {
                     "type": "input_image",
                     "image_url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "high",
+                    "detail": detail,
                 },
             ],
         }
     ]
-    response = client.responses.create(
-        model=MODEL,
-        input=input_messages,
-        tools=[],
-        parallel_tool_calls=False,
-    )
+    return dict(model=model, input=input_messages, tools=[], parallel_tool_calls=False)
+
+
+def parse_extraction_response(response):
+    """Return the invoice data dict from an extraction response; raises ValueError if it holds no JSON."""
     # Try to extract JSON from the response
     for output in response.output:
         if hasattr(output, "content") and output.content:
@@ -84,6 +95,13 @@ If any field is missing, set its value to null. Do not use any other key names.
     raise ValueError("Could not extract invoice data from model response.")
 
 
+async def _extract_invoice_data(base64_image, model, detail):
+    response = await create_response(
+        get_client(), stage="extraction", **build_extraction_request(base64_image, model, detail)
+    )
+    return parse_extraction_response(response)
+
+
 async def get_contract_details(contractid):
     # Use the retrieve_contract tool
     instructions = "Extract all contract header and contract line items as JSON."
@@ -94,7 +112,24 @@ async def get_contract_details(contractid):
         return result
 
 
+async def get_contracts_details(contract_ids):
+    """Retrieve several contracts concurrently in one browser; returns the parsed data keyed by contract id."""
+    instructions = "Extract all contract header and contract line items as JSON."
+    results = await retrieve_contracts(contract_ids, instructions=instructions)
+    contracts = {}
+    for contractid, result in results.items():
+        try:
+            contracts[contractid] = json.loads(result)
+        except Exception:
+            contracts[contractid] = result
+    return contracts
+
+
 async def get_business_rules():
+    return await get_model_router().run("rules", MODEL, lambda model, fast: _get_business_rules(model), score_business_rules)
+
+
+async def _get_business_rules(model):
     # Use file_search tool to retrieve business rules
     input_messages = [
         {
@@ -114,8 +149,10 @@ async def get_business_rules():
             "max_num_results": 5,
         }
     ]
-    response = client.responses.create(
-        model=MODEL,
+    response = await create_response(
+        get_client(),
+        stage="rules",
+        model=model,
         input=input_messages,
         tools=tools_list,
         parallel_tool_calls=False,
@@ -127,11 +164,12 @@ async def get_business_rules():
     return None
 
 
-async def detect_anomalies(invoice_data, contract_data, business_rules):
-    user_prompt = f"""
+ANOMALY_PROMPT_TEMPLATE = """
 Given the following:
-- Invoice Data: {json.dumps(invoice_data)}
-- Contract Data: {json.dumps(contract_data)}
+- Invoice Data:
+{invoice_data}
+- Contract Data:
+{contract_data}
 - Business Rules: {business_rules}
 
 Your task:
@@ -147,15 +185,35 @@ Return your response as a JSON object with the following keys:
 }}
 If contract data is missing, set status to 'rejected' and explain in summary_verdict.
 """
+
+
+async def detect_anomalies(invoice_data, contract_data, business_rules):
+    user_prompt, token_stats = build_anomaly_prompt(
+        ANOMALY_PROMPT_TEMPLATE, invoice_data, contract_data, business_rules
+    )
+    print(
+        f"Anomaly prompt: {token_stats['prompt_tokens']} tokens "
+        f"(raw {token_stats['raw_tokens']}, saved {token_stats['saved_tokens']} / {token_stats['saved_pct']}%)"
+        + (" - over budget" if token_stats["over_budget"] else "")
+    )
+    return await get_model_router().run(
+        "verdict",
+        MODEL,
+        lambda model, fast: _detect_anomalies(user_prompt, model),
+        lambda verdict: score_verdict(verdict, invoice_data, contract_data),
+    )
+
+
+def build_verdict_request(user_prompt, model=MODEL):
+    """Responses API request for the anomaly verdict; shared by interactive runs and offline batch jobs."""
     input_messages = [
         {"role": "user", "content": [{"type": "input_text", "text": user_prompt}]}
     ]
-    response = client.responses.create(
-        model=MODEL,
-        input=input_messages,
-        tools=[],
-        parallel_tool_calls=False,
-    )
+    return dict(model=model, input=input_messages, tools=[], parallel_tool_calls=False)
+
+
+def parse_verdict_response(response):
+    """Return the verdict dict from an anomaly detection response."""
     for output in response.output:
         if hasattr(output, "content") and output.content:
             text = output.content[0].text
@@ -182,9 +240,40 @@ If contract data is missing, set status to 'rejected' and explain in summary_ver
     }
 
 
-async def post_invoice(invoice_data, verdict):
+async def _detect_anomalies(user_prompt, model):
+    response = await create_response(get_client(), stage="verdict", **build_verdict_request(user_prompt, model))
+    return parse_verdict_response(response)
+
+
+def posting_fields(invoice_data):
+    """Posting form values that come from the invoice alone; status and remarks need the verdict."""
+    total_invoice_value = invoice_data.get("totalInvoiceValue", "0.00")
+    return {
+        "purchase_invoice_no": invoice_data.get("invoiceNumber", "UNKNOWN"),
+        "contract_reference": invoice_data.get("contractId", "UNKNOWN"),
+        "supplier_id": invoice_data.get("supplierId", "UNKNOWN"),
+        # The form takes only the numeric part of the total
+        "total_invoice_value": re.sub(r"[^0-9.\-]", "", str(total_invoice_value)),
+        "invoice_date": invoice_data.get("invoiceDate", "UNKNOWN"),
+    }
+
+
+def _already_posted(invoice_data, store):
+    return (
+        store is not None
+        and invoice_data.get("invoiceNumber")
+        and invoice_data.get("supplierId")
+        and store.find_posting(invoice_data["supplierId"], invoice_data["invoiceNumber"]) is not None
+    )
+
+
+async def post_invoice(invoice_data, verdict, store=None, invoice_key=None, prewarmed=None):
     """
     Compose instructions for posting invoice, including all required fields and the summary_verdict from the anomaly detection step.
+    When a state store is given, its posting ledger keyed by (supplierId, invoiceNumber) is consulted first so a
+    retried run never posts the same invoice twice.
+    A PrewarmedPostingPage, when given, supplies the already loaded form; it is cancelled if nothing is posted.
+    Returns a note such as "Already posted (verified)" when the invoice was found already posted, otherwise None.
     """
     purchase_invoice_no = invoice_data.get("invoiceNumber", "UNKNOWN")
     contract_reference = invoice_data.get("contractId", "UNKNOWN")
@@ -197,6 +286,19 @@ async def post_invoice(invoice_data, verdict):
     status = verdict.get("status", "rejected")
     remarks = verdict.get("summary_verdict", "No summary provided").replace("\n", " ")
 
+    ledger_keyed = store is not None and invoice_data.get("invoiceNumber") and invoice_data.get("supplierId")
+    if ledger_keyed:
+        existing = store.find_posting(supplier_id, purchase_invoice_no)
+        if existing:
+            print(f"Invoice {purchase_invoice_no} from supplier {supplier_id} is already in the posting ledger; skipping.")
+            return f"Already posted ({existing['source']})"
+    if VERIFY_BEFORE_POST and invoice_data.get("invoiceNumber") and invoice_data.get("supplierId"):
+        if await invoice_exists(purchase_invoice_no, supplier_id):
+            print(f"Invoice {purchase_invoice_no} from supplier {supplier_id} already exists on the invoice list page; skipping.")
+            if ledger_keyed:
+                store.record_posting(supplier_id, purchase_invoice_no, invoice_key, status, source="verified")
+            return "Already posted (verified)"
+
     instructions = (
         f"Fill the form with purchase_invoice_no '{purchase_invoice_no}', "
         f"contract_reference '{contract_reference}', "
@@ -207,91 +309,230 @@ async def post_invoice(invoice_data, verdict):
         f"Save this information by clicking on the 'save' button. "
         f"If the response message shows a dialog box or a message box, acknowledge it."
     )
-    result = await post_purchase_invoice_header(instructions=instructions)
+    computer = await prewarmed.take() if prewarmed else None
+    if computer is not None and prewarmed.prefilled:
+        instructions += (
+            f" The fields {', '.join(prewarmed.prefilled)} are already filled in; check them and only correct them if they differ."
+        )
+    result = await post_purchase_invoice_header(instructions=instructions, computer=computer)
+    if ledger_keyed:
+        store.record_posting(supplier_id, purchase_invoice_no, invoice_key, status)
     return result
 
 
-async def main(image_path=None):
+def _record_timing(results, step, started):
+    """Record a step's wall time in results["timings"] (steps restored from a checkpoint take ~0s)."""
+    results.setdefault("timings", {})[step] = round(time.perf_counter() - started, 3)
+
+
+def _save_checkpoint(store, invoice_key, stage, output):
+    """Checkpoint a stage's output; failed stages are not checkpointed so a rerun retries them."""
+    if store is None or (isinstance(output, dict) and "error" in output):
+        return
+    store.save_checkpoint(invoice_key, stage, output)
+
+
+async def main(image_path=None, store=None, invoice_key=None, stop_before=None, prewarm_posting=None):
     """
     Stepwise workflow for procure-to-pay automation.
     Args:
         image_path (str): Path to the invoice image file.
+        store (InvoiceStateStore): Optional durable state store. When given, each completed step is
+            checkpointed and steps already completed by an earlier run are resumed instead of recomputed.
+        invoice_key (str): Key of the invoice in the store. Defaults to the key derived from the image.
+        stop_before (str): Return before this step ("verdict"), e.g. when the verdict is computed by an offline batch job.
+        prewarm_posting (bool): Open the posting form while the verdict is computed. Defaults to PREWARM_POSTING_PAGE.
+    Returns:
+        dict: The output of every step, keyed by step name.
     """
     if image_path is None:
         image_path = "data_files/Invoice-001.png"
+    checkpoints = {}
+    if store is not None:
+        invoice_key = invoice_key or store.enqueue(image_path)
+        checkpoints = store.load_checkpoints(invoice_key)
+        if checkpoints:
+            print(f"Resuming invoice {invoice_key} with completed steps: {', '.join(checkpoints)}")
+    # Safety check escalations and audit records name the invoice they belong to
+    safety_context.set({"image_path": image_path, "invoice_key": invoice_key})
     results = {}
     # Step 1: Extract invoice data
+    started = time.perf_counter()
     print("=" * 60)
     print("STEP 1: Extracting invoice data from image...")
     print("=" * 60)
-    try:
-        invoice_data = await extract_invoice_data(image_path)
-        print("Extracted invoice data:\n", json.dumps(invoice_data, indent=2))
-    except Exception as e:
-        invoice_data = {"error": f"Invoice extraction failed: {str(e)}"}
-        print(f"ERROR in Step 1: {e}")
+    if "invoice_data" in checkpoints:
+        invoice_data = checkpoints["invoice_data"]
+        print("Invoice data restored from checkpoint.")
+    else:
+        try:
+            invoice_data = await extract_invoice_data(image_path)
+            print("Extracted invoice data:\n", json.dumps(invoice_data, indent=2))
+        except Exception as e:
+            invoice_data = {"error": f"Invoice extraction failed: {str(e)}"}
+            print(f"ERROR in Step 1: {e}")
+        _save_checkpoint(store, invoice_key, "invoice_data", invoice_data)
     results['invoice_data'] = invoice_data
+    _record_timing(results, 'invoice_data', started)
 
     # Step 2: Retrieve contract details
+    started = time.perf_counter()
     print("=" * 60)
     print("STEP 2: Retrieving contract details...")
     print("=" * 60)
-    contractid = invoice_data.get("contractId") if isinstance(invoice_data, dict) else None
-    if not contractid:
-        print(f"WARNING: No contractId found in invoice data. Invoice data keys: {list(invoice_data.keys()) if isinstance(invoice_data, dict) else 'N/A'}")
-        print(f"Invoice data: {json.dumps(invoice_data, indent=2) if isinstance(invoice_data, dict) else invoice_data}")
+    if "contract_data" in checkpoints:
+        contract_data = checkpoints["contract_data"]
+        print("Contract data restored from checkpoint.")
     else:
-        print(f"Contract ID extracted: {contractid}")
-    try:
-        contract_data = await get_contract_details(contractid) if contractid else {"error": "No contractId found in invoice data."}
-        print(f"Contract data retrieved: {json.dumps(contract_data, indent=2) if isinstance(contract_data, dict) else contract_data}")
-    except Exception as e:
-        contract_data = {"error": f"Contract retrieval failed: {str(e)}"}
-        print(f"ERROR in Step 2: {e}")
+        contractid = invoice_data.get("contractId") if isinstance(invoice_data, dict) else None
+        if not contractid:
+            print(f"WARNING: No contractId found in invoice data. Invoice data keys: {list(invoice_data.keys()) if isinstance(invoice_data, dict) else 'N/A'}")
+            print(f"Invoice data: {json.dumps(invoice_data, indent=2) if isinstance(invoice_data, dict) else invoice_data}")
+        else:
+            print(f"Contract ID extracted: {contractid}")
+        try:
+            contract_data = await get_contract_details(contractid) if contractid else {"error": "No contractId found in invoice data."}
+            print(f"Contract data retrieved: {json.dumps(contract_data, indent=2) if isinstance(contract_data, dict) else contract_data}")
+        except Exception as e:
+            contract_data = {"error": f"Contract retrieval failed: {str(e)}"}
+            print(f"ERROR in Step 2: {e}")
+        _save_checkpoint(store, invoice_key, "contract_data", contract_data)
     results['contract_data'] = contract_data
+    _record_timing(results, 'contract_data', started)
+
+    if prewarm_posting is None:
+        prewarm_posting = PREWARM_POSTING_PAGE
+    prewarmed = None
+    if (
+        prewarm_posting
+        and stop_before is None
+        and "post_result" not in checkpoints
+        and isinstance(invoice_data, dict)
+        and "error" not in invoice_data
+        and not _already_posted(invoice_data, store)
+    ):
+        # Load the posting form while steps 3 and 4 run; status and remarks are filled once the verdict is known
+        prewarmed = PrewarmedPostingPage(posting_fields(invoice_data)).start()
+    try:
+        await _run_verdict_and_posting(results, checkpoints, store, invoice_key, invoice_data, contract_data, prewarmed, stop_before)
+    finally:
+        if prewarmed is not None:
+            await prewarmed.cancel()
 
+    print("\n" + "=" * 60)
+    print("WORKFLOW COMPLETE")
+    print("=" * 60)
+    return results
+
+
+async def _run_verdict_and_posting(results, checkpoints, store, invoice_key, invoice_data, contract_data, prewarmed, stop_before=None):
+    """Steps 3 to 5 of main; results are added to results."""
     # Step 3: Retrieve business rules
+    started = time.perf_counter()
     print("=" * 60)
     print("STEP 3: Retrieving business rules...")
     print("=" * 60)
-    try:
-        business_rules = await get_business_rules()
-        print("Business rules retrieved:\n", business_rules)
-    except Exception as e:
-        business_rules = f"Business rules retrieval failed: {str(e)}"
-        print(f"ERROR in Step 3: {e}")
+    if "business_rules" in checkpoints:
+        business_rules = checkpoints["business_rules"]
+        print("Business rules restored from checkpoint.")
+    else:
+        try:
+            business_rules = await get_business_rules()
+            print("Business rules retrieved:\n", business_rules)
+            _save_checkpoint(store, invoice_key, "business_rules", business_rules)
+        except Exception as e:
+            business_rules = f"Business rules retrieval failed: {str(e)}"
+            print(f"ERROR in Step 3: {e}")
     results['business_rules'] = business_rules
+    _record_timing(results, 'business_rules', started)
+    if stop_before == "verdict":
+        return
 
     # Step 4: Detect anomalies
+    started = time.perf_counter()
     print("=" * 60)
     print("STEP 4: Detecting anomalies...")
     print("=" * 60)
-    try:
-        verdict = await detect_anomalies(invoice_data, contract_data, business_rules)
-        print(f"Verdict: {json.dumps(verdict, indent=2) if isinstance(verdict, dict) else verdict}")
-    except Exception as e:
-        verdict = {"error": f"Anomaly detection failed: {str(e)}"}
-        print(f"ERROR in Step 4: {e}")
+    if "verdict" in checkpoints:
+        verdict = checkpoints["verdict"]
+        print("Verdict restored from checkpoint.")
+    else:
+        try:
+            verdict = await detect_anomalies(invoice_data, contract_data, business_rules)
+            print(f"Verdict: {json.dumps(verdict, indent=2) if isinstance(verdict, dict) else verdict}")
+        except Exception as e:
+            verdict = {"error": f"Anomaly detection failed: {str(e)}"}
+            print(f"ERROR in Step 4: {e}")
+        _save_checkpoint(store, invoice_key, "verdict", verdict)
     results['verdict'] = verdict
+    _record_timing(results, 'verdict', started)
 
     # Step 5: Post invoice
+    started = time.perf_counter()
     print("=" * 60)
     print("STEP 5: Posting purchase invoice...")
     print("=" * 60)
-    try:
-        post_result = await post_invoice(invoice_data, verdict)
-    except Exception as e:
-        post_result = f"Post invoice failed: {str(e)}"
-        print(f"ERROR in Step 5: {e}")
+    if "post_result" in checkpoints:
+        post_result = checkpoints["post_result"]
+        print("Invoice was already posted by an earlier run; skipping.")
+    elif any(isinstance(output, dict) and "error" in output for output in (invoice_data, verdict)):
+        # Don't post a rejection caused by a failed model call; leave the invoice for a retry
+        post_result = {"error": "Posting skipped because invoice extraction or anomaly detection failed."}
+        print(f"ERROR in Step 5: {post_result['error']}")
+    else:
+        try:
+            skipped = await post_invoice(invoice_data, verdict, store=store, invoice_key=invoice_key, prewarmed=prewarmed)
+            # The same value whether the invoice was posted now or the post is restored from the checkpoint
+            post_result = {"posted": True, "status": verdict.get("status") if isinstance(verdict, dict) else None}
+            if skipped:
+                # e.g. "Already posted (verified)": the invoice was found posted instead of being posted again
+                post_result["note"] = skipped
+            _save_checkpoint(store, invoice_key, "post_result", post_result)
+        except Exception as e:
+            post_result = f"Post invoice failed: {str(e)}"
+            print(f"ERROR in Step 5: {e}")
     results['post_result'] = post_result
+    _record_timing(results, 'post_result', started)
 
-    print("\n" + "=" * 60)
-    print("WORKFLOW COMPLETE")
-    print("=" * 60)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Process purchase invoice image (stepwise).')
     parser.add_argument('--image', type=str, default="data_files/Invoice-002.png", help='Path to the purchase invoice image file')
+    parser.add_argument('--state-db', type=str, default=None, help='SQLite state store used to checkpoint and resume the workflow')
+    parser.add_argument('--output', type=str, default=None, help='JSONL results file receiving the workflow result (see common/results_sink.py)')
     args = parser.parse_args()
-    asyncio.run(main(image_path=args.image))
+    store = invoice_key = None
+    if args.state_db:
+        from common.state_store import InvoiceStateStore
+        store = InvoiceStateStore(args.state_db)
+        invoice_key = store.enqueue(args.image)
+    from common.clients import get_token_manager, uses_aad_token
+    if uses_aad_token():
+        # Acquire the AAD token in the background while the invoice image is prepared
+        get_token_manager().start()
+    from common.memory import MEMORY_TRACE, get_memory_tracker
+    if MEMORY_TRACE:
+        get_memory_tracker().sample("start")
+    try:
+        results = asyncio.run(main(image_path=args.image, store=store, invoice_key=invoice_key))
+    except Exception as e:
+        if store is not None:
+            store.mark_failed(invoice_key, f"Pipeline failed: {str(e)}")
+        raise
+    if store is not None:
+        # Record the outcome as the batch runner does, so a later batch run skips or retries this invoice
+        from batch_runner import pipeline_error
+        error = pipeline_error(results)
+        if error:
+            store.mark_failed(invoice_key, error)
+        else:
+            store.mark_done(invoice_key)
+    if args.output:
+        from common.results_sink import ResultsSink
+        with ResultsSink(args.output) as sink:
+            sink.write({"image_path": args.image, "results": results})
+    get_model_router().print_report()
+    if MEMORY_TRACE:
+        get_memory_tracker().sample(args.image)
+        get_memory_tracker().print_report()
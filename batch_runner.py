@@ -0,0 +1,263 @@
+# Procure-to-Pay Automation - Multi-process Batch Runner
+# Shards the invoice queue across worker processes. Each worker runs its own event loop,
+# browser sessions and model client, and streams results back to the coordinator,
+# which appends them to a shared JSONL results sink (optionally exported to Parquet).
+# With --state-db, invoices are queued in a durable SQLite state store instead: workers pull
+# from it, every step is checkpointed, and a rerun resumes where the previous run stopped.
+# Within a worker, invoices are scheduled by priority lane and deadline (see common/scheduler.py).
+
+import os
+import glob
+import queue
+import asyncio
+import multiprocessing as mp
+
+DEFAULT_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 1))
+# Number of invoices (and therefore browser sessions) each worker drives concurrently
+DEFAULT_WORKER_CONCURRENCY = int(os.getenv("BATCH_WORKER_CONCURRENCY", "2"))
+# Pre-warm the posting page in batch workers as well (see PREWARM_POSTING_PAGE). Off by default: the pre-warmed
+# page is a second browser per invoice that BATCH_WORKER_CONCURRENCY does not account for
+BATCH_PREWARM_POSTING_PAGE = os.getenv("BATCH_PREWARM_POSTING_PAGE", "false").lower() in ("1", "true", "yes")
+
+
+def _fetch_token_seed():
+    """Fetch one AAD token in the coordinator so workers start with it instead of each probing the credential chain."""
+    from common.clients import get_token_manager, uses_aad_token
+
+    if not uses_aad_token():
+        return None
+
+    try:
+        manager = get_token_manager()
+        manager.get_token()
+        return manager.snapshot()
+    except Exception as e:
+        print(f"Could not pre-fetch an AAD token ({type(e).__name__}: {e}); workers will acquire their own")
+        return None
+
+
+def _prewarm_token(token_seed):
+    """Start the worker's token manager so its tokens are refreshed in the background, off the request path."""
+    from common.clients import get_token_manager, uses_aad_token
+
+    if not uses_aad_token():
+        return
+
+    get_token_manager(seed=token_seed).start()
+
+
+def _print_routing_report(worker_id):
+    from common.model_routing import get_model_router
+
+    get_model_router().print_report(f"Worker {worker_id} model routing")
+
+
+def _sample_memory(label):
+    """With MEMORY_TRACE, record the worker's memory after an invoice (see common/memory.py)."""
+    from common.memory import MEMORY_TRACE, get_memory_tracker
+
+    if MEMORY_TRACE:
+        get_memory_tracker().sample(label)
+
+
+def _print_memory_report(worker_id):
+    from common.memory import get_memory_tracker
+
+    get_memory_tracker().print_report(f"Worker {worker_id} memory")
+
+
+def shard_invoices(image_paths, num_shards):
+    """Split the invoice queue round-robin into at most num_shards non-empty shards."""
+    num_shards = max(1, num_shards)
+    shards = [image_paths[i::num_shards] for i in range(num_shards)]
+    return [s for s in shards if s]
+
+
+async def _run_shard(worker_id, jobs, concurrency, sink_queue):
+    # Imported inside the worker so every process builds its own model client
+    from app_stepwise import main
+    from common.scheduler import DeadlineScheduler, LocalJobSource
+
+    _sample_memory(f"worker {worker_id} start")
+
+    async def run_one(job):
+        record = {"image_path": job.image_path, "worker": worker_id}
+        try:
+            record["results"] = await main(image_path=job.image_path, prewarm_posting=BATCH_PREWARM_POSTING_PAGE)
+        except Exception as e:
+            record["error"] = f"Pipeline failed: {str(e)}"
+        record.update(job.record_fields())
+        sink_queue.put(record)
+        _sample_memory(f"worker {worker_id} {job.image_path}")
+
+    await DeadlineScheduler(LocalJobSource(jobs), run_one, concurrency, name=f"worker {worker_id}").run()
+
+
+def _worker_entry(worker_id, jobs, concurrency, sink_queue, token_seed=None):
+    _prewarm_token(token_seed)
+    asyncio.run(_run_shard(worker_id, jobs, concurrency, sink_queue))
+    _print_routing_report(worker_id)
+    _print_memory_report(worker_id)
+
+
+def pipeline_error(results):
+    """Return the first step error in a pipeline result, or None if every step succeeded.
+    A missing contract is not an error: by design it produces a posted 'rejected' verdict."""
+    for step, output in results.items():
+        if step == "contract_data":
+            continue
+        if isinstance(output, dict) and "error" in output:
+            return output["error"]
+        if step == "post_result" and isinstance(output, str) and output.startswith("Post invoice failed"):
+            return output
+    return None
+
+
+async def _run_queue_worker(worker_id, state_db, concurrency, sink_queue):
+    """Pull invoices from the durable state store until the queue is drained."""
+    from app_stepwise import main
+    from common.scheduler import DeadlineScheduler, StoreJobSource
+    from common.state_store import InvoiceStateStore
+
+    store = InvoiceStateStore(state_db)
+    worker_name = f"worker-{worker_id}-{os.getpid()}"
+    _sample_memory(f"worker {worker_id} start")
+
+    async def run_one(job):
+        invoice_key = job.invoice_key
+        record = {"image_path": job.image_path, "invoice_key": invoice_key, "worker": worker_id}
+        try:
+            results = await main(
+                image_path=job.image_path, store=store, invoice_key=invoice_key, prewarm_posting=BATCH_PREWARM_POSTING_PAGE
+            )
+            record["results"] = results
+            error = pipeline_error(results)
+        except Exception as e:
+            error = f"Pipeline failed: {str(e)}"
+        if error:
+            record["error"] = error
+            store.mark_failed(invoice_key, error)
+        else:
+            store.mark_done(invoice_key)
+        record.update(job.record_fields())
+        sink_queue.put(record)
+        _sample_memory(f"worker {worker_id} {invoice_key}")
+
+    try:
+        await DeadlineScheduler(StoreJobSource(store, worker_name), run_one, concurrency, name=f"worker {worker_id}").run()
+    finally:
+        store.close()
+
+
+def _queue_worker_entry(worker_id, state_db, concurrency, sink_queue, token_seed=None):
+    _prewarm_token(token_seed)
+    asyncio.run(_run_queue_worker(worker_id, state_db, concurrency, sink_queue))
+    _print_routing_report(worker_id)
+    _print_memory_report(worker_id)
+
+
+def run_batch(image_paths, output_path, workers=DEFAULT_WORKERS, concurrency=DEFAULT_WORKER_CONCURRENCY, state_db=None, jobs=None,
+              parquet_dir=None):
+    """
+    Process a batch of invoice images across worker processes.
+    Args:
+        image_paths (list[str]): Invoice images to process, in the normal lane without a deadline.
+        output_path (str): JSONL file that receives one record per processed invoice.
+        workers (int): Number of worker processes.
+        concurrency (int): Invoices processed concurrently within each worker.
+        state_db (str): Optional SQLite state store. When given, the images are added to the durable
+            queue (already-posted invoices are skipped) and workers pull from it.
+        jobs (list[InvoiceJob]): Invoices with a priority lane and deadline, e.g. from a --manifest file.
+        parquet_dir (str): Directory receiving Parquet exports of the results (default RESULTS_PARQUET_DIR).
+    Returns:
+        int: Number of records written to the output sink.
+    """
+    from common.results_sink import RESULTS_PARQUET_DIR, ResultsSink
+    from common.scheduler import InvoiceJob, urgency_order
+
+    jobs = list(jobs or []) + [InvoiceJob(image_path) for image_path in image_paths]
+    # 'spawn' gives each worker a fresh interpreter, so no client or browser state is inherited
+    ctx = mp.get_context("spawn")
+    sink_queue = ctx.Queue()
+    token_seed = _fetch_token_seed()
+    if state_db:
+        from common.state_store import InvoiceStateStore
+
+        store = InvoiceStateStore(state_db)
+        for job in jobs:
+            store.enqueue(job.image_path, priority=job.rank, deadline=job.deadline)
+        requeued = store.requeue_running()
+        if requeued:
+            print(f"Requeued {requeued} invoices left running by an interrupted run")
+        print(f"State store {state_db}: {store.status_counts()}")
+        store.close()
+        processes = [
+            ctx.Process(
+                target=_queue_worker_entry,
+                args=(worker_id, state_db, concurrency, sink_queue, token_seed),
+                name=f"p2p-worker-{worker_id}",
+            )
+            for worker_id in range(max(1, workers))
+        ]
+    else:
+        # Sharding the urgency-sorted queue round-robin gives every worker its share of the urgent invoices
+        processes = [
+            ctx.Process(
+                target=_worker_entry,
+                args=(worker_id, shard, concurrency, sink_queue, token_seed),
+                name=f"p2p-worker-{worker_id}",
+            )
+            for worker_id, shard in enumerate(shard_invoices(urgency_order(jobs), workers))
+        ]
+    # Each worker gets an equal share of the deployment's TPM/RPM quota
+    os.environ["MODEL_QUOTA_SHARE"] = str(1.0 / max(1, len(processes)))
+    for process in processes:
+        process.start()
+    print(f"Started {len(processes)} workers for {len(jobs)} invoices")
+
+    with ResultsSink(output_path, parquet_dir=parquet_dir or RESULTS_PARQUET_DIR) as sink:
+        while True:
+            try:
+                record = sink_queue.get(timeout=1)
+            except queue.Empty:
+                sink.tick()
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            sink.write(record)
+            print(f"[{sink.written}] {record['image_path']} done (worker {record['worker']})")
+    written = sink.written
+
+    for process in processes:
+        process.join()
+    if not state_db and written < len(jobs):
+        print("WARNING: Workers exited before every invoice reported a result.")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Process a batch of purchase invoice images across worker processes.')
+    parser.add_argument('--images', nargs='*', default=[], help='Paths to purchase invoice image files')
+    parser.add_argument('--input-dir', type=str, default=None, help='Directory of invoice images (*.png, *.jpg)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of worker processes')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_WORKER_CONCURRENCY, help='Invoices processed concurrently per worker')
+    parser.add_argument('--output', type=str, default="batch_results.jsonl", help='JSONL file receiving one result per invoice')
+    parser.add_argument('--state-db', type=str, default=None, help='SQLite state store to checkpoint and resume invoices')
+    parser.add_argument('--parquet-dir', type=str, default=None, help='Directory receiving periodic Parquet exports of the results (needs pyarrow)')
+    parser.add_argument('--manifest', type=str, default=None, help='JSONL of {"image_path", "priority": high|normal|low, "deadline"} jobs')
+    args = parser.parse_args()
+
+    image_paths = list(args.images)
+    if args.input_dir:
+        for pattern in ("*.png", "*.jpg", "*.jpeg"):
+            image_paths.extend(sorted(glob.glob(os.path.join(args.input_dir, pattern))))
+    jobs = []
+    if args.manifest:
+        from common.scheduler import load_manifest
+
+        jobs = load_manifest(args.manifest)
+    if not image_paths and not jobs and not args.state_db:
+        parser.error("No invoice images given; use --images, --input-dir or --manifest.")
+    run_batch(image_paths, args.output, workers=args.workers, concurrency=args.concurrency, state_db=args.state_db, jobs=jobs,
+              parquet_dir=args.parquet_dir)
@@ -0,0 +1,59 @@
+# Startup benchmark - measures how long the pipeline entry points take before doing any work.
+# Each command runs in a fresh interpreter so import caches from earlier runs do not hide the cost.
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+DEFAULT_RUNS = int(os.getenv("BENCH_STARTUP_RUNS", "5"))
+
+COMMANDS = {
+    "app_stepwise --help": [sys.executable, "app_stepwise.py", "--help"],
+    "batch_runner --help": [sys.executable, "batch_runner.py", "--help"],
+    "import app_stepwise": [sys.executable, "-c", "import app_stepwise"],
+    "import call_computer_use": [sys.executable, "-c", "import call_computer_use"],
+}
+
+
+def time_command(command, runs):
+    """
+    Run command runs times and return the wall-clock durations in seconds.
+    Args:
+        command (list): The command line to run.
+        runs (int): Number of runs.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main(runs=DEFAULT_RUNS, import_time=False):
+    print(f"{'command':<28} {'median':>9} {'min':>9} {'max':>9}")
+    for name, command in COMMANDS.items():
+        durations = time_command(command, runs)
+        print(f"{name:<28} {statistics.median(durations) * 1000:>7.0f}ms {min(durations) * 1000:>7.0f}ms {max(durations) * 1000:>7.0f}ms")
+    if import_time:
+        # Per-module breakdown of the slowest imports (python -X importtime)
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app_stepwise"], capture_output=True, text=True)
+        rows = []
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                rows.append((int(parts[1]), parts[2].rstrip()))
+        print("\nSlowest imports for 'import app_stepwise' (cumulative):")
+        for cumulative, module in sorted(rows, reverse=True)[:15]:
+            print(f"{cumulative / 1000:>8.1f}ms {module}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure cold-start time of the pipeline entry points.')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Runs per command')
+    parser.add_argument('--import-time', action='store_true', help='Also print the slowest imports of app_stepwise')
+    args = parser.parse_args()
+    main(args.runs, args.import_time)
@@ -0,0 +1,53 @@
+# Procure-to-Pay Automation - Shared Browser Server
+# Runs one long-lived headless Chromium with the DevTools protocol enabled, so pipeline workers using the
+# 'remote_playwright' backend (COMPUTER_BACKEND=remote_playwright) attach to it and only create contexts.
+
+import os
+import signal
+import asyncio
+import subprocess
+from playwright.async_api import async_playwright
+
+
+async def get_chromium_executable():
+    async with async_playwright() as playwright:
+        return playwright.chromium.executable_path
+
+
+def serve(port: int, host: str = "127.0.0.1", headless: bool = True):
+    """Start Chromium listening for CDP connections and block until it exits or the server is stopped."""
+    executable = asyncio.run(get_chromium_executable())
+    args = [
+        executable,
+        f"--remote-debugging-port={port}",
+        f"--remote-debugging-address={host}",
+        f"--user-data-dir={os.path.abspath('.browser_server_profile')}",
+        "--disable-extensions",
+        "--disable-file-system",
+        "--no-first-run",
+        "--no-default-browser-check",
+    ]
+    if headless:
+        args.append("--headless=new")
+    process = subprocess.Popen(args)
+    print(f"Browser server running (pid {process.pid}). Set BROWSER_ENDPOINT=http://{host}:{port} and COMPUTER_BACKEND=remote_playwright")
+
+    def stop(signum, frame):
+        process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        process.wait()
+    except KeyboardInterrupt:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a shared Chromium instance that pipeline workers attach to over CDP.')
+    parser.add_argument('--port', type=int, default=9222, help='DevTools port')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Address to listen on')
+    parser.add_argument('--headful', action='store_true', help='Show the browser window')
+    args = parser.parse_args()
+    serve(args.port, host=args.host, headless=not args.headful)
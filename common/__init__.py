@@ -1,3 +1,24 @@
-from .computer import Computer
-from .local_playwright import LocalPlaywrightComputer
-from .utils import check_blocklisted_url
\ No newline at end of file
+import importlib
+
+# Exports are resolved on first access so that importing any common submodule (e.g. from a CLI
+# that only prints --help) does not pull in Playwright, the OpenAI SDK or PIL.
+_EXPORTS = {
+    "Computer": ".computer",
+    "BrowserComputer": ".computer",
+    "create_computer": ".backends",
+    "register_backend": ".backends",
+    "LocalPlaywrightComputer": ".local_playwright",
+    "check_blocklisted_url": ".utils",
+    "InvoiceStateStore": ".state_store",
+    "get_client": ".clients",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,46 @@
+import os
+
+# Backend used by create_computer when none is named
+DEFAULT_BACKEND = os.getenv("COMPUTER_BACKEND", "local_playwright")
+
+_BACKENDS = {}
+
+
+def register_backend(name: str, factory):
+    """
+    Register a Computer backend.
+    Args:
+        name (str): Backend name, selectable through COMPUTER_BACKEND.
+        factory: Callable returning an async context manager that implements common.computer.Computer.
+            It is called with the task's keyword options (profile, session_app, ...) and may ignore
+            options that don't apply to it.
+    """
+    _BACKENDS[name] = factory
+
+
+def available_backends():
+    return sorted(_BACKENDS)
+
+
+def create_computer(backend: str = None, **options):
+    """Create a computer from the named (or default) backend."""
+    name = backend or DEFAULT_BACKEND
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown computer backend '{name}'. Available: {', '.join(available_backends())}")
+    return _BACKENDS[name](**options)
+
+
+def _local_playwright(**options):
+    from .local_playwright import LocalPlaywrightComputer
+
+    return LocalPlaywrightComputer(**options)
+
+
+def _remote_playwright(**options):
+    from .remote_playwright import RemotePlaywrightComputer
+
+    return RemotePlaywrightComputer(**options)
+
+
+register_backend("local_playwright", _local_playwright)
+register_backend("remote_playwright", _remote_playwright)
@@ -0,0 +1,185 @@
+import os
+import json
+import uuid
+import shutil
+import asyncio
+
+# Batch backend used by offline_batch.py: "openai" (the service's batch API) or "local" (in-process stand-in)
+OFFLINE_BATCH_BACKEND = os.getenv("OFFLINE_BATCH_BACKEND", "openai")
+OFFLINE_BATCH_DIR = os.getenv("OFFLINE_BATCH_DIR", ".offline_batches")
+OFFLINE_BATCH_ENDPOINT = os.getenv("OFFLINE_BATCH_ENDPOINT", "/v1/responses")
+OFFLINE_BATCH_COMPLETION_WINDOW = os.getenv("OFFLINE_BATCH_COMPLETION_WINDOW", "24h")
+# Requests the local stand-in sends concurrently per job
+LOCAL_BATCH_CONCURRENCY = int(os.getenv("LOCAL_BATCH_CONCURRENCY", "4"))
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_line(custom_id: str, request: dict, endpoint: str = OFFLINE_BATCH_ENDPOINT) -> dict:
+    """One request of a batch input file."""
+    return {"custom_id": custom_id, "method": "POST", "url": endpoint, "body": request}
+
+
+def write_batch_file(lines, path: str) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as batch_file:
+        for line in lines:
+            batch_file.write(json.dumps(line) + "\n")
+    return path
+
+
+def parse_result_line(line: dict):
+    """
+    Split one line of a batch output (or error) file.
+    Returns:
+        tuple: (custom_id, Response or None, error message or None).
+    """
+    from openai.types.responses import Response
+
+    custom_id = line.get("custom_id")
+    response = line.get("response") or {}
+    if line.get("error"):
+        error = line["error"]
+        return custom_id, None, error.get("message", str(error)) if isinstance(error, dict) else str(error)
+    if response.get("status_code") != 200:
+        body = response.get("body") or {}
+        message = (body.get("error") or {}).get("message") if isinstance(body, dict) else None
+        return custom_id, None, f"HTTP {response.get('status_code')}: {message or body}"
+    try:
+        return custom_id, Response.model_validate(response["body"]), None
+    except Exception as e:
+        return custom_id, None, f"Unreadable response body: {e}"
+
+
+class OpenAIBatchBackend:
+    """Submits batch files to the (Azure) OpenAI batch API."""
+
+    name = "openai"
+
+    def __init__(self, client=None, endpoint: str = OFFLINE_BATCH_ENDPOINT, completion_window: str = OFFLINE_BATCH_COMPLETION_WINDOW):
+        if client is None:
+            from .clients import get_client
+
+            client = get_client()
+        self.client = client
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+
+    def _submit(self, path):
+        with open(path, "rb") as batch_file:
+            input_file = self.client.files.create(file=batch_file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=self.endpoint, completion_window=self.completion_window
+        )
+        return batch.id
+
+    async def submit(self, path: str) -> str:
+        """Upload a batch input file and start the job. Returns the job id."""
+        return await asyncio.to_thread(self._submit, path)
+
+    async def status(self, job_id: str) -> str:
+        batch = await asyncio.to_thread(self.client.batches.retrieve, job_id)
+        return batch.status
+
+    def _results(self, job_id):
+        batch = self.client.batches.retrieve(job_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self.client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return lines
+
+    async def results(self, job_id: str) -> list:
+        """Return the output and error lines of a finished job."""
+        return await asyncio.to_thread(self._results, job_id)
+
+
+class LocalBatchBackend:
+    """
+    Local stand-in for the batch API, for testing offline runs without a batch deployment. Each job's requests are
+    sent through create_response in the background (so the rate limiter and MODEL_CACHE_MODE apply, and replay
+    mode runs fully offline); job files and status live in OFFLINE_BATCH_DIR/local/<job id>.
+    """
+
+    name = "local"
+
+    def __init__(self, client=None, directory: str = os.path.join(OFFLINE_BATCH_DIR, "local"), concurrency: int = LOCAL_BATCH_CONCURRENCY):
+        self.client = client
+        self.directory = directory
+        self.concurrency = concurrency
+        self._tasks = {}
+
+    def _job_path(self, job_id, name):
+        return os.path.join(self.directory, job_id, name)
+
+    async def submit(self, path: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.directory, job_id))
+        shutil.copyfile(path, self._job_path(job_id, "input.jsonl"))
+        self._write_status(job_id, "in_progress")
+        self._start(job_id)
+        return job_id
+
+    def _write_status(self, job_id, status):
+        with open(self._job_path(job_id, "status"), "w", encoding="utf-8") as status_file:
+            status_file.write(status)
+
+    def _start(self, job_id):
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def _run(self, job_id):
+        from .clients import get_client
+        from .model_calls import create_response
+
+        client = self.client or get_client()
+        with open(self._job_path(job_id, "input.jsonl"), "r", encoding="utf-8") as input_file:
+            requests = [json.loads(line) for line in input_file if line.strip()]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(request):
+            async with semaphore:
+                try:
+                    # custom ids are "<stage>:<invoice key>"
+                    stage = request["custom_id"].split(":", 1)[0]
+                    response = await create_response(client, stage=stage, **request["body"])
+                    return {
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": response.model_dump(mode="json")},
+                        "error": None,
+                    }
+                except Exception as e:
+                    return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+
+        lines = await asyncio.gather(*(run_one(request) for request in requests))
+        write_batch_file(lines, self._job_path(job_id, "output.jsonl"))
+        self._write_status(job_id, "completed")
+
+    async def status(self, job_id: str) -> str:
+        try:
+            with open(self._job_path(job_id, "status"), "r", encoding="utf-8") as status_file:
+                status = status_file.read().strip()
+        except FileNotFoundError:
+            return "expired"
+        if status == "in_progress" and job_id not in self._tasks:
+            # The process that ran the job stopped; pick it up again
+            self._start(job_id)
+        return status
+
+    async def results(self, job_id: str) -> list:
+        with open(self._job_path(job_id, "output.jsonl"), "r", encoding="utf-8") as output_file:
+            return [json.loads(line) for line in output_file if line.strip()]
+
+
+BATCH_BACKENDS = {
+    "openai": OpenAIBatchBackend,
+    "local": LocalBatchBackend,
+}
+
+
+def get_batch_backend(name: str = None, **options):
+    """Create the batch backend registered under name (default OFFLINE_BATCH_BACKEND)."""
+    name = name or OFFLINE_BATCH_BACKEND
+    if name not in BATCH_BACKENDS:
+        raise ValueError(f"Unknown batch backend '{name}'. Available: {', '.join(BATCH_BACKENDS)}")
+    return BATCH_BACKENDS[name](**options)
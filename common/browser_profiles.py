@@ -0,0 +1,43 @@
+import os
+from dataclasses import dataclass, replace
+
+
+@dataclass(frozen=True)
+class BrowserProfile:
+    """Launch and context settings for a browser session."""
+
+    headless: bool = True
+    # "new" runs the full Chromium build headless; "shell" uses the lighter chromium-headless-shell
+    headless_mode: str = "new"
+    viewport: tuple = (1024, 768)
+    device_scale_factor: float = 1.0
+    # Abort image and font requests; only for tasks that read the DOM rather than screenshots
+    block_images: bool = False
+    block_fonts: bool = False
+    reduced_motion: bool = True
+    # Name of the request routing rules in common/request_routing.py
+    route_rules: str = "default"
+
+
+PROFILES = {
+    # Headful browser on the local display, for watching a run
+    "interactive": BrowserProfile(headless=False, reduced_motion=False),
+    # Headless browser for unattended runs; screenshots render exactly as in the interactive profile
+    "batch": BrowserProfile(),
+    # Headless browser without images and web fonts, for DOM-only extraction
+    "dom_extraction": BrowserProfile(block_images=True, block_fonts=True, route_rules="dom_extraction"),
+}
+
+DEFAULT_PROFILE = os.getenv("BROWSER_PROFILE", "batch")
+
+
+def get_profile(profile=None, **overrides) -> BrowserProfile:
+    """Resolve a profile name (or BrowserProfile) to a BrowserProfile, applying any field overrides."""
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown browser profile '{profile}'. Available: {', '.join(PROFILES)}")
+        profile = PROFILES[profile]
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    return replace(profile, **overrides) if overrides else profile
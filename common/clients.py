@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+# The background thread refreshes the token this long before it expires
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# A request only waits for a token when the cached one is missing or about to expire
+TOKEN_MIN_VALIDITY_SECONDS = 30
+TOKEN_RETRY_SECONDS = 15
+
+_lock = threading.Lock()
+_credential = None
+_token_manager = None
+_clients = {}
+# Client returned by get_client for every endpoint, e.g. the soak test's client for the stand-in model server
+_pinned_client = None
+
+
+def get_credential():
+    """Return the shared DefaultAzureCredential, creating it on first use."""
+    global _credential
+    with _lock:
+        if _credential is None:
+            from azure.identity import DefaultAzureCredential
+
+            _credential = DefaultAzureCredential()
+        return _credential
+
+
+class TokenManager:
+    """
+    Caches the AAD access token for a scope and refreshes it in a background thread before it expires,
+    so model calls read a ready token instead of acquiring one on the request path.
+    """
+
+    def __init__(self, scope: str = COGNITIVE_SERVICES_SCOPE, refresh_margin: float = TOKEN_REFRESH_MARGIN_SECONDS, seed=None):
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        # (token, expires_on) with expires_on in epoch seconds
+        self._token = tuple(seed) if seed else None
+        self._fetch_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.refreshes = 0
+        self.inline_fetches = 0
+
+    def _expires_in(self) -> float:
+        token = self._token
+        return token[1] - time.time() if token else float("-inf")
+
+    def _fetch(self):
+        with self._fetch_lock:
+            access_token = get_credential().get_token(self.scope)
+            self._token = (access_token.token, access_token.expires_on)
+            self.refreshes += 1
+
+    def get_token(self) -> str:
+        """Return a valid token. Usable directly as an azure_ad_token_provider."""
+        if self._expires_in() < TOKEN_MIN_VALIDITY_SECONDS:
+            # Cold start, or the background refresh has been failing
+            with self._fetch_lock:
+                if self._expires_in() < TOKEN_MIN_VALIDITY_SECONDS:
+                    self.inline_fetches += 1
+                    self._fetch()
+        self.start()
+        return self._token[0]
+
+    def snapshot(self):
+        """Return the cached (token, expires_on), e.g. to seed the token managers of worker processes."""
+        return self._token
+
+    def start(self):
+        """Start the background refresh thread; fetches the first token right away if none is cached."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        with _lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="aad-token-refresh", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            delay = self._expires_in() - self.refresh_margin
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            try:
+                self._fetch()
+                if self._expires_in() - self.refresh_margin <= 0:
+                    # Short-lived token: refresh when half of its remaining lifetime has passed
+                    self._wakeup.wait(max(TOKEN_RETRY_SECONDS, self._expires_in() / 2))
+            except Exception as e:
+                print(f"AAD token refresh failed ({type(e).__name__}: {e}); retrying in {TOKEN_RETRY_SECONDS}s")
+                self._wakeup.wait(TOKEN_RETRY_SECONDS)
+
+
+def get_token_manager(seed=None) -> TokenManager:
+    """
+    Return the process-wide token manager shared by every client.
+    Args:
+        seed (tuple): Optional (token, expires_on) fetched by another process, used until the first refresh.
+    """
+    global _token_manager
+    with _lock:
+        if _token_manager is None:
+            _token_manager = TokenManager(seed=seed)
+        return _token_manager
+
+
+def get_token_provider():
+    """Return the shared bearer token provider for Azure OpenAI."""
+    return get_token_manager().get_token
+
+
+def uses_aad_token() -> bool:
+    """False when model calls authenticate with AZURE_OPENAI_API_KEY or are replayed from the response cache."""
+    return not os.getenv("AZURE_OPENAI_API_KEY") and os.getenv("MODEL_CACHE_MODE") != "replay"
+
+
+def pin_client(client):
+    """Make get_client return client for any endpoint from now on (None unpins)."""
+    global _pinned_client
+    _pinned_client = client
+
+
+def get_client(endpoint: str = None, api_version: str = None):
+    """
+    Return a shared AzureOpenAI client, constructed on first use.
+    The credential chain is only probed when the first token is needed, so importing the pipeline
+    modules stays fast and does not touch the network. All clients share one token manager, unless
+    AZURE_OPENAI_API_KEY is set (e.g. for the local stand-in model server), in which case it is used instead.
+    Args:
+        endpoint (str): Azure OpenAI endpoint; defaults to AZURE_OPENAI_ENDPOINT.
+        api_version (str): API version; defaults to AZURE_API_VERSION.
+    """
+    if _pinned_client is not None:
+        return _pinned_client
+    endpoint = endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_version = api_version or os.getenv("AZURE_API_VERSION")
+    key = (endpoint, api_version)
+    if key not in _clients:
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        auth = {"api_key": api_key} if api_key else {"azure_ad_token_provider": get_token_provider()}
+        from openai import AzureOpenAI
+
+        with _lock:
+            if key not in _clients:
+                _clients[key] = AzureOpenAI(
+                    azure_endpoint=endpoint,
+                    **auth,
+                    api_version=api_version,
+                    # Retries are handled by common.model_calls.create_response
+                    max_retries=0,
+                )
+    return _clients[key]
@@ -2,29 +2,53 @@ from typing import Protocol, List, Literal, Dict
 
 
 class Computer(Protocol):
-    """Defines the 'shape' (methods/properties) our loop expects."""
+    """Defines the 'shape' (methods/properties) our loop expects. Every action is a coroutine."""
 
     @property
     def environment(self) -> Literal["windows", "mac", "linux", "browser"]: ...
     @property
     def dimensions(self) -> tuple[int, int]: ...
 
-    def screenshot(self) -> str: ...
+    async def screenshot(self) -> bytes: ...
 
-    def click(self, x: int, y: int, button: str = "left") -> None: ...
+    async def click(self, x: int, y: int, button: str = "left") -> None: ...
 
-    def double_click(self, x: int, y: int) -> None: ...
+    async def double_click(self, x: int, y: int) -> None: ...
 
-    def scroll(self, x: int, y: int, scroll_x: int, scroll_y: int) -> None: ...
+    async def scroll(self, x: int, y: int, scroll_x: int, scroll_y: int) -> None: ...
 
-    def type(self, text: str) -> None: ...
+    async def type(self, text: str) -> None: ...
 
-    def wait(self, ms: int = 1000) -> None: ...
+    async def wait(self, ms: int = 1000) -> None: ...
 
-    def move(self, x: int, y: int) -> None: ...
+    async def move(self, x: int, y: int) -> None: ...
 
-    def keypress(self, keys: List[str]) -> None: ...
+    async def keypress(self, keys: List[str]) -> None: ...
 
-    def drag(self, path: List[Dict[str, int]]) -> None: ...
+    async def drag(self, path: List[Dict[str, int]]) -> None: ...
 
-    def get_current_url() -> str: ...
\ No newline at end of file
+    async def get_current_url(self) -> str: ...
+
+
+class BrowserComputer(Computer, Protocol):
+    """A Computer driving a browser page, with the navigation and DOM helpers the pipeline uses."""
+
+    async def goto(self, url: str) -> None: ...
+
+    async def wait_for_load_state(self) -> bool: ...
+
+    async def evaluate(self, js_expression: str, arg=None): ...
+
+    async def click_selector(self, selector: str) -> bool: ...
+
+    async def fill(self, selector: str, text: str) -> bool: ...
+
+    async def clear_and_type(self, selector: str, text: str) -> bool: ...
+
+    async def focus_and_type(self, x: int, y: int, text: str) -> bool: ...
+
+    async def open_page(self): ...
+
+    def page_view(self, page) -> "BrowserComputer": ...
+
+    async def screenshot_tiles(self, overlap: int = 120, max_tiles: int = 8) -> List[bytes]: ...
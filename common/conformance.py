@@ -0,0 +1,123 @@
+"""
+Conformance checks for Computer backends.
+
+Drives a backend through every action of the async Computer protocol against a self-contained test page
+and verifies the page observed each action. Run it against a registered backend with:
+
+    python -m common.conformance [backend]
+"""
+
+import asyncio
+import inspect
+import sys
+from urllib.parse import quote
+
+from .backends import DEFAULT_BACKEND, create_computer
+
+PROTOCOL_METHODS = [
+    "screenshot", "click", "double_click", "scroll", "type", "wait", "move", "keypress", "drag", "get_current_url",
+]
+
+# Records every event the actions should produce into window.events
+TEST_PAGE = """<!doctype html>
+<html><body style="margin:0;height:3000px">
+<input id="field" style="position:absolute;left:10px;top:10px;width:300px;height:30px">
+<div id="target" style="position:absolute;left:10px;top:60px;width:200px;height:100px;background:#ccc"></div>
+<script>
+window.events = [];
+const target = document.getElementById('target');
+target.addEventListener('click', () => events.push('click'));
+target.addEventListener('dblclick', () => events.push('dblclick'));
+target.addEventListener('contextmenu', (e) => { e.preventDefault(); events.push('rightclick'); });
+document.addEventListener('mousemove', (e) => { if (e.clientX === 400 && e.clientY === 400) events.push('move'); });
+target.addEventListener('mousedown', () => events.push('mousedown'));
+document.addEventListener('mouseup', (e) => { if (e.clientX === 300) events.push('dragend'); });
+document.addEventListener('keydown', (e) => { if (e.key === 'Enter') events.push('enter'); if (e.ctrlKey && e.key.toLowerCase() === 'a') events.push('ctrl+a'); });
+</script>
+</body></html>"""
+
+
+async def _events(computer):
+    return await computer.evaluate("window.events")
+
+
+async def check_conformance(computer) -> list:
+    """
+    Exercise every Computer protocol action. The computer must already be entered (async with).
+    Returns:
+        list[str]: Descriptions of the failed checks; empty when the backend conforms.
+    """
+    failures = []
+    for name in PROTOCOL_METHODS:
+        if not inspect.iscoroutinefunction(getattr(computer, name, None)):
+            failures.append(f"{name} is missing or not a coroutine function")
+    if getattr(computer, "environment", None) not in ("windows", "mac", "linux", "browser"):
+        failures.append("environment is not one of windows/mac/linux/browser")
+    if len(tuple(getattr(computer, "dimensions", ()))) != 2:
+        failures.append("dimensions is not a (width, height) pair")
+    if failures:
+        return failures
+
+    await computer.goto("data:text/html," + quote(TEST_PAGE))
+    shot = await computer.screenshot()
+    if not isinstance(shot, (bytes, bytearray)) or not shot.startswith(b"\x89PNG"):
+        failures.append("screenshot did not return PNG bytes")
+    if hasattr(computer, "screenshot_tiles"):
+        # The 3000px test page needs several viewport-high tiles
+        tiles = await computer.screenshot_tiles(overlap=100, max_tiles=10)
+        if len(tiles) < 3000 // computer.dimensions[1] or not all(tile.startswith(b"\x89PNG") for tile in tiles):
+            failures.append("screenshot_tiles did not cover the full page with PNG tiles")
+    if not (await computer.get_current_url()).startswith("data:text/html"):
+        failures.append("get_current_url did not return the page URL")
+
+    checks = [
+        ("click", lambda: computer.click(50, 100), "click"),
+        ("click(button='right')", lambda: computer.click(50, 100, "right"), "rightclick"),
+        ("double_click", lambda: computer.double_click(50, 100), "dblclick"),
+        ("move", lambda: computer.move(400, 400), "move"),
+        ("drag", lambda: computer.drag([{"x": 50, "y": 100}, {"x": 200, "y": 200}, {"x": 300, "y": 200}]), "dragend"),
+    ]
+    for label, action, expected in checks:
+        await action()
+        if expected not in await _events(computer):
+            failures.append(f"{label} was not observed by the page")
+
+    await computer.click(50, 25)
+    await computer.type("hello")
+    await computer.keypress(["CTRL", "A"])
+    await computer.keypress(["ENTER"])
+    if await computer.evaluate("document.getElementById('field').value") != "hello":
+        failures.append("type did not enter text into the focused field")
+    events = await _events(computer)
+    if "ctrl+a" not in events:
+        failures.append("keypress did not hold modifiers for a chord")
+    if "enter" not in events:
+        failures.append("keypress did not map CUA key names")
+
+    await computer.scroll(100, 100, 0, 500)
+    if await computer.evaluate("window.scrollY") < 400:
+        failures.append("scroll did not scroll the page")
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await computer.wait(200)
+    if loop.time() - started < 0.15:
+        failures.append("wait returned before the requested time")
+    return failures
+
+
+async def run(backend: str = None) -> int:
+    async with create_computer(backend, profile="batch") as computer:
+        failures = await check_conformance(computer)
+    name = backend or DEFAULT_BACKEND
+    if failures:
+        print(f"Backend '{name}' failed {len(failures)} conformance checks:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print(f"Backend '{name}' conforms to the Computer protocol.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(sys.argv[1] if len(sys.argv) > 1 else None)))
@@ -1,71 +1,328 @@
-from playwright.async_api import async_playwright, Browser, Page
 import asyncio
+import contextlib
+import copy
+import os
+from urllib.parse import urlparse
+
+from .browser_profiles import get_profile
+from .memory import track_computer
+from .request_routing import StaticAssetCache, STATIC_CACHE_TTL_SECONDS, get_route_rules, route_request
+from .session_state import StorageStateStore
+
+# Key names used by the computer-use model mapped to Playwright key names
+CUA_KEY_TO_PLAYWRIGHT_KEY = {
+    "/": "Divide",
+    "\\": "Backslash",
+    "alt": "Alt",
+    "arrowdown": "ArrowDown",
+    "arrowleft": "ArrowLeft",
+    "arrowright": "ArrowRight",
+    "arrowup": "ArrowUp",
+    "backspace": "Backspace",
+    "capslock": "CapsLock",
+    "cmd": "Meta",
+    "ctrl": "Control",
+    "delete": "Delete",
+    "end": "End",
+    "enter": "Enter",
+    "esc": "Escape",
+    "home": "Home",
+    "insert": "Insert",
+    "option": "Alt",
+    "pagedown": "PageDown",
+    "pageup": "PageUp",
+    "shift": "Shift",
+    "space": " ",
+    "super": "Meta",
+    "tab": "Tab",
+    "win": "Meta",
+}
+# Full scrollable height of the page in CSS pixels
+PAGE_HEIGHT_SCRIPT = "Math.max(document.documentElement.scrollHeight, document.body ? document.body.scrollHeight : 0)"
+
+
+def playwright_key(key: str) -> str:
+    """
+    Map a CUA key name to a Playwright key. CUA sends letters upper case ("CTRL", "A"); they are pressed as the
+    lower-case key, since Playwright would otherwise report the shifted "A" and chords like Ctrl+A would not match.
+    """
+    if key.lower() in CUA_KEY_TO_PLAYWRIGHT_KEY:
+        return CUA_KEY_TO_PLAYWRIGHT_KEY[key.lower()]
+    return key.lower() if len(key) == 1 else key
+
 
 class LocalPlaywrightComputer:
     """Launches a local Chromium instance using Playwright async API."""
 
-    def __init__(self, headless: bool = False):
+    # Whether the browser is shared with other sessions (then only this session's context is ours to close)
+    shares_browser = False
+
+    def __init__(self, headless: bool = None, profile=None, route_rules=None, session_app: str = None):
         self._playwright = None
         self._browser = None
         self._page = None
-        self.headless = headless
+        # Browser settings come from a named profile (headless 'batch' by default); headless overrides it
+        self.profile = get_profile(profile, headless=headless)
+        self.headless = self.profile.headless
         self.environment = "browser"
-        self.dimensions = (1024, 768)
+        self.dimensions = tuple(self.profile.viewport)
+        # Per-task allow/deny rules for every request; defaults to the profile's rules
+        rules = get_route_rules(route_rules or self.profile.route_rules)
+        if self.profile.block_images:
+            rules = rules.blocking("image")
+        if self.profile.block_fonts:
+            rules = rules.blocking("font")
+        self.route_rules = rules
+        self._asset_cache = None
+        # Storage state (cookies, local storage) is reused per target app host so sessions start authenticated
+        self.session_app = session_app
+        self.auth_expired = False
+        self._session_store = StorageStateStore() if session_app else None
+        self._context = None
+        # Pages opened through open_page() are worked on in parallel and must not take over self._page
+        self._opening_pages = 0
+        # (target, event, handler) of every registered event handler, removed again when the context closes
+        self._listeners = []
+        self._on_page_close = self._handle_page_close
+        # Set on views created by page_view(); a view cannot relaunch the browser it shares
+        self._view_of = None
 
     async def __aenter__(self):
-        # Start Playwright and get browser/page
+        # Start Playwright and get browser/page; imported here so importing this module stays cheap
+        from playwright.async_api import async_playwright
+
         self._playwright = await async_playwright().start()
         await self._get_browser_and_page()
+        track_computer(self)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self._browser:
-            await self._browser.close()
+        await self._save_session()
+        await self._close_browser()
+        self._release_context()
         if self._playwright:
             await self._playwright.stop()
 
-    async def _get_browser_and_page(self):
+    async def _save_session(self):
+        if self._session_store and self._context and not self.auth_expired:
+            try:
+                await self._session_store.save(self._context, self.session_app)
+            except Exception as e:
+                print(f"Saving browser session for {self.session_app} failed: {e}")
+
+    def _listen(self, target, event, handler):
+        """Register an event handler that is removed again when the context is released."""
+        target.on(event, handler)
+        self._listeners.append((target, event, handler))
+
+    def _unlisten(self, target):
+        """Remove every handler registered on target."""
+        for listener in [listener for listener in self._listeners if listener[0] is target]:
+            with contextlib.suppress(Exception):
+                target.remove_listener(listener[1], listener[2])
+            self._listeners.remove(listener)
+
+    def _release_context(self):
+        """Drop the handlers and references to a closed context so its pages can be freed."""
+        for target in {id(listener[0]): listener[0] for listener in self._listeners}.values():
+            self._unlisten(target)
+        self._context = None
+        self._page = None
+
+    async def _close_browser(self):
+        if self._browser:
+            await self._browser.close()
+
+    async def _launch_browser(self):
         width, height = self.dimensions
         launch_args = [f"--window-size={width},{height}", "--disable-extensions", "--disable-file-system"]
-        self._browser = await self._playwright.chromium.launch(
-            headless=self.headless,
-            args=launch_args,
-            env={"DISPLAY": ":0"}
+        launch_options = {"headless": self.headless, "args": launch_args}
+        if self.headless:
+            if self.profile.headless_mode == "new":
+                # The full Chromium build runs in new headless mode; the default is the headless shell
+                launch_options["channel"] = "chromium"
+        else:
+            # A headful browser needs a display; keep the rest of the environment intact
+            launch_options["env"] = {**os.environ, "DISPLAY": os.environ.get("DISPLAY", ":0")}
+        self._browser = await self._playwright.chromium.launch(**launch_options)
+
+    async def _get_browser_and_page(self):
+        await self._launch_browser()
+        await self._open_context()
+
+    async def _open_context(self):
+        width, height = self.dimensions
+        storage_state = self._session_store.load(self.session_app) if self._session_store else None
+        context = await self._browser.new_context(
+            viewport={"width": width, "height": height},
+            device_scale_factor=self.profile.device_scale_factor,
+            reduced_motion="reduce" if self.profile.reduced_motion else "no-preference",
+            storage_state=storage_state,
         )
-        
-        context = await self._browser.new_context()
-        
+        self._context = context
+        if self._session_store:
+            self._listen(context, "response", self._handle_response)
+        # Requests are filtered (including the domain blocklist) before they leave the browser
+        if self.route_rules.cache_static_assets and STATIC_CACHE_TTL_SECONDS > 0:
+            self._asset_cache = StaticAssetCache()
+        await context.route("**/*", self._route_request)
+
         # Add event listeners for page creation and closure
-        context.on("page", self._handle_new_page)
-        
+        self._listen(context, "page", self._handle_new_page)
+
         self._page = await context.new_page()
-        await self._page.set_viewport_size({"width": width, "height": height})
-        self._page.on("close", self._handle_page_close)
+        self._listen(self._page, "close", self._on_page_close)
 
         # Initialize with a blank page instead of hardcoding a specific URL
         await self._page.goto("about:blank")
+
+    async def _route_request(self, route):
+        await route_request(route, self.route_rules, self._asset_cache)
+
+    def _handle_response(self, response):
+        """Detect an expired session: a 401 from the target app drops the saved state so the next session signs in again."""
+        if response.status != 401 or self.auth_expired:
+            return
+        if urlparse(response.url).hostname != self.session_app:
+            return
+        print(f"Session for {self.session_app} is no longer authenticated (401); discarding saved state.")
+        self.auth_expired = True
+        self._session_store.invalidate(self.session_app)
         
     def _handle_new_page(self, page):
-        """Handle the creation of a new page."""
+        """Handle the creation of a new page (e.g. a popup opened by the active page)."""
         print("New page created")
-        self._page = page
-        page.on("close", self._handle_page_close)
-        
+        if self._opening_pages == 0:
+            self._page = page
+        self._listen(page, "close", self._on_page_close)
+
     def _handle_page_close(self, page):
         """Handle the closure of a page."""
         print("Page closed")
+        self._unlisten(page)
         if self._page == page:
-            if self._browser.contexts[0].pages:
-                self._page = self._browser.contexts[0].pages[-1]
+            if self._context and self._context.pages:
+                self._page = self._context.pages[-1]
             else:
                 print("Warning: All pages have been closed.")
                 self._page = None
+
+    async def open_page(self):
+        """Open an additional page in this session's context without making it the active page."""
+        self._opening_pages += 1
+        try:
+            return await self._context.new_page()
+        finally:
+            self._opening_pages -= 1
+
+    def page_view(self, page):
+        """Return a computer that shares this session but performs every action on the given page.
+        Used to work on several pages of one context concurrently; the view is not entered or exited itself."""
+        view = copy.copy(self)
+        view._page = page
+        view._view_of = self
+        return view
+
+    async def recycle(self) -> bool:
+        """
+        Relaunch the browser (attached to a shared browser: reopen this session's context) to release the
+        memory it has accumulated, and return to the current page. The session state is saved and restored.
+        Returns:
+            bool: False for views, which share their session's browser and cannot recycle it.
+        """
+        if self._view_of is not None:
+            return False
+        url = await self.get_current_url()
+        await self._save_session()
+        await self._close_browser()
+        self._release_context()
+        if not self.shares_browser:
+            await self._launch_browser()
+        await self._open_context()
+        if url and url != "about:blank":
+            await self._page.goto(url)
+        return True
     
     async def screenshot(self):
         """Capture screenshot of the current page."""
         return await self._page.screenshot(full_page=False)
-    
-    async def click(self, selector):
+
+    async def screenshot_tiles(self, overlap: int = 120, max_tiles: int = 8):
+        """
+        Capture the full page as viewport-sized PNG tiles, top to bottom, without scrolling the page.
+        Consecutive tiles overlap by overlap pixels so rows cut at a tile edge appear whole in one of them.
+        Args:
+            overlap (int): Vertical overlap between tiles in pixels.
+            max_tiles (int): Upper bound on the number of tiles; content below the last tile is not captured.
+        Returns:
+            list[bytes]: The tiles.
+        """
+        width, height = self.dimensions
+        page_height = await self._page.evaluate(PAGE_HEIGHT_SCRIPT)
+        step = max(1, height - overlap)
+        tiles = []
+        top = 0
+        while len(tiles) < max_tiles:
+            clip = {"x": 0, "y": top, "width": width, "height": min(height, max(1, page_height - top))}
+            tiles.append(await self._page.screenshot(clip=clip, full_page=True))
+            if top + height >= page_height:
+                break
+            top += step
+        return tiles
+
+    # --- Computer protocol actions (coordinates are viewport pixels) ---
+
+    async def click(self, x: int, y: int, button: str = "left") -> None:
+        """Click at coordinates; 'back'/'forward' navigate history and 'wheel' scrolls."""
+        if button == "back":
+            await self._page.go_back()
+        elif button == "forward":
+            await self._page.go_forward()
+        elif button == "wheel":
+            await self._page.mouse.wheel(x, y)
+        else:
+            await self._page.mouse.click(x, y, button={"right": "right", "middle": "middle"}.get(button, "left"))
+
+    async def double_click(self, x: int, y: int) -> None:
+        await self._page.mouse.dblclick(x, y)
+
+    async def scroll(self, x: int, y: int, scroll_x: int, scroll_y: int) -> None:
+        await self._page.mouse.move(x, y)
+        await self._page.evaluate("([dx, dy]) => window.scrollBy(dx, dy)", [scroll_x, scroll_y])
+
+    async def type(self, text: str) -> None:
+        await self._page.keyboard.type(text)
+
+    async def wait(self, ms: int = 1000) -> None:
+        await asyncio.sleep(ms / 1000)
+
+    async def move(self, x: int, y: int) -> None:
+        await self._page.mouse.move(x, y)
+
+    async def keypress(self, keys) -> None:
+        """Press a key or chord, e.g. ["CTRL", "A"]; modifiers are held while the last key is pressed."""
+        mapped = [playwright_key(key) for key in keys]
+        for key in mapped[:-1]:
+            await self._page.keyboard.down(key)
+        await self._page.keyboard.press(mapped[-1])
+        for key in reversed(mapped[:-1]):
+            await self._page.keyboard.up(key)
+
+    async def drag(self, path) -> None:
+        if not path:
+            return
+        await self._page.mouse.move(path[0]["x"], path[0]["y"])
+        await self._page.mouse.down()
+        for point in path[1:]:
+            await self._page.mouse.move(point["x"], point["y"])
+        await self._page.mouse.up()
+
+    async def get_current_url(self) -> str:
+        return self._page.url if self._page else ""
+
+    # --- Selector-based helpers ---
+
+    async def click_selector(self, selector):
         """Click on an element matching the selector."""
         try:
             # Wait for the element to be visible and enabled before clicking
@@ -137,9 +394,9 @@ class LocalPlaywrightComputer:
         """Navigate to a URL."""
         await self._page.goto(url)
         
-    async def evaluate(self, js_expression):
+    async def evaluate(self, js_expression, arg=None):
         """Execute JavaScript in the browser context."""
-        return await self._page.evaluate(js_expression)
+        return await self._page.evaluate(js_expression, arg)
     
     async def wait_for_load_state(self):
         """Wait for the page to reach a stable load state."""
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import weakref
+import tracemalloc
+
+# Take a tracemalloc snapshot after every invoice and report the allocation sites that grew
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "false").lower() in ("1", "true", "yes")
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "5"))
+MEMORY_TOP_ALLOCATORS = int(os.getenv("MEMORY_TOP_ALLOCATORS", "10"))
+# Optional JSONL file receiving every memory sample
+MEMORY_REPORT_PATH = os.getenv("MEMORY_REPORT_PATH")
+# Screenshots kept in a CUA conversation; older ones are replaced by a placeholder (0 keeps all)
+CUA_MAX_SCREENSHOTS = int(os.getenv("CUA_MAX_SCREENSHOTS", "0"))
+# Chromium RSS of this process's browsers above which a CUA loop relaunches its browser (0 disables)
+BROWSER_MAX_RSS_MB = float(os.getenv("BROWSER_MAX_RSS_MB", "0"))
+
+# 1x1 PNG standing in for evicted screenshots, so computer_call_output items keep their shape
+PLACEHOLDER_IMAGE_URL = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+CHROMIUM_PROCESS_NAMES = ("chrome", "chromium", "headless_shell")
+MB = 1024 * 1024
+
+# Live CUA loops and browser sessions, for the samples
+_guards = weakref.WeakSet()
+_computers = weakref.WeakSet()
+# Running totals over the life of the process
+_totals = {"screenshots_evicted": 0, "bytes_evicted": 0, "browser_recycles": 0}
+
+
+def _screenshot_holders(items):
+    """Yield the dicts in a CUA conversation whose image_url holds a screenshot, oldest first."""
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        output = item.get("output")
+        if item.get("type") == "computer_call_output" and isinstance(output, dict):
+            if str(output.get("image_url", "")).startswith("data:image"):
+                yield output
+        elif isinstance(item.get("content"), list):
+            for part in item["content"]:
+                if isinstance(part, dict) and part.get("type") == "input_image" and str(part.get("image_url", "")).startswith("data:image"):
+                    yield part
+
+
+def screenshot_stats(items):
+    """Return (count, bytes) of the screenshots retained in a CUA conversation, placeholders excluded."""
+    count = size = 0
+    for holder in _screenshot_holders(items):
+        if holder["image_url"] != PLACEHOLDER_IMAGE_URL:
+            count += 1
+            size += len(holder["image_url"])
+    return count, size
+
+
+def evict_screenshots(items, keep: int):
+    """
+    Replace all but the newest keep screenshots in a CUA conversation with a placeholder image.
+    Returns:
+        tuple: (screenshots evicted, bytes freed).
+    """
+    holders = [holder for holder in _screenshot_holders(items) if holder["image_url"] != PLACEHOLDER_IMAGE_URL]
+    evicted = freed = 0
+    for holder in holders[:max(0, len(holders) - keep)]:
+        freed += len(holder["image_url"])
+        holder["image_url"] = PLACEHOLDER_IMAGE_URL
+        evicted += 1
+    _totals["screenshots_evicted"] += evicted
+    _totals["bytes_evicted"] += freed
+    return evicted, freed
+
+
+def _statm_rss(pid) -> int:
+    with open(f"/proc/{pid}/statm", "r") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def process_rss_bytes():
+    """Current RSS of this process, or None where /proc is not available."""
+    try:
+        return _statm_rss("self")
+    except (OSError, ValueError):
+        return None
+
+
+def chromium_rss_bytes():
+    """
+    Total RSS of the Chromium processes started by this process (browsers launched through Playwright).
+    Browsers attached over BROWSER_ENDPOINT are not descendants and are not counted. None where /proc
+    is not available.
+    """
+    children = {}
+    names = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as stat:
+                    data = stat.read()
+            except OSError:
+                continue
+            # comm is in parentheses and may contain spaces; ppid is the second field after it
+            name = data[data.index("(") + 1:data.rindex(")")]
+            ppid = int(data[data.rindex(")") + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+            names[int(entry)] = name.lower()
+    except OSError:
+        return None
+    total = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        if any(name in names.get(pid, "") for name in CHROMIUM_PROCESS_NAMES):
+            try:
+                total += _statm_rss(pid)
+            except (OSError, ValueError):
+                pass
+    return total
+
+
+def track_computer(computer):
+    """Count a browser session in the open page and context figures while it is alive."""
+    _computers.add(computer)
+
+
+def open_browser_objects() -> dict:
+    """Browser sessions, contexts and pages currently open in this process."""
+    sessions = contexts = pages = 0
+    for computer in list(_computers):
+        context = getattr(computer, "_context", None)
+        if context is None:
+            continue
+        sessions += 1
+        contexts += 1
+        pages += len(context.pages)
+    return {"sessions": sessions, "contexts": contexts, "pages": pages}
+
+
+def browser_over_limit(max_browser_rss_mb: float = BROWSER_MAX_RSS_MB) -> bool:
+    """Whether the Chromium processes of this process use more than max_browser_rss_mb (never when 0)."""
+    if max_browser_rss_mb <= 0:
+        return False
+    rss = chromium_rss_bytes()
+    return rss is not None and rss > max_browser_rss_mb * MB
+
+
+async def recycle_browser(computer, max_browser_rss_mb: float = BROWSER_MAX_RSS_MB) -> bool:
+    """
+    Relaunch computer's browser to release its memory.
+    Returns:
+        bool: True if the browser was relaunched; False if the computer cannot relaunch it (e.g. a page view).
+    """
+    recycle = getattr(computer, "recycle", None)
+    if not recycle:
+        return False
+    if not await recycle():
+        return False
+    print(f"[memory] Chromium RSS exceeded {max_browser_rss_mb:.0f} MB; relaunched the browser")
+    _totals["browser_recycles"] += 1
+    return True
+
+
+class CuaMemoryGuard:
+    """Keeps one CUA loop's conversation and browser within the memory limits, and reports what it retains."""
+
+    def __init__(self, items, computer=None, max_screenshots: int = CUA_MAX_SCREENSHOTS, max_browser_rss_mb: float = BROWSER_MAX_RSS_MB):
+        self.items = items
+        self.computer = computer
+        self.max_screenshots = max_screenshots
+        self.max_browser_rss_mb = max_browser_rss_mb
+        self._recycle_unsupported = False
+        _guards.add(self)
+
+    async def after_turn(self, allow_recycle: bool = True):
+        """
+        Apply the limits after a turn's items were added.
+        Args:
+            allow_recycle (bool): Whether the browser may be relaunched now; pass False while the page holds
+                state that a reload would lose, e.g. a partly filled form.
+        """
+        if self.max_screenshots > 0:
+            evicted, freed = evict_screenshots(self.items, self.max_screenshots)
+            if evicted:
+                print(f"[memory] evicted {evicted} screenshots ({freed / MB:.1f} MB) from the conversation")
+        if not allow_recycle or self._recycle_unsupported or not browser_over_limit(self.max_browser_rss_mb):
+            return
+        if not await recycle_browser(self.computer, self.max_browser_rss_mb):
+            # Page views share their session's browser; the session owner relaunches it between pages (see retrieve_contracts)
+            self._recycle_unsupported = True
+            print("[memory] this page shares its browser and cannot relaunch it; BROWSER_MAX_RSS_MB is applied once its session is idle")
+
+
+class MemoryTracker:
+    """Samples process memory after each invoice and reports the allocation sites that grew."""
+
+    def __init__(self, frames: int = MEMORY_TRACE_FRAMES, top: int = MEMORY_TOP_ALLOCATORS, report_path: str = MEMORY_REPORT_PATH):
+        self.frames = frames
+        self.top = top
+        self.report_path = report_path
+        self._baseline = None
+        self._previous = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = self._previous = self._snapshot()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def _top_growth(self, snapshot, since):
+        return [
+            {
+                "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(since, "lineno")[:self.top]
+            if stat.size_diff > 0
+        ]
+
+    def sample(self, label: str) -> dict:
+        """
+        Record the current memory figures, print a one-line summary and append it to report_path.
+        Args:
+            label (str): What was just finished, e.g. the invoice key.
+        Returns:
+            dict: The sample, including the allocation sites that grew since the previous sample.
+        """
+        screenshots = bytes_retained = 0
+        for guard in list(_guards):
+            count, size = screenshot_stats(guard.items)
+            screenshots += count
+            bytes_retained += size
+        python_rss = process_rss_bytes()
+        chromium_rss = chromium_rss_bytes()
+        record = {
+            "label": label,
+            "time": time.time(),
+            "pid": os.getpid(),
+            "python_rss_mb": round(python_rss / MB, 1) if python_rss is not None else None,
+            "chromium_rss_mb": round(chromium_rss / MB, 1) if chromium_rss is not None else None,
+            "screenshots_retained": screenshots,
+            "screenshot_mb_retained": round(bytes_retained / MB, 2),
+            **open_browser_objects(),
+            **_totals,
+        }
+        if tracemalloc.is_tracing() and self._previous is not None:
+            snapshot = self._snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            record["traced_mb"] = round(traced / MB, 1)
+            record["traced_peak_mb"] = round(peak / MB, 1)
+            record["top_growth"] = self._top_growth(snapshot, self._previous)
+            self._previous = snapshot
+        print(
+            f"[memory] {label}: python {record['python_rss_mb']} MB, chromium {record['chromium_rss_mb']} MB, "
+            f"{screenshots} screenshots ({record['screenshot_mb_retained']} MB) retained, "
+            f"{record['pages']} pages in {record['contexts']} contexts open"
+        )
+        if self.report_path:
+            with open(self.report_path, "a", encoding="utf-8") as report_file:
+                report_file.write(json.dumps(record) + "\n")
+        return record
+
+    def print_report(self, label: str = "Memory"):
+        """Print the allocation sites that grew most since start()."""
+        if not tracemalloc.is_tracing() or self._baseline is None:
+            return
+        traced, peak = tracemalloc.get_traced_memory()
+        print(f"{label}: {traced / MB:.1f} MB traced (peak {peak / MB:.1f} MB); top allocators since start:")
+        for entry in self._top_growth(self._snapshot(), self._baseline):
+            print(f"  {entry['where']}: +{entry['size_diff_kb']} KB ({entry['count_diff']:+d} blocks)")
+
+
+_tracker = None
+
+
+def get_memory_tracker() -> MemoryTracker:
+    """Return the process-wide tracker, started on first use when MEMORY_TRACE is set."""
+    global _tracker
+    if _tracker is None:
+        _tracker = MemoryTracker()
+        if MEMORY_TRACE:
+            _tracker.start()
+    return _tracker
@@ -0,0 +1,332 @@
+import html
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Layout of the mock posting form; the fake model clicks the save button at its centre
+SAVE_BUTTON_BOX = (40, 560, 200, 60)
+CONTRACT_LINES = 60
+SUPPLIERS = ["SUP001", "SUP002", "SUP003"]
+ITEMS = [("ITM001", 12.5), ("ITM002", 40.0), ("ITM003", 7.25), ("ITM004", 150.0)]
+FALLBACK_RULES = (
+    "1. Every invoiced item must appear on the referenced contract.\n"
+    "2. Unit prices must not exceed the contract price.\n"
+    "3. The invoice total must equal the sum of its lines."
+)
+
+
+class _Server:
+    """An HTTP server on a daemon thread, bound to a free port on 127.0.0.1."""
+
+    handler = None
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        handler = type(self.handler.__name__, (self.handler,), {"service": self})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def contract_lines(contract_id: str):
+    """Deterministic contract lines for a contract id."""
+    seed = int(hashlib.sha1(contract_id.encode("utf-8")).hexdigest(), 16)
+    return [
+        {"itemId": ITEMS[(seed + index) % len(ITEMS)][0], "description": f"Line {index + 1}", "unitPrice": ITEMS[(seed + index) % len(ITEMS)][1]}
+        for index in range(CONTRACT_LINES)
+    ]
+
+
+class _AppHandler(_QuietHandler):
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        self.service.count("get")
+        if path.startswith("/Contracts/"):
+            contract_id = html.escape(path.rsplit("/", 1)[1])
+            rows = "".join(
+                f"<tr><td>{line['itemId']}</td><td>{line['description']}</td><td>{line['unitPrice']:.2f}</td></tr>"
+                for line in contract_lines(contract_id)
+            )
+            self._send(200, (
+                f"<html><body><h1>Contract {contract_id}</h1><dl><dt>Contract ID</dt><dd>{contract_id}</dd>"
+                f"<dt>Supplier</dt><dd>{SUPPLIERS[0]}</dd></dl>"
+                f"<table><tr><th>Item</th><th>Description</th><th>Unit price</th></tr>{rows}</table></body></html>"
+            ))
+        elif path.endswith("/PurchaseInvoiceHeaders/Create"):
+            left, top, width, height = SAVE_BUTTON_BOX
+            fields = "".join(
+                f'<label for="{name}">{name}</label><input id="{name}" name="{name}"><br>'
+                for name in ("PurchaseInvoiceNo", "ContractReference", "SupplierId", "TotalInvoiceValue", "InvoiceDate", "Status", "Remarks")
+            )
+            self._send(200, (
+                f'<html><body><h1>Create purchase invoice</h1><form method="post">{fields}'
+                f'<button type="submit" style="position:absolute;left:{left}px;top:{top}px;width:{width}px;height:{height}px">Save</button>'
+                f"</form></body></html>"
+            ))
+        elif path.endswith("/PurchaseInvoiceHeaders"):
+            with self.service.lock:
+                posted = list(self.service.posted[-50:])
+            rows = "".join(f"<tr><td>{html.escape(str(entry.get('PurchaseInvoiceNo', '')))}</td><td>{html.escape(str(entry.get('SupplierId', '')))}</td></tr>" for entry in posted)
+            self._send(200, f"<html><body><h1>Purchase invoices</h1><table>{rows}</table></body></html>")
+        else:
+            self._send(404, "<html><body>Not found</body></html>")
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        if not path.endswith("/PurchaseInvoiceHeaders/Create"):
+            self._send(404, "<html><body>Not found</body></html>")
+            return
+        with self.service.lock:
+            self.service.posted.append(form)
+        self.service.count("post")
+        self._send(303, "", headers={"Location": path.rsplit("/", 1)[0]})
+
+
+class MockProcurementApp(_Server):
+    """
+    Local stand-in for the procurement web app: contract detail pages (/Contracts/<id>), the purchase invoice
+    create form (/PurchaseInvoiceHeaders/Create) and the invoice list page. Posted forms are kept in memory.
+    """
+
+    handler = _AppHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__(host, port)
+        self.lock = threading.Lock()
+        self.posted = []
+        self.requests = {"get": 0, "post": 0}
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+
+    @property
+    def contract_data_url(self) -> str:
+        return f"{self.url}/Contracts"
+
+    @property
+    def invoice_data_url(self) -> str:
+        return f"{self.url}/PurchaseInvoiceHeaders/Create"
+
+
+def _texts(content):
+    if isinstance(content, str):
+        return [content]
+    return [part.get("text", "") for part in content or [] if isinstance(part, dict) and part.get("type") in ("input_text", "output_text")]
+
+
+def _images(content):
+    if isinstance(content, str):
+        return []
+    return [part.get("image_url", "") for part in content or [] if isinstance(part, dict) and part.get("type") == "input_image"]
+
+
+def fake_invoice(image_url: str) -> dict:
+    """Deterministic invoice data for an invoice image."""
+    digest = hashlib.sha1(image_url.encode("utf-8")).hexdigest()
+    seed = int(digest[:8], 16)
+    contract_id = f"CON{seed % 3 + 1:04d}"
+    lines = []
+    for index, contract_line in enumerate(contract_lines(contract_id)[:seed % 3 + 1]):
+        quantity = (seed >> index) % 9 + 1
+        price = contract_line["unitPrice"]
+        lines.append({"itemId": contract_line["itemId"], "quantity": quantity, "unitPrice": price, "totalPrice": round(quantity * price, 2)})
+    return {
+        "invoiceNumber": f"INV-{digest[:8].upper()}",
+        "contractId": contract_id,
+        "supplierId": SUPPLIERS[seed % len(SUPPLIERS)],
+        "totalInvoiceValue": round(sum(line["totalPrice"] for line in lines), 2),
+        "invoiceDate": "2025-01-15",
+        "invoiceLines": lines,
+    }
+
+
+def _message(text):
+    return {
+        "type": "message",
+        "id": f"msg_{uuid.uuid4().hex}",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": text, "annotations": []}],
+    }
+
+
+def _computer_call(action):
+    return {
+        "type": "computer_call",
+        "id": f"cu_{uuid.uuid4().hex}",
+        "call_id": f"call_{uuid.uuid4().hex}",
+        "action": action,
+        "pending_safety_checks": [],
+        "status": "completed",
+    }
+
+
+class _ModelHandler(_QuietHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        service = self.service
+        service.count("requests")
+        if not urlparse(self.path).path.endswith("/responses"):
+            self._send(404, json.dumps({"error": {"message": "Not found", "type": "invalid_request_error"}}), "application/json")
+            return
+        if service.error_rate and service.random.random() < service.error_rate:
+            service.count("throttled")
+            body = {"error": {"message": "Rate limit is exceeded. Try again in 1 seconds.", "type": "rate_limit_exceeded", "code": "429"}}
+            self._send(429, json.dumps(body), "application/json", headers={"Retry-After": "1"})
+            return
+        output = service.respond(request)
+        response = {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": request.get("model", ""),
+            "status": "completed",
+            "output": output,
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": length // 4,
+                "input_tokens_details": {"cached_tokens": 0},
+                "output_tokens": sum(len(json.dumps(item)) for item in output) // 4,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": length // 4 + sum(len(json.dumps(item)) for item in output) // 4,
+            },
+        }
+        latency = service.latency()
+        if not request.get("stream"):
+            time.sleep(latency)
+            self._send(200, json.dumps(response), "application/json")
+            return
+        # Server-sent events: the first item after most of the latency, the rest shortly after
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        sequence = 0
+
+        def event(payload):
+            nonlocal sequence
+            payload["sequence_number"] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            event({"type": "response.created", "response": {**response, "status": "in_progress", "output": []}})
+            time.sleep(latency * 0.7)
+            for index, item in enumerate(output):
+                event({"type": "response.output_item.done", "output_index": index, "item": item})
+                time.sleep(latency * 0.3 / max(1, len(output)))
+            event({"type": "response.completed", "response": response})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped the stream early
+            pass
+
+
+class FakeResponsesServer(_Server):
+    """
+    Local stand-in for the Azure OpenAI Responses API (POST .../responses, streamed or not). Answers are
+    deterministic per request kind:
+    - invoice extraction: invoice data derived from a hash of the image;
+    - business rules (file_search): the local rules file;
+    - anomaly verdicts: approved;
+    - contract CUA turns: one wait action, then the contract as JSON; tiled contract capture: the lines as JSON;
+    - posting CUA turns: a click on the mock form's save button, then a screenshot request.
+    Each answer takes latency_ms (with +/- jitter), and error_rate of the requests are throttled with a 429.
+    """
+
+    handler = _ModelHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 200, jitter: float = 0.5,
+                 error_rate: float = 0.0, rules_path: str = "data_files/p2p-rules.txt", seed: int = None):
+        super().__init__(host, port)
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "throttled": 0}
+        try:
+            with open(rules_path, "r", encoding="utf-8") as rules_file:
+                self.rules = rules_file.read()
+        except OSError:
+            self.rules = FALLBACK_RULES
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+
+    def latency(self) -> float:
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency_ms * factor / 1000)
+
+    def respond(self, request: dict) -> list:
+        """Return the output items for a Responses API request."""
+        items = request.get("input")
+        items = [{"role": "user", "content": items}] if isinstance(items, str) else items or []
+        user_texts = [text for item in items if isinstance(item, dict) and item.get("role") == "user" for text in _texts(item.get("content"))]
+        images = [image for item in items if isinstance(item, dict) for image in _images(item.get("content"))]
+        first_text = user_texts[0] if user_texts else ""
+        if request.get("model") == "computer-use-preview":
+            turn = sum(1 for item in items if isinstance(item, dict) and item.get("type") == "computer_call_output")
+            if "contract details page" in first_text:
+                if turn == 0:
+                    return [_computer_call({"type": "wait"})]
+                contract_id = "CON0001"
+                return [_message(json.dumps({"contractId": contract_id, "supplierId": SUPPLIERS[0], "contractLines": contract_lines(contract_id)}))]
+            if turn == 0:
+                left, top, width, height = SAVE_BUTTON_BOX
+                return [_computer_call({"type": "click", "x": left + width // 2, "y": top + height // 2, "button": "left"})]
+            return [_computer_call({"type": "screenshot"})]
+        if any(tool.get("type") == "file_search" for tool in request.get("tools") or []):
+            return [_message(self.rules)]
+        if images and first_text.startswith("You are viewing part"):
+            return [_message(json.dumps({"header": {"contractId": "CON0001"}, "contractLines": contract_lines("CON0001")[:10]}))]
+        if images:
+            return [_message(json.dumps(fake_invoice(images[0])))]
+        return [_message(json.dumps({
+            "status": "approved",
+            "detailed_verdict": "All invoice lines match the contract.",
+            "summary_verdict": "Approved: lines match the contract.",
+        }))]
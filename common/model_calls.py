@@ -0,0 +1,351 @@
+import os
+import time
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from email.utils import parsedate_to_datetime
+
+from .response_cache import get_response_cache
+
+# Lower numbers are admitted first when callers are waiting for quota. Posting-loop turns hold an
+# open browser session, so they go ahead of fresh extractions that can wait without holding anything.
+STAGE_PRIORITIES = {
+    "posting": 0,
+    "contract": 1,
+    "verdict": 2,
+    "rules": 3,
+    "extraction": 4,
+}
+DEFAULT_PRIORITY = 5
+# Priority class of the invoice a call is made for (set per invoice by common.scheduler, 0 = most urgent).
+# Every class outranks the whole stage order of the classes after it.
+priority_class = contextvars.ContextVar("priority_class", default=0)
+PRIORITY_CLASS_SPAN = DEFAULT_PRIORITY + 1
+# Seconds a waiting call needs to gain one priority level, so low-priority calls are not starved (0 disables aging)
+MODEL_PRIORITY_AGING_SECONDS = float(os.getenv("MODEL_PRIORITY_AGING_SECONDS", "5"))
+# Waiters that are not first in line re-check their position this often, since aging can reorder the line
+WAITER_RECHECK_SECONDS = 1.0
+
+# Deployment quotas; 0 disables the corresponding limit
+MODEL_TPM = int(os.getenv("AZURE_OPENAI_TPM", "0"))
+MODEL_RPM = int(os.getenv("AZURE_OPENAI_RPM", "0"))
+# Fraction of the deployment quota this process may use (set by the batch runner for its workers)
+MODEL_QUOTA_SHARE = float(os.getenv("MODEL_QUOTA_SHARE", "1.0"))
+MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "6"))
+BACKOFF_BASE_SECONDS = float(os.getenv("MODEL_BACKOFF_BASE_SECONDS", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.getenv("MODEL_BACKOFF_MAX_SECONDS", "60"))
+
+# Rough token costs used to charge requests against the TPM bucket before they are sent
+IMAGE_TOKEN_ESTIMATE = 1000
+OUTPUT_TOKEN_ESTIMATE = 1000
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# Error codes of failed (streamed) responses that are transient on the service side
+RETRYABLE_ERROR_CODES = {"server_error", "rate_limit_exceeded", "vector_store_timeout"}
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to one minute of quota."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be consumed (requests larger than the bucket wait for a full bucket)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Admits model calls against RPM/TPM token buckets, serving waiting callers in (aged) priority order."""
+
+    def __init__(self, tpm: float = 0, rpm: float = 0, aging_seconds: float = MODEL_PRIORITY_AGING_SECONDS):
+        self._token_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self._request_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self._paused_until = 0.0
+        self.aging_seconds = aging_seconds
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def pause(self, seconds: float):
+        """Hold back every caller, e.g. after the service answered 429 with a Retry-After."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_time(self, tokens):
+        delay = self._paused_until - time.monotonic()
+        if self._token_bucket:
+            delay = max(delay, self._token_bucket.wait_time(tokens))
+        if self._request_bucket:
+            delay = max(delay, self._request_bucket.wait_time(1))
+        return delay
+
+    def _first_in_line(self):
+        """The waiter with the best priority after aging; ties go to the earliest."""
+        now = time.monotonic()
+        if self.aging_seconds <= 0:
+            return min(self._waiters)
+        return min(self._waiters, key=lambda entry: (entry[0] - (now - entry[3]) / self.aging_seconds, entry[1]))
+
+    async def acquire(self, tokens: int, priority: int = DEFAULT_PRIORITY):
+        entry = (priority, next(self._seq), tokens, time.monotonic())
+        async with self._cond:
+            self._waiters.append(entry)
+            try:
+                while True:
+                    if self._first_in_line() is entry:
+                        delay = self._wait_time(tokens)
+                        if delay <= 0:
+                            break
+                        timeout = delay
+                    else:
+                        timeout = WAITER_RECHECK_SECONDS
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiters.remove(entry)
+                self._cond.notify_all()
+                raise
+            self._waiters.remove(entry)
+            if self._token_bucket:
+                self._token_bucket.consume(tokens)
+            if self._request_bucket:
+                self._request_bucket.consume(1)
+            self._cond.notify_all()
+
+
+_limiter = None
+_limiter_loop = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter for the running event loop."""
+    global _limiter, _limiter_loop
+    loop = asyncio.get_running_loop()
+    if _limiter is None or _limiter_loop is not loop:
+        _limiter = RateLimiter(MODEL_TPM * MODEL_QUOTA_SHARE, MODEL_RPM * MODEL_QUOTA_SHARE)
+        _limiter_loop = loop
+    return _limiter
+
+
+def call_priority(stage: str = None) -> int:
+    """Limiter priority of a call: the invoice's priority class first, then the stage order."""
+    return priority_class.get() * PRIORITY_CLASS_SPAN + STAGE_PRIORITIES.get(stage, DEFAULT_PRIORITY)
+
+
+def _count_tokens(value) -> int:
+    if isinstance(value, str):
+        if value.startswith("data:image"):
+            return IMAGE_TOKEN_ESTIMATE
+        return len(value) // 4 + 1
+    if isinstance(value, dict):
+        return sum(_count_tokens(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_count_tokens(v) for v in value)
+    if hasattr(value, "model_dump"):
+        return _count_tokens(value.model_dump())
+    return 0
+
+
+def estimate_request_tokens(request: dict) -> int:
+    """Approximate the tokens a Responses API request is charged against the TPM quota."""
+    output_tokens = request.get("max_output_tokens") or OUTPUT_TOKEN_ESTIMATE
+    return _count_tokens(request.get("input")) + _count_tokens(request.get("instructions")) + output_tokens
+
+
+def _is_retryable(error) -> bool:
+    import openai
+
+    if isinstance(error, StreamFailed):
+        return error.code in RETRYABLE_ERROR_CODES
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def _retry_after_seconds(error):
+    """Read the server's Retry-After hint (retry-after-ms, or retry-after in seconds or as an HTTP date)."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _is_rate_limited(error) -> bool:
+    return getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == "rate_limit_exceeded"
+
+
+def retry_delay(error, attempt: int) -> float:
+    """Delay before the next attempt: the server's Retry-After when given, otherwise full-jitter exponential backoff."""
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        return min(BACKOFF_MAX_SECONDS, retry_after) + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+async def create_response(client, stage: str = None, **request):
+    """
+    Call client.responses.create with rate limiting and retries.
+    The call is admitted by the process-wide rate limiter in stage priority order, run off the event loop,
+    and retried with jittered exponential backoff (honoring Retry-After) on 429, 5xx and connection errors.
+    With MODEL_CACHE_MODE=record or replay, recorded responses are served from the local response cache.
+    Args:
+        client: The AzureOpenAI client.
+        stage (str): Pipeline stage issuing the call; selects its priority in STAGE_PRIORITIES (after priority_class).
+        **request: Arguments for client.responses.create.
+    Returns:
+        The Responses API response.
+    Raises:
+        The last error once MAX_RETRIES retries are exhausted, or any non-retryable error immediately.
+        CacheMiss in replay mode when the request has no recorded response.
+    """
+    cache = get_response_cache()
+    if cache.enabled:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+    priority = call_priority(stage)
+    tokens = estimate_request_tokens(request)
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens, priority)
+        try:
+            response = await asyncio.to_thread(client.responses.create, **request)
+            cache.put(request, response)
+            return response
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt)
+            if _is_rate_limited(e):
+                limiter.pause(delay)
+            attempt += 1
+            print(f"Model call for stage '{stage}' failed ({type(e).__name__}); retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+
+class StreamFailed(RuntimeError):
+    """Raised when a streamed response reports an error or failure event; code is the service's error code."""
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.code = code
+
+
+async def stream_response(client, stage: str = None, on_output_item=None, **request):
+    """
+    Stream a Responses API call and hand each output item to on_output_item as soon as it is complete,
+    while the rest of the response is still being generated.
+    Admission and retries work as in create_response, except that a failed stream is only retried while
+    no item has been handed out yet. A response that fails with a transient service error (RETRYABLE_ERROR_CODES)
+    is retried like a 5xx. When the response cache is enabled the call is not streamed; the
+    cached or recorded response's items are handed out in order instead.
+    Args:
+        client: The AzureOpenAI client.
+        stage (str): Pipeline stage issuing the call; selects its priority in STAGE_PRIORITIES (after priority_class).
+        on_output_item: Coroutine function called with each completed output item. Returning True stops
+            the stream; the remaining items are discarded.
+        **request: Arguments for client.responses.create.
+    Returns:
+        The completed response, or None when on_output_item stopped the stream early.
+    """
+    if get_response_cache().enabled:
+        response = await create_response(client, stage=stage, **request)
+        for item in response.output or []:
+            if on_output_item and await on_output_item(item):
+                return None
+        return response
+    priority = call_priority(stage)
+    tokens = estimate_request_tokens(request)
+    limiter = get_rate_limiter()
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens, priority)
+        events = asyncio.Queue()
+        stopped = threading.Event()
+
+        def pump():
+            # The SDK stream is synchronous; read it on a worker thread and forward events to the loop
+            try:
+                with client.responses.create(stream=True, **request) as stream:
+                    for event in stream:
+                        if stopped.is_set():
+                            break
+                        loop.call_soon_threadsafe(events.put_nowait, ("event", event))
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, ("error", e))
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, ("end", None))
+
+        reader = loop.run_in_executor(None, pump)
+        response = None
+        error = None
+        dispatched = 0
+        try:
+            while True:
+                kind, payload = await events.get()
+                if kind == "end":
+                    break
+                if kind == "error":
+                    error = payload
+                elif payload.type == "response.output_item.done":
+                    dispatched += 1
+                    if on_output_item and await on_output_item(payload.item):
+                        return None
+                elif payload.type in ("response.completed", "response.incomplete"):
+                    response = payload.response
+                elif payload.type == "response.failed":
+                    failure = payload.response.error
+                    error = StreamFailed(
+                        f"Response failed: {failure.message if failure else 'unknown error'}", failure.code if failure else None
+                    )
+                elif payload.type == "error":
+                    error = StreamFailed(f"Stream error {payload.code}: {payload.message}", payload.code)
+        finally:
+            # An early stop does not wait for the reader: it closes the stream at its next event
+            stopped.set()
+        await reader
+        if error is None and response is not None:
+            return response
+        error = error or StreamFailed("Stream ended without a completed response")
+        if dispatched or attempt >= MAX_RETRIES or not _is_retryable(error):
+            raise error
+        delay = retry_delay(error, attempt)
+        if _is_rate_limited(error):
+            limiter.pause(delay)
+        attempt += 1
+        print(f"Streamed model call for stage '{stage}' failed ({type(error).__name__}); retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+        await asyncio.sleep(delay)
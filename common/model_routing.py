@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+from dataclasses import dataclass
+
+# Cheaper/faster deployment tried first; routing is off when unset
+MODEL_NAME_FAST = os.getenv("MODEL_NAME_FAST")
+# Image detail used for the first, fast attempt (the strong model always gets "high")
+FAST_IMAGE_DETAIL = os.getenv("FAST_IMAGE_DETAIL", "low")
+# Results scoring below this confidence (fraction of checks passed) are redone with the strong model
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "1.0"))
+
+INVOICE_FIELDS = ["contractId", "invoiceNumber", "supplierId", "totalInvoiceValue", "invoiceDate"]
+INVOICE_LINE_FIELDS = ["itemId", "quantity", "unitPrice", "totalPrice"]
+# Amounts within this absolute or relative difference count as equal (rounding on the invoice)
+AMOUNT_ABS_TOLERANCE = 0.05
+AMOUNT_REL_TOLERANCE = 0.005
+
+
+def to_number(value):
+    """Parse an amount such as 1234.5, "1,234.50" or "USD 1,234.50"; None if it holds no number."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = re.search(r"-?\d[\d,]*(?:\.\d+)?", value)
+    if not match:
+        return None
+    try:
+        return float(match.group(0).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _amounts_match(a, b) -> bool:
+    return abs(a - b) <= max(AMOUNT_ABS_TOLERANCE, AMOUNT_REL_TOLERANCE * max(abs(a), abs(b)))
+
+
+def _confidence(passed: int, failures: list):
+    total = passed + len(failures)
+    return (passed / total if total else 1.0), failures
+
+
+def score_invoice_extraction(invoice_data):
+    """
+    Score an extracted invoice by schema completeness and arithmetic consistency.
+    Returns:
+        tuple: (confidence between 0 and 1, list of failed checks).
+    """
+    if not isinstance(invoice_data, dict):
+        return 0.0, ["extraction is not a JSON object"]
+    failures = []
+    passed = 0
+    for name in INVOICE_FIELDS:
+        if invoice_data.get(name) in (None, ""):
+            failures.append(f"missing {name}")
+        else:
+            passed += 1
+    lines = [line for line in invoice_data.get("invoiceLines") or [] if isinstance(line, dict)]
+    if not lines:
+        return _confidence(passed, failures + ["no invoice lines"])
+    line_total = 0.0
+    for index, line in enumerate(lines):
+        missing = [name for name in INVOICE_LINE_FIELDS if line.get(name) in (None, "")]
+        if missing:
+            failures.append(f"line {index + 1} missing {', '.join(missing)}")
+            continue
+        passed += 1
+        quantity, unit_price, total_price = (to_number(line.get(name)) for name in ("quantity", "unitPrice", "totalPrice"))
+        if None in (quantity, unit_price, total_price):
+            failures.append(f"line {index + 1} has non-numeric amounts")
+            continue
+        if _amounts_match(quantity * unit_price, total_price):
+            passed += 1
+        else:
+            failures.append(f"line {index + 1}: {quantity} x {unit_price} != {total_price}")
+        line_total += total_price
+    invoice_total = to_number(invoice_data.get("totalInvoiceValue"))
+    if invoice_total is not None and not failures:
+        if _amounts_match(line_total, invoice_total):
+            passed += 1
+        else:
+            failures.append(f"line totals sum to {line_total:.2f}, totalInvoiceValue is {invoice_total:.2f}")
+    return _confidence(passed, failures)
+
+
+def score_business_rules(business_rules):
+    if not isinstance(business_rules, str) or len(business_rules.strip()) < 50:
+        return 0.0, ["no business rules text returned"]
+    return 1.0, []
+
+
+def rule_violations(invoice_data, contract_data):
+    """
+    Deterministic business rule checks that need no interpretation. Only violations that are certain
+    are reported, so an empty list does not mean the invoice is compliant.
+    """
+    if not isinstance(invoice_data, dict):
+        return []
+    if not isinstance(contract_data, dict) or "error" in contract_data:
+        return ["contract data is missing"]
+    contract_text = json.dumps(contract_data, default=str).lower()
+    violations = []
+    for line in invoice_data.get("invoiceLines") or []:
+        item_id = line.get("itemId") if isinstance(line, dict) else None
+        if item_id not in (None, "") and str(item_id).strip().lower() not in contract_text:
+            violations.append(f"item {item_id} does not appear in the contract")
+    return violations
+
+
+def score_verdict(verdict, invoice_data, contract_data):
+    """Score an anomaly verdict by its schema and its agreement with the deterministic rule checks."""
+    if not isinstance(verdict, dict):
+        return 0.0, ["verdict is not a JSON object"]
+    failures = []
+    passed = 0
+    if verdict.get("status") in ("approved", "rejected"):
+        passed += 1
+    else:
+        failures.append(f"status is {verdict.get('status')!r}")
+    for name in ("detailed_verdict", "summary_verdict"):
+        if verdict.get(name):
+            passed += 1
+        else:
+            failures.append(f"missing {name}")
+    violations = rule_violations(invoice_data, contract_data)
+    if violations and verdict.get("status") == "approved":
+        failures.append(f"approved despite: {'; '.join(violations)}")
+    else:
+        passed += 1
+    return _confidence(passed, failures)
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    escalations: int = 0
+    fast_failures: int = 0
+    fast_seconds: float = 0.0
+    accepted_fast_seconds: float = 0.0
+    strong_seconds: float = 0.0
+    strong_calls: int = 0
+
+
+class ModelRouter:
+    """Runs each task on the fast deployment first and escalates to the strong one when the result scores low."""
+
+    def __init__(self, fast_model: str = MODEL_NAME_FAST, min_confidence: float = ROUTING_MIN_CONFIDENCE):
+        self.fast_model = fast_model
+        self.min_confidence = min_confidence
+        self.stats = {}
+
+    async def run(self, stage: str, strong_model: str, call, score):
+        """
+        Args:
+            stage (str): Pipeline stage, for the statistics.
+            strong_model (str): Deployment used when routing is off or the fast result is rejected.
+            call: Coroutine function call(model, fast) producing the result; fast tells it to use cheaper settings.
+            score: Function returning (confidence, failed checks) for a result.
+        Returns:
+            The accepted result.
+        """
+        stats = self.stats.setdefault(stage, StageStats())
+        stats.calls += 1
+        if self.fast_model and self.fast_model != strong_model:
+            started = time.perf_counter()
+            try:
+                result = await call(self.fast_model, True)
+                confidence, failures = score(result)
+            except Exception as e:
+                stats.fast_failures += 1
+                confidence, failures = 0.0, [f"fast model call failed: {e}"]
+            elapsed = time.perf_counter() - started
+            stats.fast_seconds += elapsed
+            if confidence >= self.min_confidence:
+                stats.accepted_fast_seconds += elapsed
+                return result
+            stats.escalations += 1
+            print(f"[{stage}] escalating to {strong_model} (confidence {confidence:.2f}): {'; '.join(failures)}")
+        started = time.perf_counter()
+        result = await call(strong_model, False)
+        stats.strong_seconds += time.perf_counter() - started
+        stats.strong_calls += 1
+        return result
+
+    def report(self) -> dict:
+        """Escalation rate and estimated latency saved per stage (savings need at least one strong call to compare)."""
+        report = {}
+        for stage, stats in self.stats.items():
+            accepted = stats.calls - stats.escalations if self.fast_model else 0
+            entry = {
+                "calls": stats.calls,
+                "escalations": stats.escalations,
+                "escalation_rate": round(stats.escalations / stats.calls, 3) if stats.calls and self.fast_model else None,
+                "latency_saved_seconds": None,
+            }
+            if stats.strong_calls and self.fast_model:
+                strong_avg = stats.strong_seconds / stats.strong_calls
+                wasted = stats.fast_seconds - stats.accepted_fast_seconds
+                entry["latency_saved_seconds"] = round(accepted * strong_avg - stats.accepted_fast_seconds - wasted, 2)
+            report[stage] = entry
+        return report
+
+    def print_report(self, label: str = "Model routing"):
+        if not self.fast_model or not self.stats:
+            return
+        print(f"{label} ({self.fast_model} first):")
+        for stage, entry in self.report().items():
+            saved = "n/a" if entry["latency_saved_seconds"] is None else f"{entry['latency_saved_seconds']:.1f}s"
+            print(f"  {stage}: {entry['escalations']}/{entry['calls']} escalated ({entry['escalation_rate']:.0%}), latency saved {saved}")
+
+
+_router = None
+
+
+def get_model_router() -> ModelRouter:
+    """Return the process-wide router configured by MODEL_NAME_FAST and ROUTING_MIN_CONFIDENCE."""
+    global _router
+    if _router is None:
+        _router = ModelRouter()
+    return _router
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+
+# Token budget for the anomaly detection prompt (0 disables enforcement)
+ANOMALY_PROMPT_TOKEN_BUDGET = int(os.getenv("ANOMALY_PROMPT_TOKEN_BUDGET", "6000"))
+
+# Fields of the extracted invoice that anomaly detection compares against the contract
+INVOICE_FIELDS = ["invoiceNumber", "contractId", "supplierId", "invoiceDate", "totalInvoiceValue", "currency"]
+INVOICE_LINE_FIELDS = ["itemId", "description", "quantity", "unitPrice", "totalPrice"]
+
+# Contract header fields named with one of these words survive trimming to the token budget
+RELEVANT_KEYWORDS = (
+    "contract", "supplier", "vendor", "date", "start", "end", "valid", "expir", "status",
+    "value", "amount", "total", "currency", "price", "quantity", "qty", "item", "term",
+)
+# Link and button captions scraped from list pages (e.g. "Edit | Details | Delete")
+_ACTION_WORDS = {"edit", "details", "delete", "back to list", "create new", "select", "view"}
+MAX_FIELD_NAME_LENGTH = 60
+MAX_FIELD_VALUE_LENGTH = 200
+
+_tokenizer = None
+
+
+def _get_tokenizer():
+    """Return the tiktoken encoder for gpt-4o class models, or None when tiktoken isn't installed."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+
+            _tokenizer = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            print("WARNING: tiktoken is not available; prompt tokens are estimated at ~4 characters per token (pip install tiktoken).")
+            _tokenizer = False
+    return _tokenizer or None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally; falls back to ~4 characters per token without tiktoken."""
+    tokenizer = _get_tokenizer()
+    if tokenizer:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _collapse(value) -> str:
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+
+def _is_relevant(name: str) -> bool:
+    name = name.lower()
+    return any(keyword in name for keyword in RELEVANT_KEYWORDS)
+
+
+def _is_action_text(value: str) -> bool:
+    parts = [part.strip().lower() for part in value.split("|") if part.strip()]
+    return bool(parts) and all(part in _ACTION_WORDS for part in parts)
+
+
+def _render_table(columns, rows) -> str:
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(_collapse(row.get(column, "")) for column in columns) for row in rows)
+    return "\n".join(lines)
+
+
+def _normalize_table(rows):
+    """Turn a list of row dicts into (columns, rows), promoting a scraped header row
+    (col0..colN keys) to column names and dropping empty and action-link columns."""
+    rows = [row for row in rows if isinstance(row, dict) and any(_collapse(v) for v in row.values())]
+    if not rows:
+        return [], []
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    if all(re.fullmatch(r"col\d+", column) for column in columns) and len(rows) > 1:
+        header = rows[0]
+        names = {}
+        for column in columns:
+            name = _collapse(header.get(column, "")) or column
+            names[column] = name if name not in names.values() else f"{name}_{column}"
+        rows = [{names[k]: v for k, v in row.items()} for row in rows[1:]]
+        columns = [names[column] for column in columns]
+    kept = []
+    for column in columns:
+        values = {_collapse(row.get(column, "")) for row in rows} - {""}
+        if values and not all(_is_action_text(value) for value in values):
+            kept.append(column)
+    return kept, rows
+
+
+def _flatten(data, prefix=""):
+    """Split nested contract JSON into scalar fields and tables (lists of row dicts)."""
+    fields, tables = {}, {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            sub_fields, sub_tables = _flatten(value, f"{name}.")
+            fields.update(sub_fields)
+            tables.update(sub_tables)
+        elif isinstance(value, list) and value and all(isinstance(row, dict) for row in value):
+            tables[name] = value
+        elif isinstance(value, list):
+            fields[name] = ", ".join(_collapse(v) for v in value)
+        else:
+            fields[name] = value
+    return fields, tables
+
+
+def compact_invoice(invoice_data) -> str:
+    """Render the extracted invoice as canonical header fields plus a line-item table."""
+    if not isinstance(invoice_data, dict):
+        return _collapse(invoice_data)
+    if "error" in invoice_data:
+        return f"error: {_collapse(invoice_data['error'])}"
+    header = [f"{field}: {_collapse(invoice_data[field])}" for field in INVOICE_FIELDS if invoice_data.get(field) is not None]
+    lines = invoice_data.get("invoiceLines") or []
+    if lines:
+        header.append("invoiceLines:")
+        header.append(_render_table(INVOICE_LINE_FIELDS, [line for line in lines if isinstance(line, dict)]))
+    return "\n".join(header)
+
+
+def compact_contract(contract_data, item_ids=None, relevant_only=False, drop_oversized=False) -> str:
+    """
+    Render contract data as canonical header fields plus tables, dropping empty and navigation fields.
+    drop_oversized drops header values longer than MAX_FIELD_VALUE_LENGTH (e.g. scraped page text);
+    item_ids restricts table rows to lines mentioning one of the invoiced items;
+    relevant_only keeps only header fields named like contract terms.
+    """
+    if not isinstance(contract_data, dict):
+        return _collapse(contract_data)
+    fields, tables = _flatten(contract_data)
+    seen_values = set()
+    header = []
+    for name, value in fields.items():
+        value = _collapse(value)
+        if not value or len(name) > MAX_FIELD_NAME_LENGTH:
+            continue
+        if drop_oversized and len(value) > MAX_FIELD_VALUE_LENGTH:
+            continue
+        if _is_action_text(value) or (relevant_only and not _is_relevant(name)):
+            continue
+        # The scraper reports the same label/value pair from several elements
+        if (name.lower(), value) in seen_values:
+            continue
+        seen_values.add((name.lower(), value))
+        header.append(f"{name}: {value}")
+    sections = ["\n".join(header)] if header else []
+    wanted = {_collapse(item_id).lower() for item_id in item_ids} if item_ids else None
+    for name, rows in tables.items():
+        columns, rows = _normalize_table(rows)
+        if not columns:
+            continue
+        if wanted:
+            rows = [row for row in rows if any(_collapse(v).lower() in wanted for v in row.values())] or rows
+        sections.append(f"{name}:\n{_render_table(columns, rows)}")
+    return "\n".join(sections)
+
+
+def build_anomaly_prompt(template: str, invoice_data, contract_data, business_rules, token_budget=ANOMALY_PROMPT_TOKEN_BUDGET):
+    """
+    Fill the anomaly detection prompt with compact canonical renderings of its inputs.
+    If the prompt exceeds token_budget, oversized contract header values, contract rows for items not on the
+    invoice and non-contract-term header fields are dropped in turn, and finally the business rules text is truncated.
+    Args:
+        template (str): Prompt with {invoice_data}, {contract_data} and {business_rules} placeholders.
+    Returns:
+        tuple[str, dict]: The prompt and token statistics (raw_tokens, prompt_tokens, saved_tokens, saved_pct).
+    """
+    raw_prompt = template.format(
+        invoice_data=json.dumps(invoice_data), contract_data=json.dumps(contract_data), business_rules=business_rules
+    )
+    raw_tokens = count_tokens(raw_prompt)
+    item_ids = [
+        line.get("itemId") for line in (invoice_data.get("invoiceLines") or [])
+        if isinstance(line, dict) and line.get("itemId")
+    ] if isinstance(invoice_data, dict) else []
+    invoice_text = compact_invoice(invoice_data)
+    rules_text = re.sub(r"[ \t]+", " ", re.sub(r"\n\s*\n", "\n", str(business_rules))).strip() if business_rules else ""
+    attempts = [
+        {},
+        {"drop_oversized": True},
+        {"drop_oversized": True, "item_ids": item_ids},
+        {"drop_oversized": True, "item_ids": item_ids, "relevant_only": True},
+    ]
+    for options in attempts:
+        prompt = template.format(
+            invoice_data=invoice_text,
+            contract_data=compact_contract(contract_data, **options),
+            business_rules=rules_text,
+        )
+        prompt_tokens = count_tokens(prompt)
+        if not token_budget or prompt_tokens <= token_budget:
+            break
+    else:
+        # Still over budget: truncate the business rules to what fits
+        overflow_chars = (prompt_tokens - token_budget) * 4
+        if rules_text and overflow_chars < len(rules_text):
+            rules_text = rules_text[: len(rules_text) - overflow_chars] + " [truncated]"
+            prompt = template.format(
+                invoice_data=invoice_text,
+                contract_data=compact_contract(contract_data, **attempts[-1]),
+                business_rules=rules_text,
+            )
+            prompt_tokens = count_tokens(prompt)
+    saved = raw_tokens - prompt_tokens
+    stats = {
+        "raw_tokens": raw_tokens,
+        "prompt_tokens": prompt_tokens,
+        "saved_tokens": saved,
+        "saved_pct": round(100.0 * saved / raw_tokens, 1) if raw_tokens else 0.0,
+        "over_budget": bool(token_budget) and prompt_tokens > token_budget,
+    }
+    return prompt, stats
@@ -0,0 +1,33 @@
+import os
+
+from .local_playwright import LocalPlaywrightComputer
+
+# Endpoint of a long-lived browser server: http://host:9222 (Chrome DevTools Protocol)
+# or ws://host:port/... (a Playwright browser server)
+BROWSER_ENDPOINT = os.getenv("BROWSER_ENDPOINT", "http://localhost:9222")
+
+
+class RemotePlaywrightComputer(LocalPlaywrightComputer):
+    """Attaches to an already-running browser and works in its own context.
+
+    Only the context is created on enter and closed on exit; the browser keeps running, so several
+    pipeline workers can share one browser server and a session starts in context-creation time.
+    """
+
+    shares_browser = True
+
+    def __init__(self, endpoint: str = None, **options):
+        super().__init__(**options)
+        self.endpoint = endpoint or BROWSER_ENDPOINT
+
+    async def _launch_browser(self):
+        if self.endpoint.startswith(("http://", "https://")) or "/devtools/" in self.endpoint:
+            self._browser = await self._playwright.chromium.connect_over_cdp(self.endpoint)
+        else:
+            self._browser = await self._playwright.chromium.connect(self.endpoint)
+
+    async def _close_browser(self):
+        # Detach without killing the shared browser: close only the context this session opened.
+        # Stopping Playwright afterwards drops the connection.
+        if self._context:
+            await self._context.close()
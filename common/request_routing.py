@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+from dataclasses import dataclass, replace
+from urllib.parse import urlparse
+
+from .utils import is_blocklisted_url
+
+# Third-party analytics and tag hosts that never affect what the agent needs to see
+ANALYTICS_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "clarity.ms",
+    "hotjar.com",
+    "segment.io",
+    "js.monitor.azure.com",
+)
+STATIC_RESOURCE_TYPES = {"stylesheet", "script", "font", "image"}
+
+STATIC_CACHE_DIR = os.getenv("STATIC_CACHE_DIR", ".browser_cache")
+# How long a cached static asset is served without going back to the network (0 disables the cache);
+# a shorter Cache-Control max-age from the server takes precedence
+STATIC_CACHE_TTL_SECONDS = int(os.getenv("STATIC_CACHE_TTL_SECONDS", "86400"))
+# Cache-Control directives that rule out serving the asset from the cache without revalidation
+UNCACHEABLE_DIRECTIVES = {"no-store", "no-cache", "private"}
+# Headers describing the transfer of the original body, which no longer apply to the decoded body we replay
+TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+def _host_matches(hostname: str, hosts) -> bool:
+    return any(hostname == host or hostname.endswith(f".{host}") for host in hosts)
+
+
+def replay_headers(headers) -> dict:
+    """Response headers for fulfilling a request with an already decoded body: transfer headers are dropped."""
+    return {name: value for name, value in headers.items() if name.lower() not in TRANSFER_HEADERS}
+
+
+def _site(hostname: str) -> str:
+    """Approximate the registrable domain (last two labels) for first/third-party checks."""
+    return ".".join(hostname.split(".")[-2:])
+
+
+@dataclass(frozen=True)
+class RouteRules:
+    """Allow/deny rules applied to every request a browser context makes."""
+
+    block_resource_types: frozenset = frozenset()
+    deny_hosts: tuple = ANALYTICS_HOSTS
+    # When set, only these hosts (and their subdomains) may be contacted
+    allow_hosts: tuple = ()
+    # Block subresources served from a different site than the page that requests them
+    block_third_party: bool = False
+    cache_static_assets: bool = True
+
+    def blocking(self, *resource_types) -> "RouteRules":
+        return replace(self, block_resource_types=self.block_resource_types | frozenset(resource_types))
+
+    def decide(self, url: str, resource_type: str, page_url: str = "", is_navigation: bool = False) -> bool:
+        """Return True if the request may proceed."""
+        # The domain blocklist applies to everything, including top-level navigations
+        if is_blocklisted_url(url):
+            return False
+        hostname = urlparse(url).hostname or ""
+        if not hostname:
+            return True  # about:, data: and blob: URLs
+        if self.allow_hosts and not _host_matches(hostname, self.allow_hosts):
+            return False
+        if _host_matches(hostname, self.deny_hosts):
+            return False
+        if is_navigation:
+            return True
+        if resource_type in self.block_resource_types:
+            return False
+        if self.block_third_party:
+            page_host = urlparse(page_url).hostname or ""
+            if page_host and _site(page_host) != _site(hostname):
+                return False
+        return True
+
+
+ROUTE_RULES = {
+    "default": RouteRules(),
+    # DOM-only extraction needs neither rendering assets nor third-party scripts
+    "dom_extraction": RouteRules(
+        block_resource_types=frozenset({"image", "font", "media", "stylesheet"}),
+        block_third_party=True,
+    ),
+}
+
+
+def get_route_rules(rules=None) -> RouteRules:
+    if rules is None:
+        return ROUTE_RULES["default"]
+    if isinstance(rules, str):
+        if rules not in ROUTE_RULES:
+            raise ValueError(f"Unknown route rules '{rules}'. Available: {', '.join(ROUTE_RULES)}")
+        return ROUTE_RULES[rules]
+    return rules
+
+
+class StaticAssetCache:
+    """On-disk cache of static assets (CSS, JS, fonts, images) shared by browser sessions and processes."""
+
+    def __init__(self, directory: str = STATIC_CACHE_DIR, ttl_seconds: int = STATIC_CACHE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.body"), os.path.join(self.directory, f"{key}.json")
+
+    def get(self, url):
+        """Return (status, headers, body) for a fresh cached asset, or None."""
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            expires_at = min(meta.get("expires_at", float("inf")), meta["stored_at"] + self.ttl_seconds)
+            if time.time() >= expires_at:
+                return None
+            with open(body_path, "rb") as body_file:
+                return meta["status"], replay_headers(meta["headers"]), body_file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def freshness_seconds(self, headers) -> float:
+        """How long a response may be served from the cache: its Cache-Control max-age, capped at the TTL; 0 if not cacheable."""
+        cache_control = (headers.get("cache-control") or "").lower()
+        directives = {directive.strip().split("=", 1)[0] for directive in cache_control.split(",")}
+        if directives & UNCACHEABLE_DIRECTIVES:
+            return 0
+        max_age = re.search(r"(?:^|,)\s*max-age\s*=\s*\"?(\d+)", cache_control)
+        if max_age:
+            return min(int(max_age.group(1)), self.ttl_seconds)
+        return self.ttl_seconds
+
+    def put(self, url, status, headers, body):
+        headers = {name.lower(): value for name, value in headers.items()}
+        freshness = self.freshness_seconds(headers)
+        if status != 200 or freshness <= 0:
+            return
+        headers = replay_headers(headers)
+        body_path, meta_path = self._paths(url)
+        now = time.time()
+        meta = {"url": url, "status": status, "headers": headers, "stored_at": now, "expires_at": now + freshness}
+        # Write then rename so concurrent sessions never read a partial entry
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, mode) as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+
+
+async def route_request(route, rules: RouteRules, cache: StaticAssetCache = None):
+    """Playwright route handler: abort denied requests and serve static assets from the cache."""
+    request = route.request
+    try:
+        page_url = request.frame.url
+    except Exception:
+        page_url = ""
+    if not rules.decide(request.url, request.resource_type, page_url, request.is_navigation_request()):
+        await route.abort("blockedbyclient")
+        return
+    if cache is None or request.method != "GET" or request.resource_type not in STATIC_RESOURCE_TYPES:
+        await route.continue_()
+        return
+    cached = cache.get(request.url)
+    if cached:
+        cache.hits += 1
+        status, headers, body = cached
+        await route.fulfill(status=status, headers=headers, body=body)
+        return
+    cache.misses += 1
+    response = await route.fetch()
+    body = await response.body()
+    cache.put(request.url, response.status, response.headers, body)
+    await route.fulfill(response=response, headers=replay_headers(response.headers), body=body)
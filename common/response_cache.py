@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+
+# record: serve cached responses and store new ones; replay: serve cached responses only (a miss is an error);
+# passthrough: no caching
+MODEL_CACHE_MODE = os.getenv("MODEL_CACHE_MODE", "passthrough")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", ".model_cache")
+CACHE_MODES = ("record", "replay", "passthrough")
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+def _normalize(value):
+    """Make a request JSON-stable: SDK objects become dicts and image data is replaced by its hash."""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str) and value.startswith("data:image"):
+        return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return value
+
+
+# Request fields that do not change the response and are left out of the cache key
+IGNORED_FIELDS = ("timeout", "extra_headers", "extra_query", "metadata", "user", "store", "stream")
+
+
+def request_key(request: dict) -> str:
+    relevant = {field: value for field, value in request.items() if field not in IGNORED_FIELDS}
+    return hashlib.sha256(json.dumps(_normalize(relevant), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Local disk cache of Responses API responses keyed by a hash of the request (model, input, tools, ...)."""
+
+    def __init__(self, mode: str = MODEL_CACHE_MODE, directory: str = MODEL_CACHE_DIR):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown model cache mode '{mode}'. Available: {', '.join(CACHE_MODES)}")
+        self.mode = mode
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "passthrough"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, request: dict):
+        """Return the recorded response for request, or None. In replay mode a miss raises CacheMiss."""
+        key = request_key(request)
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            if self.mode == "replay":
+                raise CacheMiss(f"No recorded response for model call {key} (model {request.get('model')})")
+            return None
+        self.hits += 1
+        from openai.types.responses import Response
+
+        return Response.model_validate(entry["response"])
+
+    def put(self, request: dict, response):
+        if self.mode != "record":
+            return
+        key = request_key(request)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"key": key, "request": _normalize(request), "response": response.model_dump(mode="json")}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(tmp_path, path)
+
+
+_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache configured by MODEL_CACHE_MODE and MODEL_CACHE_DIR."""
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
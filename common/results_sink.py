@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import time
+
+# Records held in memory before they are written to the JSONL file
+RESULTS_BUFFER_RECORDS = int(os.getenv("RESULTS_BUFFER_RECORDS", "50"))
+# Buffered records are written at least this often (checked on write and tick)
+RESULTS_FLUSH_SECONDS = float(os.getenv("RESULTS_FLUSH_SECONDS", "1"))
+# Written records are fsynced once this many have accumulated or this many seconds have passed
+RESULTS_FSYNC_RECORDS = int(os.getenv("RESULTS_FSYNC_RECORDS", "200"))
+RESULTS_FSYNC_SECONDS = float(os.getenv("RESULTS_FSYNC_SECONDS", "5"))
+# Directory receiving Parquet part files for analytics (needs pyarrow); no export when unset
+RESULTS_PARQUET_DIR = os.getenv("RESULTS_PARQUET_DIR")
+# A Parquet part file is written once this many rows are pending or this many seconds have passed
+RESULTS_EXPORT_ROWS = int(os.getenv("RESULTS_EXPORT_ROWS", "10000"))
+RESULTS_EXPORT_SECONDS = float(os.getenv("RESULTS_EXPORT_SECONDS", "300"))
+
+# Keywords classifying a flagged row of the verdict's detailed_verdict table, checked in order
+DISCREPANCY_TYPES = [
+    ("contract", ("contract not found", "no contract", "contract data is missing", "contract is missing")),
+    ("date", ("date", "validity", "expired", "period")),
+    ("currency", ("currency",)),
+    ("quantity", ("quantity", "qty")),
+    ("price", ("price",)),
+    ("total", ("total", "value", "amount")),
+    ("item", ("item",)),
+]
+# Words marking a row of the detailed_verdict table as a discrepancy
+DISCREPANCY_MARKERS = re.compile(
+    r"mismatch|discrepan|exceed|not match|does not|doesn't|missing|invalid|expired|outside|fail|violat|non-compliant|not compliant|✗|❌|✘",
+    re.IGNORECASE,
+)
+
+
+def _text_or_none(value):
+    return None if value is None else str(value)
+
+
+def _json_or_none(value):
+    return None if value is None else json.dumps(value, default=str)
+
+
+def _posted(post_result) -> bool:
+    # Step 5 stores {"posted": True, ...} on success, a dict with an error when posting was skipped,
+    # and a "Post invoice failed: ..." string when the posting session failed
+    return isinstance(post_result, dict) and "error" not in post_result and bool(post_result.get("posted"))
+
+
+def verdict_findings(detailed_verdict):
+    """Parse the Markdown table of a verdict's detailed_verdict into one dict per row, keyed by column header."""
+    if not isinstance(detailed_verdict, str):
+        return []
+    rows = [
+        [cell.strip() for cell in line.strip().strip("|").split("|")]
+        for line in detailed_verdict.splitlines()
+        if line.strip().startswith("|")
+    ]
+    # Drop the |---|---| separator rows
+    rows = [row for row in rows if not all(re.fullmatch(r":?-{3,}:?", cell) for cell in row if cell)]
+    if len(rows) < 2:
+        return []
+    header = [cell or f"column_{i}" for i, cell in enumerate(rows[0])]
+    return [dict(zip(header, row)) for row in rows[1:]]
+
+
+def discrepancy_types(findings, violations=()):
+    """Classify the flagged findings (and deterministic rule violations) into discrepancy types."""
+    texts = [" ".join(finding.values()) for finding in findings]
+    types = set()
+    for text in [text for text in texts if DISCREPANCY_MARKERS.search(text)] + list(violations):
+        lowered = text.lower()
+        types.add(next((name for name, words in DISCREPANCY_TYPES if any(word in lowered for word in words)), "other"))
+    return sorted(types)
+
+
+def flatten_record(record: dict) -> dict:
+    """
+    Turn a pipeline result record into one flat analytics row: invoice fields, contract snapshot,
+    verdict status and findings, posting outcome and timings.
+    """
+    from .model_routing import rule_violations, to_number
+
+    results = record.get("results") or {}
+    invoice_data = results.get("invoice_data") if isinstance(results.get("invoice_data"), dict) else {}
+    contract_data = results.get("contract_data")
+    verdict = results.get("verdict") if isinstance(results.get("verdict"), dict) else {}
+    post_result = results.get("post_result")
+    timings = results.get("timings") or {}
+    findings = verdict_findings(verdict.get("detailed_verdict"))
+    contract_found = isinstance(contract_data, dict) and "error" not in contract_data
+    types = discrepancy_types(findings, rule_violations(invoice_data, contract_data) if invoice_data else ())
+    return {
+        "invoice_key": _text_or_none(record.get("invoice_key")),
+        "image_path": _text_or_none(record.get("image_path")),
+        "worker": _text_or_none(record.get("worker")),
+        "lane": _text_or_none(record.get("lane")),
+        "deadline": record.get("deadline"),
+        "missed_deadline": record.get("missed_deadline"),
+        "recorded_at": record.get("recorded_at"),
+        "error": _text_or_none(record.get("error")),
+        "contract_id": _text_or_none(invoice_data.get("contractId")),
+        "invoice_number": _text_or_none(invoice_data.get("invoiceNumber")),
+        "supplier_id": _text_or_none(invoice_data.get("supplierId")),
+        "invoice_date": _text_or_none(invoice_data.get("invoiceDate")),
+        "total_invoice_value": to_number(invoice_data.get("totalInvoiceValue")),
+        "invoice_line_count": len(invoice_data.get("invoiceLines") or []),
+        "invoice_data": _json_or_none(invoice_data or None),
+        "contract_found": contract_found,
+        "contract_data": _json_or_none(contract_data),
+        "verdict_status": _text_or_none(verdict.get("status")),
+        "summary_verdict": _text_or_none(verdict.get("summary_verdict")),
+        "findings": _json_or_none(findings),
+        "discrepancy_types": types,
+        "discrepancy_count": len(types),
+        "posted": _posted(post_result),
+        "post_result": _json_or_none(post_result) if isinstance(post_result, dict) else _text_or_none(post_result),
+        "total_seconds": round(sum(timings.values()), 3) if timings else None,
+        "timings": _json_or_none(timings or None),
+    }
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("invoice_key", pa.string()),
+        ("image_path", pa.string()),
+        ("worker", pa.string()),
+        ("lane", pa.string()),
+        ("deadline", pa.float64()),
+        ("missed_deadline", pa.bool_()),
+        ("recorded_at", pa.float64()),
+        ("error", pa.string()),
+        ("contract_id", pa.string()),
+        ("invoice_number", pa.string()),
+        ("supplier_id", pa.string()),
+        ("invoice_date", pa.string()),
+        ("total_invoice_value", pa.float64()),
+        ("invoice_line_count", pa.int32()),
+        ("invoice_data", pa.string()),
+        ("contract_found", pa.bool_()),
+        ("contract_data", pa.string()),
+        ("verdict_status", pa.string()),
+        ("summary_verdict", pa.string()),
+        ("findings", pa.string()),
+        ("discrepancy_types", pa.list_(pa.string())),
+        ("discrepancy_count", pa.int32()),
+        ("posted", pa.bool_()),
+        ("post_result", pa.string()),
+        ("total_seconds", pa.float64()),
+        ("timings", pa.string()),
+    ])
+
+
+def write_parquet(rows, directory: str) -> str:
+    """Write flattened rows as a new part file in directory (a Parquet dataset). Returns the file path."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+    path = os.path.join(directory, name)
+    temporary_path = os.path.join(directory, f".{name}.tmp")
+    table = pa.Table.from_pylist(rows, schema=_arrow_schema())
+    # Write under a hidden name first (dataset readers skip dot files) so readers never see a partial file
+    pq.write_table(table, temporary_path, compression="zstd")
+    os.replace(temporary_path, path)
+    return path
+
+
+class ResultsSink:
+    """
+    Append-only JSONL sink receiving one record per finished invoice. Records are buffered (at most
+    buffer_records, and no longer than flush_seconds) and fsynced in batches. With a parquet_dir, the
+    records are also exported as flattened analytics rows to Parquet part files.
+    Used from one thread; call tick() periodically when records arrive irregularly.
+    """
+
+    def __init__(self, path: str, parquet_dir: str = RESULTS_PARQUET_DIR, buffer_records: int = RESULTS_BUFFER_RECORDS,
+                 flush_seconds: float = RESULTS_FLUSH_SECONDS, fsync_records: int = RESULTS_FSYNC_RECORDS,
+                 fsync_seconds: float = RESULTS_FSYNC_SECONDS, export_rows: int = RESULTS_EXPORT_ROWS,
+                 export_seconds: float = RESULTS_EXPORT_SECONDS):
+        self.path = path
+        self.parquet_dir = parquet_dir
+        self.buffer_records = max(1, buffer_records)
+        self.flush_seconds = flush_seconds
+        self.fsync_records = max(1, fsync_records)
+        self.fsync_seconds = fsync_seconds
+        self.export_rows = max(1, export_rows)
+        self.export_seconds = export_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._buffer = []
+        self._unsynced = 0
+        self._pending_rows = []
+        now = time.monotonic()
+        self._flushed_at = self._synced_at = self._exported_at = now
+        self.written = 0
+        self.exported = 0
+        if parquet_dir:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("WARNING: pyarrow is not installed; results are not exported to Parquet (pip install pyarrow).")
+                self.parquet_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record: dict):
+        """Add one invoice's record; it reaches the file within flush_seconds or buffer_records records."""
+        record.setdefault("recorded_at", time.time())
+        self._buffer.append(json.dumps(record, default=str))
+        if self.parquet_dir:
+            self._pending_rows.append(flatten_record(record))
+        self.written += 1
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+        self.tick()
+
+    def tick(self):
+        """Apply the time-based flush, fsync and export intervals."""
+        now = time.monotonic()
+        if self._buffer and now - self._flushed_at >= self.flush_seconds:
+            self.flush()
+        if self._unsynced and (self._unsynced >= self.fsync_records or now - self._synced_at >= self.fsync_seconds):
+            self.sync()
+        if self._pending_rows and (len(self._pending_rows) >= self.export_rows or now - self._exported_at >= self.export_seconds):
+            self.export()
+
+    def flush(self):
+        """Write the buffered records to the file (without fsync)."""
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._file.flush()
+            self._unsynced += len(self._buffer)
+            self._buffer.clear()
+        self._flushed_at = time.monotonic()
+
+    def sync(self):
+        """Flush and fsync, so every record written so far survives a crash."""
+        self.flush()
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def export(self):
+        """Write the rows pending export to a new Parquet part file."""
+        # The JSONL records are made durable first, so the Parquet dataset never holds rows the JSONL lacks
+        self.sync()
+        if self._pending_rows and self.parquet_dir:
+            try:
+                path = write_parquet(self._pending_rows, self.parquet_dir)
+                print(f"Exported {len(self._pending_rows)} results to {path}")
+                self.exported += len(self._pending_rows)
+                self._pending_rows.clear()
+            except Exception as e:
+                # Keep the rows for the next attempt; the JSONL file still has them
+                print(f"WARNING: Parquet export failed ({type(e).__name__}: {e})")
+        self._exported_at = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._pending_rows:
+            self.export()
+        else:
+            self.sync()
+        self._file.close()
+
+
+def export_jsonl(jsonl_path: str, parquet_dir: str, rows_per_file: int = RESULTS_EXPORT_ROWS) -> int:
+    """
+    Rebuild Parquet part files from a results JSONL file, e.g. for runs made without RESULTS_PARQUET_DIR.
+    Returns:
+        int: Number of rows exported.
+    """
+    rows = []
+    exported = 0
+    with open(jsonl_path, "r", encoding="utf-8") as jsonl_file:
+        for line in jsonl_file:
+            if not line.strip():
+                continue
+            rows.append(flatten_record(json.loads(line)))
+            if len(rows) >= rows_per_file:
+                write_parquet(rows, parquet_dir)
+                exported += len(rows)
+                rows = []
+    if rows:
+        write_parquet(rows, parquet_dir)
+        exported += len(rows)
+    return exported
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Export a results JSONL file to Parquet part files.')
+    parser.add_argument('jsonl', type=str, help='Results JSONL file written by the batch runner')
+    parser.add_argument('parquet_dir', type=str, help='Directory receiving the Parquet part files')
+    args = parser.parse_args()
+    print(f"Exported {export_jsonl(args.jsonl, args.parquet_dir)} rows to {args.parquet_dir}")
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import asyncio
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+# JSON policy file (see SafetyPolicy.from_dict); without one every check is escalated
+SAFETY_POLICY_PATH = os.getenv("SAFETY_POLICY_PATH")
+# Unattended escalations wait this long for a decision file before the check is rejected
+SAFETY_ESCALATION_TIMEOUT_SECONDS = float(os.getenv("SAFETY_ESCALATION_TIMEOUT_SECONDS", "900"))
+SAFETY_ESCALATION_DIR = os.getenv("SAFETY_ESCALATION_DIR", ".safety_escalations")
+SAFETY_AUDIT_LOG = os.getenv("SAFETY_AUDIT_LOG", "safety_audit.jsonl")
+# Ask on the terminal instead of through escalation files; defaults to on when stdin is a terminal
+SAFETY_INTERACTIVE = os.getenv("SAFETY_INTERACTIVE", "auto")
+ESCALATION_POLL_SECONDS = 2
+
+DECISIONS = ("allow", "reject", "escalate")
+
+# Invoice the current task is working on, attached to audit records and escalation requests
+safety_context = contextvars.ContextVar("safety_context", default={})
+
+
+class SafetyCheckRejected(ValueError):
+    """Raised when a pending safety check is rejected by the policy, an operator or an escalation timeout."""
+
+
+def _host_matches(hostname: str, hosts) -> bool:
+    return any(hostname == host or hostname.endswith(f".{host}") for host in hosts)
+
+
+@dataclass(frozen=True)
+class SafetyRule:
+    """Decision for safety checks matching every given criterion; empty criteria match anything."""
+
+    decision: str
+    # Safety check codes, e.g. malicious_instructions, irrelevant_domain, sensitive_domain
+    codes: tuple = ()
+    # Hosts (and their subdomains) of the page the agent is on
+    hosts: tuple = ()
+
+    def matches(self, code: str, hostname: str) -> bool:
+        if self.codes and code not in self.codes:
+            return False
+        if self.hosts and not _host_matches(hostname, self.hosts):
+            return False
+        return True
+
+
+@dataclass(frozen=True)
+class SafetyPolicy:
+    """Ordered rules; the first matching rule decides, otherwise default applies."""
+
+    rules: tuple = field(default_factory=tuple)
+    default: str = "escalate"
+    escalation_timeout: float = SAFETY_ESCALATION_TIMEOUT_SECONDS
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SafetyPolicy":
+        """
+        Build a policy from e.g.
+        {"rules": [{"decision": "reject", "codes": ["malicious_instructions"]},
+                   {"decision": "allow", "codes": ["irrelevant_domain"], "hosts": ["procurement.example.com"]}],
+         "default": "escalate", "escalation_timeout": 900}
+        """
+        rules = []
+        for rule in data.get("rules", []):
+            if rule.get("decision") not in DECISIONS:
+                raise ValueError(f"Unknown safety rule decision '{rule.get('decision')}'. Available: {', '.join(DECISIONS)}")
+            rules.append(SafetyRule(rule["decision"], tuple(rule.get("codes", ())), tuple(rule.get("hosts", ()))))
+        default = data.get("default", "escalate")
+        if default not in DECISIONS:
+            raise ValueError(f"Unknown default safety decision '{default}'. Available: {', '.join(DECISIONS)}")
+        return cls(tuple(rules), default, float(data.get("escalation_timeout", SAFETY_ESCALATION_TIMEOUT_SECONDS)))
+
+    @classmethod
+    def load(cls, path: str) -> "SafetyPolicy":
+        with open(path, "r", encoding="utf-8") as policy_file:
+            return cls.from_dict(json.load(policy_file))
+
+    def decide(self, code: str, url: str):
+        """Return (decision, reason) for a check raised while the agent is on url."""
+        hostname = urlparse(url or "").hostname or ""
+        for index, rule in enumerate(self.rules):
+            if rule.matches(code, hostname):
+                return rule.decision, f"rule {index}"
+        return self.default, "default"
+
+
+def _check_field(check, name):
+    return getattr(check, name, None) if not isinstance(check, dict) else check.get(name)
+
+
+def _interactive() -> bool:
+    if SAFETY_INTERACTIVE == "auto":
+        return sys.stdin is not None and sys.stdin.isatty()
+    return SAFETY_INTERACTIVE.lower() in ("1", "true", "yes")
+
+
+def audit(record: dict, path: str = SAFETY_AUDIT_LOG):
+    """Append one decision to the JSONL audit log (single appends stay whole across worker processes)."""
+    record = {"time": time.time(), "pid": os.getpid(), **safety_context.get(), **record}
+    with open(path, "a", encoding="utf-8") as audit_file:
+        audit_file.write(json.dumps(record, default=str) + "\n")
+
+
+# Lines typed on the terminal; a single long-lived thread reads stdin, so a timed-out prompt leaves no reader behind
+_answers = None
+# Concurrent escalations ask one at a time (one lock per event loop)
+_prompt_lock = None
+_prompt_lock_loop = None
+
+
+def _read_answers(stream, answers):
+    for line in stream:
+        answers.put(line)
+
+
+def _operator_answers() -> queue.Queue:
+    global _answers
+    if _answers is None:
+        _answers = queue.Queue()
+        threading.Thread(target=_read_answers, args=(sys.stdin, _answers), name="safety-stdin", daemon=True).start()
+    return _answers
+
+
+def _get_prompt_lock() -> asyncio.Lock:
+    global _prompt_lock, _prompt_lock_loop
+    loop = asyncio.get_running_loop()
+    if _prompt_lock is None or _prompt_lock_loop is not loop:
+        _prompt_lock = asyncio.Lock()
+        _prompt_lock_loop = loop
+    return _prompt_lock
+
+
+async def _ask_operator(message: str, timeout: float):
+    """Ask on the terminal without blocking the event loop. Returns True/False, or None on timeout."""
+    answers = _operator_answers()
+    async with _get_prompt_lock():
+        # Answers typed while no question was open (e.g. too late for a timed-out one) belong to no prompt
+        while not answers.empty():
+            answers.get_nowait()
+        print(f"Safety Check Warning: {message}\nDo you want to acknowledge and proceed? (y/n): ", end="", flush=True)
+        try:
+            response = await asyncio.to_thread(answers.get, timeout=timeout)
+        except queue.Empty:
+            print()
+            return None
+    return response.strip().lower() == "y"
+
+
+async def _await_decision_file(request: dict, timeout: float, directory: str = SAFETY_ESCALATION_DIR):
+    """
+    Park the calling task until an operator writes {id}.decision ("approve" or "reject") next to the
+    {id}.json escalation request. Returns True/False, or None on timeout.
+    """
+    os.makedirs(directory, exist_ok=True)
+    request_path = os.path.join(directory, f"{request['id']}.json")
+    decision_path = os.path.join(directory, f"{request['id']}.decision")
+    with open(request_path, "w", encoding="utf-8") as request_file:
+        json.dump(request, request_file, indent=2, default=str)
+    print(f"Safety check escalated; waiting up to {timeout:.0f}s for {decision_path} ('approve' or 'reject')")
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            try:
+                with open(decision_path, "r", encoding="utf-8") as decision_file:
+                    decision = decision_file.read().strip().lower()
+            except FileNotFoundError:
+                await asyncio.sleep(ESCALATION_POLL_SECONDS)
+                continue
+            return decision in ("approve", "approved", "allow", "y", "yes")
+        return None
+    finally:
+        for path in (request_path, decision_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SafetyCheckReviewer:
+    """Applies a SafetyPolicy to pending safety checks, escalating undecided ones and auditing every decision."""
+
+    def __init__(self, policy: SafetyPolicy = None):
+        self.policy = policy or SafetyPolicy()
+
+    async def review(self, pending_checks, current_url: str):
+        """
+        Decide every pending safety check of a computer call.
+        Escalations only suspend the calling task, so other invoices keep running meanwhile.
+        Args:
+            pending_checks (list): The call's pending_safety_checks.
+            current_url (str): URL of the page the agent is on.
+        Returns:
+            list: The checks to acknowledge.
+        Raises:
+            SafetyCheckRejected: If any check is rejected or its escalation times out.
+        """
+        acknowledged = []
+        for check in pending_checks:
+            code = _check_field(check, "code") or ""
+            message = _check_field(check, "message") or ""
+            decision, reason = self.policy.decide(code, current_url)
+            if decision == "escalate":
+                if _interactive():
+                    approved = await _ask_operator(message, self.policy.escalation_timeout)
+                    reason = "operator"
+                else:
+                    request = {
+                        "id": uuid.uuid4().hex,
+                        "check_id": _check_field(check, "id"),
+                        "code": code,
+                        "message": message,
+                        "url": current_url,
+                        **safety_context.get(),
+                    }
+                    approved = await _await_decision_file(request, self.policy.escalation_timeout)
+                    reason = "escalation"
+                if approved is None:
+                    decision, reason = "reject", f"{reason} timeout"
+                else:
+                    decision = "allow" if approved else "reject"
+            audit({
+                "check_id": _check_field(check, "id"),
+                "code": code,
+                "message": message,
+                "url": current_url,
+                "decision": decision,
+                "reason": reason,
+            })
+            if decision != "allow":
+                raise SafetyCheckRejected(f"Safety check failed: {message} ({code}, {reason})")
+            acknowledged.append(check)
+        return acknowledged
+
+
+_reviewer = None
+
+
+def get_safety_reviewer() -> SafetyCheckReviewer:
+    """Return the process-wide reviewer for the policy in SAFETY_POLICY_PATH (escalate everything if unset)."""
+    global _reviewer
+    if _reviewer is None:
+        policy = SafetyPolicy.load(SAFETY_POLICY_PATH) if SAFETY_POLICY_PATH else SafetyPolicy()
+        _reviewer = SafetyCheckReviewer(policy)
+    return _reviewer
@@ -0,0 +1,292 @@
+import os
+import json
+import math
+import time
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+# Priority lanes, most urgent first; an invoice's lane is its rank in this tuple
+LANES = ("high", "normal", "low")
+LANE_RANK = {lane: rank for rank, lane in enumerate(LANES)}
+DEFAULT_LANE = "normal"
+# Seconds a queued invoice needs to move up one lane, so low-priority work is not starved during a backlog (0 disables aging)
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "300"))
+# Browser slots per worker kept free for high-lane and at-risk invoices (at most concurrency - 1). A reserved slot
+# stays idle while no such invoice is queued, so only reserve slots when urgent invoices arrive during a backlog.
+SCHEDULER_RESERVED_SLOTS = int(os.getenv("SCHEDULER_RESERVED_SLOTS", "0"))
+# Initial estimate of one invoice's run time; refined from the invoices the worker finishes
+SCHEDULER_EXPECTED_SECONDS = float(os.getenv("SCHEDULER_EXPECTED_SECONDS", "180"))
+# An invoice is at risk when it cannot start this long before (deadline - expected run time)
+SCHEDULER_RISK_MARGIN_SECONDS = float(os.getenv("SCHEDULER_RISK_MARGIN_SECONDS", "60"))
+# Interval of the lane metrics printed by each worker, and an optional JSONL file receiving them
+SCHEDULER_METRICS_SECONDS = float(os.getenv("SCHEDULER_METRICS_SECONDS", "30"))
+SCHEDULER_METRICS_PATH = os.getenv("SCHEDULER_METRICS_PATH")
+# How often a worker with every free slot reserved re-checks the queue for invoices that became urgent
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "5"))
+# Weight of the newest run time in the expected run time
+DURATION_SMOOTHING = 0.2
+
+
+def parse_deadline(value):
+    """Parse a deadline given as epoch seconds or an ISO 8601 timestamp (UTC when no offset is given). None stays None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def lane_rank(lane) -> int:
+    """Rank of a lane name (or an already numeric rank)."""
+    if lane is None:
+        return LANE_RANK[DEFAULT_LANE]
+    if isinstance(lane, int):
+        return min(max(lane, 0), len(LANES) - 1)
+    if lane not in LANE_RANK:
+        raise ValueError(f"Unknown priority '{lane}'. Available: {', '.join(LANES)}")
+    return LANE_RANK[lane]
+
+
+def effective_rank(rank: int, waited: float, aging_seconds: float = SCHEDULER_AGING_SECONDS) -> int:
+    """Lane rank after aging: one lane up for every aging_seconds spent waiting."""
+    if aging_seconds <= 0:
+        return rank
+    return max(0, rank - int(max(0.0, waited) / aging_seconds))
+
+
+@dataclass
+class InvoiceJob:
+    """One invoice to process, with its lane and optional deadline (epoch seconds)."""
+
+    image_path: str
+    rank: int = LANE_RANK[DEFAULT_LANE]
+    deadline: float = None
+    invoice_key: str = None
+    enqueued_at: float = field(default_factory=time.time)
+
+    @property
+    def lane(self) -> str:
+        return LANES[self.rank]
+
+    def at_risk(self, expected_seconds: float, now: float = None, margin: float = SCHEDULER_RISK_MARGIN_SECONDS) -> bool:
+        """Whether starting now (or later) may finish after the deadline."""
+        if self.deadline is None:
+            return False
+        return (now or time.time()) + expected_seconds + margin >= self.deadline
+
+    def sort_key(self, expected_seconds: float, now: float, aging_seconds: float = SCHEDULER_AGING_SECONDS):
+        """At-risk invoices first, then by aged lane, earliest deadline and arrival."""
+        return (
+            not self.at_risk(expected_seconds, now),
+            effective_rank(self.rank, now - self.enqueued_at, aging_seconds),
+            self.deadline if self.deadline is not None else math.inf,
+            self.enqueued_at,
+        )
+
+    def record_fields(self) -> dict:
+        """Lane and deadline fields for the invoice's result record."""
+        fields = {"lane": self.lane}
+        if self.deadline is not None:
+            fields["deadline"] = self.deadline
+            fields["missed_deadline"] = time.time() > self.deadline
+        return fields
+
+
+def load_manifest(path: str):
+    """
+    Read a JSONL job manifest with one {"image_path": ..., "priority": "high|normal|low", "deadline": ...} per line.
+    Relative image paths are resolved against the manifest's directory.
+    Returns:
+        list[InvoiceJob]: The jobs, in file order.
+    """
+    jobs = []
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image_path = entry["image_path"]
+            if not os.path.isabs(image_path) and not os.path.exists(image_path):
+                image_path = os.path.join(base, image_path)
+            jobs.append(InvoiceJob(image_path, lane_rank(entry.get("priority")), parse_deadline(entry.get("deadline"))))
+    return jobs
+
+
+def urgency_order(jobs, expected_seconds: float = SCHEDULER_EXPECTED_SECONDS):
+    """Sort jobs most urgent first, e.g. before sharding them across workers."""
+    now = time.time()
+    return sorted(jobs, key=lambda job: job.sort_key(expected_seconds, now))
+
+
+class LocalJobSource:
+    """Jobs held in memory by one worker (shard mode)."""
+
+    def __init__(self, jobs):
+        self._jobs = list(jobs)
+
+    def next_job(self, urgent_only: bool, expected_seconds: float, aging_seconds: float):
+        if not self._jobs:
+            return None
+        now = time.time()
+        job = min(self._jobs, key=lambda job: job.sort_key(expected_seconds, now, aging_seconds))
+        if urgent_only and not _is_urgent(job, expected_seconds, now, aging_seconds):
+            return None
+        self._jobs.remove(job)
+        return job
+
+    def queued(self):
+        return list(self._jobs)
+
+
+class StoreJobSource:
+    """Jobs claimed from the durable state store, shared by all workers (queue mode)."""
+
+    def __init__(self, store, worker_name: str):
+        self.store = store
+        self.worker_name = worker_name
+
+    def next_job(self, urgent_only: bool, expected_seconds: float, aging_seconds: float):
+        claimed = self.store.claim_next(
+            self.worker_name,
+            urgent_only=urgent_only,
+            risk_before=time.time() + expected_seconds + SCHEDULER_RISK_MARGIN_SECONDS,
+            aging_seconds=aging_seconds,
+        )
+        if claimed is None:
+            return None
+        invoice_key, image_path, rank, deadline, enqueued_at = claimed
+        return InvoiceJob(image_path, lane_rank(rank), deadline, invoice_key, enqueued_at)
+
+    def queued(self):
+        return [
+            InvoiceJob(image_path, lane_rank(rank), deadline, invoice_key, enqueued_at)
+            for invoice_key, image_path, rank, deadline, enqueued_at in self.store.claimable_invoices()
+        ]
+
+
+def _is_urgent(job, expected_seconds, now, aging_seconds):
+    return job.at_risk(expected_seconds, now) or effective_rank(job.rank, now - job.enqueued_at, aging_seconds) == 0
+
+
+class DeadlineScheduler:
+    """
+    Runs invoices from a job source on a fixed number of browser slots, most urgent first. Optionally some slots are
+    reserved for high-lane and at-risk invoices so they start promptly during a backlog; queued invoices age into higher
+    lanes so low-priority work still progresses. Model calls made for an invoice carry its priority class to the
+    rate limiter (see common/model_calls.py).
+    """
+
+    def __init__(self, source, run_job, slots: int, name: str = "scheduler", reserved_slots: int = SCHEDULER_RESERVED_SLOTS,
+                 aging_seconds: float = SCHEDULER_AGING_SECONDS, expected_seconds: float = SCHEDULER_EXPECTED_SECONDS,
+                 metrics_seconds: float = SCHEDULER_METRICS_SECONDS, metrics_path: str = SCHEDULER_METRICS_PATH,
+                 poll_seconds: float = SCHEDULER_POLL_SECONDS):
+        """
+        Args:
+            source: LocalJobSource or StoreJobSource.
+            run_job: Async callable processing one InvoiceJob.
+            slots (int): Invoices run concurrently.
+            name (str): Prefix of the printed metrics, e.g. the worker name.
+        """
+        self.source = source
+        self.run_job = run_job
+        self.slots = max(1, slots)
+        self.reserved_slots = min(max(0, reserved_slots), self.slots - 1)
+        self.name = name
+        self.aging_seconds = aging_seconds
+        self.expected_seconds = expected_seconds
+        self.metrics_seconds = metrics_seconds
+        self.metrics_path = metrics_path
+        self.poll_seconds = poll_seconds
+        self._running = {}
+        self._warned = set()
+        self._done = {lane: 0 for lane in LANES}
+        self._missed = {lane: 0 for lane in LANES}
+
+    def _next_job(self):
+        free = self.slots - len(self._running)
+        return self.source.next_job(free <= self.reserved_slots, self.expected_seconds, self.aging_seconds)
+
+    async def _run(self, job):
+        from .model_calls import priority_class
+
+        # The task runs in its own copy of the context, so this only affects this invoice's model calls
+        urgent = job.at_risk(self.expected_seconds)
+        priority_class.set(0 if urgent else effective_rank(job.rank, time.time() - job.enqueued_at, self.aging_seconds))
+        started = time.time()
+        try:
+            await self.run_job(job)
+        finally:
+            elapsed = time.time() - started
+            self.expected_seconds += DURATION_SMOOTHING * (elapsed - self.expected_seconds)
+            self._done[job.lane] += 1
+            if job.deadline is not None and time.time() > job.deadline:
+                self._missed[job.lane] += 1
+                print(f"[{self.name}] {job.invoice_key or job.image_path} ({job.lane}) missed its deadline by {time.time() - job.deadline:.0f}s")
+
+    async def run(self):
+        """Process jobs until the source is drained."""
+        last_metrics = time.monotonic()
+        try:
+            while True:
+                while len(self._running) < self.slots:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    self._running[asyncio.create_task(self._run(job))] = job
+                if not self._running:
+                    return
+                finished, _ = await asyncio.wait(
+                    self._running, timeout=self.poll_seconds, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in finished:
+                    del self._running[task]
+                    if task.exception() is not None:
+                        print(f"[{self.name}] invoice failed outside the pipeline: {task.exception()}")
+                if self.metrics_seconds > 0 and time.monotonic() - last_metrics >= self.metrics_seconds:
+                    self.emit_metrics()
+                    last_metrics = time.monotonic()
+        finally:
+            self.emit_metrics()
+
+    def metrics(self) -> dict:
+        """Queued and running invoices per lane, how many are at risk of missing their deadline, and how many missed it."""
+        now = time.time()
+        queued = self.source.queued()
+        running = list(self._running.values())
+        at_risk = [job for job in queued + running if job.at_risk(self.expected_seconds, now)]
+        for job in at_risk:
+            job_id = job.invoice_key or job.image_path
+            if job_id not in self._warned:
+                self._warned.add(job_id)
+                print(f"[{self.name}] WARNING: {job_id} ({job.lane}) is at risk of missing its deadline "
+                      f"(due in {job.deadline - now:.0f}s, expected run time {self.expected_seconds:.0f}s)")
+        return {
+            "name": self.name,
+            "time": now,
+            "queued": {lane: sum(job.lane == lane for job in queued) for lane in LANES},
+            "running": {lane: sum(job.lane == lane for job in running) for lane in LANES},
+            "at_risk": len(at_risk),
+            "done": dict(self._done),
+            "missed_deadline": dict(self._missed),
+            "expected_seconds": round(self.expected_seconds, 1),
+        }
+
+    def emit_metrics(self) -> dict:
+        """Print the lane metrics and append them to metrics_path."""
+        record = self.metrics()
+        lanes = ", ".join(f"{lane} {record['queued'][lane]}/{record['running'][lane]}" for lane in LANES)
+        print(f"[{self.name}] queued/running: {lanes}; at risk {record['at_risk']}; "
+              f"missed deadline {sum(record['missed_deadline'].values())} of {sum(record['done'].values())} done")
+        if self.metrics_path:
+            with open(self.metrics_path, "a", encoding="utf-8") as metrics_file:
+                metrics_file.write(json.dumps(record) + "\n")
+        return record
@@ -0,0 +1,69 @@
+import os
+import re
+import json
+import time
+import tempfile
+from urllib.parse import urlparse
+
+AUTH_STATE_DIR = os.getenv("AUTH_STATE_DIR", ".auth")
+# Saved sessions older than this are not reused, even if their cookies have not expired
+AUTH_STATE_MAX_AGE_SECONDS = int(os.getenv("AUTH_STATE_MAX_AGE_SECONDS", "28800"))
+# Treat cookies expiring within this margin as already expired
+COOKIE_EXPIRY_MARGIN_SECONDS = 60
+
+
+def session_app_for(url: str) -> str:
+    """Key saved sessions by the target app's host."""
+    if not url:
+        return ""
+    return urlparse(url).hostname or ""
+
+
+class StorageStateStore:
+    """Saves Playwright storage state (cookies and local storage) per target app so sessions start authenticated."""
+
+    def __init__(self, directory: str = AUTH_STATE_DIR, max_age_seconds: int = AUTH_STATE_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+
+    def path_for(self, app: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", app) + ".json")
+
+    def load(self, app: str):
+        """Return the path of a usable saved state for app, or None if there is none or it has expired."""
+        path = self.path_for(app)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                print(f"Saved browser session for {app} is older than {self.max_age_seconds}s; starting fresh.")
+                return None
+            with open(path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        deadline = time.time() + COOKIE_EXPIRY_MARGIN_SECONDS
+        # Session cookies report expires == -1
+        if any(0 < cookie.get("expires", -1) < deadline for cookie in state.get("cookies", [])):
+            print(f"Saved browser session for {app} has expired cookies; starting fresh.")
+            return None
+        return path
+
+    async def save(self, context, app: str):
+        """Write the context's storage state for app (readable by the current user only)."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(app)
+        # A unique temp file per save, so concurrent sessions for the same app never write to the same file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            await context.storage_state(path=tmp_path)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def invalidate(self, app: str):
+        try:
+            os.remove(self.path_for(app))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+DEFAULT_STATE_DB = os.getenv("P2P_STATE_DB", "p2p_state.db")
+# Failed invoices are handed out again until they have been attempted this many times
+MAX_ATTEMPTS = int(os.getenv("P2P_MAX_ATTEMPTS", "3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    invoice_key TEXT PRIMARY KEY,
+    image_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 1,
+    deadline REAL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    invoice_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (invoice_key, stage)
+);
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    job_id TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    invoice_keys TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'submitted',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posted_invoices (
+    supplier_id TEXT NOT NULL,
+    invoice_number TEXT NOT NULL,
+    invoice_key TEXT,
+    status TEXT,
+    source TEXT NOT NULL,
+    posted_at REAL NOT NULL,
+    PRIMARY KEY (supplier_id, invoice_number)
+);
+"""
+# Columns added after the first release, with their definitions, for upgrading existing state stores
+_ADDED_COLUMNS = {
+    "invoices": {"priority": "INTEGER NOT NULL DEFAULT 1", "deadline": "REAL"},
+}
+# Priority class of invoices enqueued without one (the "normal" lane of common.scheduler)
+DEFAULT_PRIORITY = 1
+_CLAIMABLE = "(status = 'pending' OR (status = 'failed' AND attempts < :max_attempts))"
+
+
+def _ledger_key(supplier_id, invoice_number):
+    return str(supplier_id).strip().upper(), str(invoice_number).strip().upper()
+
+
+def invoice_key_for(image_path: str) -> str:
+    """Key an invoice by its image content so copies of the same file are deduplicated."""
+    with open(image_path, "rb") as image_file:
+        return hashlib.sha256(image_file.read()).hexdigest()[:32]
+
+
+class InvoiceStateStore:
+    """SQLite-backed work queue that checkpoints the output of each pipeline stage per invoice."""
+
+    def __init__(self, path: str = DEFAULT_STATE_DB):
+        self.path = path
+        # Autocommit mode; multi-statement updates use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def close(self):
+        self._conn.close()
+
+    def enqueue(self, image_path: str, priority: int = None, deadline: float = None) -> str:
+        """
+        Add an invoice to the queue. Invoices already known to the store keep their state.
+        Args:
+            image_path (str): Invoice image.
+            priority (int): Priority class, 0 = most urgent (see common/scheduler.py). Updates a known invoice when given.
+            deadline (float): Epoch seconds by which the invoice should be processed. Updates a known invoice when given.
+        Returns:
+            str: The invoice key.
+        """
+        invoice_key = invoice_key_for(image_path)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO invoices (invoice_key, image_path, updated_at, priority, deadline) VALUES (?, ?, ?, ?, ?)",
+            (invoice_key, image_path, time.time(), DEFAULT_PRIORITY if priority is None else priority, deadline),
+        )
+        if priority is not None:
+            self._conn.execute("UPDATE invoices SET priority = ? WHERE invoice_key = ?", (priority, invoice_key))
+        if deadline is not None:
+            self._conn.execute("UPDATE invoices SET deadline = ? WHERE invoice_key = ?", (deadline, invoice_key))
+        return invoice_key
+
+    def requeue_running(self) -> int:
+        """Return invoices left 'running' by a crashed worker to the queue."""
+        cursor = self._conn.execute(
+            "UPDATE invoices SET status = 'pending', claimed_by = NULL, updated_at = ? WHERE status = 'running'",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+    def claim_next(self, worker_id: str, urgent_only: bool = False, risk_before: float = None, aging_seconds: float = 0):
+        """
+        Atomically claim the next pending (or retryable failed) invoice. Invoices whose deadline falls before
+        risk_before go first, then by priority (improved by one class per aging_seconds waited), deadline and attempts.
+        Args:
+            worker_id (str): Recorded as the claimant.
+            urgent_only (bool): Only claim an invoice that is at risk or of (aged) priority 0.
+            risk_before (float): Epoch seconds; deadlines before it count as at risk. Defaults to now.
+            aging_seconds (float): Seconds of waiting per priority class gained; 0 disables aging.
+        Returns:
+            tuple: (invoice_key, image_path, priority, deadline, updated_at) or None when nothing is claimable.
+        """
+        now = time.time()
+        at_risk = "(deadline IS NOT NULL AND deadline < :risk_before)"
+        if aging_seconds > 0:
+            aged_priority = "MAX(0, priority - CAST((:now - updated_at) / :aging AS INTEGER))"
+        else:
+            aged_priority = "priority"
+        urgent_filter = f" AND ({at_risk} OR {aged_priority} = 0)" if urgent_only else ""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT invoice_key, image_path, priority, deadline, updated_at FROM invoices "
+                f"WHERE {_CLAIMABLE}{urgent_filter} "
+                f"ORDER BY {at_risk} DESC, {aged_priority}, deadline IS NULL, deadline, attempts, rowid LIMIT 1",
+                {"max_attempts": MAX_ATTEMPTS, "risk_before": risk_before or now, "now": now, "aging": aging_seconds},
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE invoices SET status = 'running', claimed_by = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE invoice_key = ?",
+                    (worker_id, time.time(), row[0]),
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return tuple(row) if row else None
+
+    def mark_done(self, invoice_key: str):
+        self._set_status(invoice_key, "done", None)
+
+    def mark_failed(self, invoice_key: str, error: str):
+        self._set_status(invoice_key, "failed", error)
+
+    def _set_status(self, invoice_key, status, error):
+        self._conn.execute(
+            "UPDATE invoices SET status = ?, last_error = ?, claimed_by = NULL, updated_at = ? WHERE invoice_key = ?",
+            (status, error, time.time(), invoice_key),
+        )
+
+    def save_checkpoint(self, invoice_key: str, stage: str, output):
+        """Persist the output of a completed stage."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO checkpoints (invoice_key, stage, output, created_at) VALUES (?, ?, ?, ?)",
+            (invoice_key, stage, json.dumps(output, default=str), time.time()),
+        )
+
+    def load_checkpoints(self, invoice_key: str) -> dict:
+        """Return the outputs of all completed stages of an invoice, keyed by stage name."""
+        rows = self._conn.execute(
+            "SELECT stage, output FROM checkpoints WHERE invoice_key = ?", (invoice_key,)
+        ).fetchall()
+        return {stage: json.loads(output) for stage, output in rows}
+
+    def claimable_invoices(self):
+        """Return (invoice_key, image_path, priority, deadline, updated_at) of every invoice waiting to be claimed."""
+        return [
+            tuple(row)
+            for row in self._conn.execute(
+                f"SELECT invoice_key, image_path, priority, deadline, updated_at FROM invoices WHERE {_CLAIMABLE} ORDER BY rowid",
+                {"max_attempts": MAX_ATTEMPTS},
+            ).fetchall()
+        ]
+
+    def status_counts(self) -> dict:
+        rows = self._conn.execute("SELECT status, COUNT(*) FROM invoices GROUP BY status").fetchall()
+        return dict(rows)
+
+    def record_batch_job(self, job_id: str, stage: str, backend: str, invoice_keys):
+        """Remember a submitted offline batch job so an interrupted run polls it instead of resubmitting."""
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO batch_jobs (job_id, stage, backend, invoice_keys, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'submitted', ?, ?)",
+            (job_id, stage, backend, json.dumps(list(invoice_keys)), now, now),
+        )
+
+    def finish_batch_job(self, job_id: str, status: str):
+        self._conn.execute(
+            "UPDATE batch_jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id)
+        )
+
+    def open_batch_jobs(self, backend: str = None):
+        """Return the submitted, unfinished batch jobs as (job_id, stage, invoice_keys) tuples."""
+        query = "SELECT job_id, stage, invoice_keys FROM batch_jobs WHERE status = 'submitted'"
+        params = ()
+        if backend:
+            query += " AND backend = ?"
+            params = (backend,)
+        rows = self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [(job_id, stage, json.loads(invoice_keys)) for job_id, stage, invoice_keys in rows]
+
+    def claim_all(self, worker_id: str):
+        """
+        Atomically claim every pending (or retryable failed) invoice, e.g. for an offline batch run.
+        Each claim counts as an attempt, so invoices that keep failing stop after MAX_ATTEMPTS like in claim_next.
+        Returns:
+            list: (invoice_key, image_path) of the claimed invoices.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._conn.execute(
+                f"SELECT invoice_key, image_path FROM invoices WHERE {_CLAIMABLE} ORDER BY rowid",
+                {"max_attempts": MAX_ATTEMPTS},
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE invoices SET status = 'running', claimed_by = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE invoice_key = ?",
+                [(worker_id, time.time(), row[0]) for row in rows],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return [tuple(row) for row in rows]
+
+    def find_posting(self, supplier_id, invoice_number):
+        """Look up the posting ledger. Returns the ledger entry as a dict, or None if the invoice was never posted."""
+        row = self._conn.execute(
+            "SELECT invoice_key, status, source, posted_at FROM posted_invoices WHERE supplier_id = ? AND invoice_number = ?",
+            _ledger_key(supplier_id, invoice_number),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"invoice_key": row[0], "status": row[1], "source": row[2], "posted_at": row[3]}
+
+    def record_posting(self, supplier_id, invoice_number, invoice_key=None, status=None, source="posted"):
+        """Record that an invoice exists in the procurement system.
+        source is 'posted' when this pipeline created it, or 'verified' when it was found on the invoice list page."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO posted_invoices (supplier_id, invoice_number, invoice_key, status, source, posted_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (*_ledger_key(supplier_id, invoice_number), invoice_key, status, source, time.time()),
+        )
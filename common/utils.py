@@ -1,9 +1,7 @@
 import os
-import requests
 from dotenv import load_dotenv
 import json
 import base64
-from PIL import Image
 from io import BytesIO
 import io
 from urllib.parse import urlparse
@@ -25,12 +23,16 @@ def pp(obj):
 
 
 def show_image(base_64_image):
+    from PIL import Image
+
     image_data = base64.b64decode(base_64_image)
     image = Image.open(BytesIO(image_data))
     image.show()
 
 
 def calculate_image_dimensions(base_64_image):
+    from PIL import Image
+
     image_data = base64.b64decode(base_64_image)
     image = Image.open(io.BytesIO(image_data))
     return image.size
@@ -48,6 +50,8 @@ def sanitize_message(msg: dict) -> dict:
 
 
 def create_response(**kwargs):
+    import requests
+
     url = "https://api.openai.com/v1/responses"
     headers = {
         "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
@@ -66,11 +70,16 @@ def create_response(**kwargs):
     return response.json()
 
 
-def check_blocklisted_url(url: str) -> None:
-    """Raise ValueError if the given URL (including subdomains) is in the blocklist."""
+def is_blocklisted_url(url: str) -> bool:
+    """Return True if the given URL's host (including subdomains) is in the blocklist."""
     hostname = urlparse(url).hostname or ""
-    if any(
+    return any(
         hostname == blocked or hostname.endswith(f".{blocked}")
         for blocked in BLOCKED_DOMAINS
-    ):
-        raise ValueError(f"Blocked URL: {url}")
\ No newline at end of file
+    )
+
+
+def check_blocklisted_url(url: str) -> None:
+    """Raise ValueError if the given URL (including subdomains) is in the blocklist."""
+    if is_blocklisted_url(url):
+        raise ValueError(f"Blocked URL: {url}")
@@ -0,0 +1,313 @@
+# Procure-to-Pay Automation - Offline Batch Mode
+# For backlogs where throughput matters more than latency: invoice extraction and anomaly verdicts are
+# collected into JSONL batch jobs and submitted through a batch backend (common/batch_jobs.py), while the
+# browser-bound steps (contract retrieval, posting) run as soon as each job's results land.
+# All progress is kept in the durable state store, so an interrupted run resumes and polls its open jobs.
+
+import os
+import glob
+import time
+import uuid
+import asyncio
+
+from common.batch_jobs import OFFLINE_BATCH_DIR, TERMINAL_STATUSES, batch_line, get_batch_backend, parse_result_line, write_batch_file
+from common.state_store import DEFAULT_STATE_DB, InvoiceStateStore
+
+# Requests per batch job; smaller jobs let the browser steps start earlier
+OFFLINE_BATCH_SIZE = int(os.getenv("OFFLINE_BATCH_SIZE", "100"))
+OFFLINE_BATCH_POLL_SECONDS = float(os.getenv("OFFLINE_BATCH_POLL_SECONDS", "30"))
+# Invoices ready for a verdict are submitted once this many are waiting, or after this many seconds
+OFFLINE_VERDICT_FLUSH_SECONDS = float(os.getenv("OFFLINE_VERDICT_FLUSH_SECONDS", "60"))
+DEFAULT_BROWSER_CONCURRENCY = int(os.getenv("BATCH_WORKER_CONCURRENCY", "2"))
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), max(1, size))]
+
+
+def browser_step_error(results):
+    """
+    Return the error of a contract or business rules retrieval that failed, or None.
+    Failed steps are not checkpointed, so posting would retrieve them again after the verdict was computed
+    from the error; such invoices are failed and retried instead. A missing contractId is not a failure:
+    it needs no browser and by design produces a 'rejected' verdict.
+    """
+    contract_data = results.get("contract_data")
+    if isinstance(contract_data, dict) and str(contract_data.get("error", "")).startswith("Contract retrieval failed"):
+        return contract_data["error"]
+    business_rules = results.get("business_rules")
+    if isinstance(business_rules, str) and business_rules.startswith("Business rules retrieval failed"):
+        return business_rules
+    return None
+
+
+class OfflineBatchRun:
+    """One offline run over the invoices queued in a state store."""
+
+    def __init__(self, store, backend, batch_size=OFFLINE_BATCH_SIZE, browser_concurrency=DEFAULT_BROWSER_CONCURRENCY, sink=None):
+        self.store = store
+        self.backend = backend
+        self.batch_size = batch_size
+        self.browser_slots = asyncio.Semaphore(max(1, browser_concurrency))
+        self.sink = sink
+        self.image_paths = {}
+        self.verdict_queue = asyncio.Queue()
+        self.browser_tasks = []
+        self.posting_tasks = []
+        self.verdict_jobs = []
+        # Step outputs of the browser stage; a missing contract is not checkpointed but still feeds the verdict
+        self.step_results = {}
+
+    async def _submit(self, stage, lines, invoice_keys):
+        path = write_batch_file(lines, os.path.join(OFFLINE_BATCH_DIR, f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"))
+        job_id = await self.backend.submit(path)
+        self.store.record_batch_job(job_id, stage, self.backend.name, invoice_keys)
+        print(f"Submitted {stage} batch job {job_id} with {len(lines)} requests")
+        return job_id
+
+    async def _wait(self, job_id):
+        while True:
+            status = await self.backend.status(job_id)
+            if status in TERMINAL_STATUSES:
+                return status
+            if self.sink is not None:
+                # Records of invoices finished since the last poll reach the results file
+                self.sink.tick()
+            await asyncio.sleep(OFFLINE_BATCH_POLL_SECONDS)
+
+    async def _collect(self, job_id, stage, invoice_keys):
+        """Wait for a job and return {invoice_key: (response, error)}; invoices missing from the output get an error."""
+        status = await self._wait(job_id)
+        outputs = {}
+        if status == "completed":
+            for line in await self.backend.results(job_id):
+                custom_id, response, error = parse_result_line(line)
+                outputs[custom_id.split(":", 1)[1]] = (response, error)
+        self.store.finish_batch_job(job_id, status)
+        print(f"{stage} batch job {job_id} {status}: {len(outputs)} of {len(invoice_keys)} results")
+        return {key: outputs.get(key, (None, f"No result in {stage} batch job {job_id} ({status})")) for key in invoice_keys}
+
+    def _fail(self, invoice_key, error):
+        print(f"Invoice {invoice_key} failed: {error}")
+        self.store.mark_failed(invoice_key, error)
+        self._write_record({"image_path": self.image_paths.get(invoice_key), "invoice_key": invoice_key, "error": error})
+
+    def _write_record(self, record):
+        if self.sink is not None:
+            self.sink.write(record)
+
+    # --- extraction ---
+
+    async def run_extraction_job(self, job_id, invoice_keys):
+        from app_stepwise import parse_extraction_response
+
+        for invoice_key, (response, error) in (await self._collect(job_id, "extraction", invoice_keys)).items():
+            if response is not None:
+                try:
+                    self.store.save_checkpoint(invoice_key, "invoice_data", parse_extraction_response(response))
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                self._fail(invoice_key, f"Invoice extraction failed: {error}")
+            else:
+                self.start_browser_steps(invoice_key)
+
+    async def submit_extraction(self, invoice_keys):
+        from app_stepwise import MODEL, build_extraction_request, encode_image_to_base64
+
+        jobs = []
+        for chunk in _chunks(invoice_keys, self.batch_size):
+            lines = [
+                batch_line(f"extraction:{key}", build_extraction_request(encode_image_to_base64(self.image_paths[key]), MODEL))
+                for key in chunk
+            ]
+            jobs.append((await self._submit("extraction", lines, chunk), chunk))
+        return jobs
+
+    # --- contract and business rules (browser and vector store) ---
+
+    def start_browser_steps(self, invoice_key):
+        self.browser_tasks.append(asyncio.create_task(self._browser_steps(invoice_key)))
+
+    async def _browser_steps(self, invoice_key):
+        from app_stepwise import main
+
+        async with self.browser_slots:
+            try:
+                results = await main(
+                    image_path=self.image_paths[invoice_key], store=self.store, invoice_key=invoice_key, stop_before="verdict"
+                )
+            except Exception as e:
+                self._fail(invoice_key, f"Pipeline failed: {str(e)}")
+                return
+        error = browser_step_error(results)
+        if error:
+            self._fail(invoice_key, error)
+            return
+        self.step_results[invoice_key] = results
+        await self.verdict_queue.put(invoice_key)
+
+    # --- verdict ---
+
+    def _verdict_line(self, invoice_key):
+        from app_stepwise import ANOMALY_PROMPT_TEMPLATE, MODEL, build_verdict_request
+        from common.prompt_compaction import build_anomaly_prompt
+
+        steps = self.step_results.pop(invoice_key, None) or self.store.load_checkpoints(invoice_key)
+        user_prompt, _ = build_anomaly_prompt(
+            ANOMALY_PROMPT_TEMPLATE,
+            steps.get("invoice_data", {}),
+            steps.get("contract_data", {"error": "Contract data is not available."}),
+            steps.get("business_rules", ""),
+        )
+        return batch_line(f"verdict:{invoice_key}", build_verdict_request(user_prompt, MODEL))
+
+    async def collect_verdicts(self):
+        """Group invoices whose browser steps finished into verdict jobs, until None is queued."""
+        waiting = []
+        while True:
+            try:
+                invoice_key = await asyncio.wait_for(self.verdict_queue.get(), OFFLINE_VERDICT_FLUSH_SECONDS)
+                timed_out = False
+            except asyncio.TimeoutError:
+                invoice_key, timed_out = None, True
+            finished = invoice_key is None and not timed_out
+            if invoice_key is not None:
+                waiting.append(invoice_key)
+            if waiting and (finished or timed_out or len(waiting) >= self.batch_size):
+                lines = [self._verdict_line(key) for key in waiting]
+                job_id = await self._submit("verdict", lines, waiting)
+                self.verdict_jobs.append(asyncio.create_task(self.run_verdict_job(job_id, waiting)))
+                waiting = []
+            if finished:
+                return
+
+    async def run_verdict_job(self, job_id, invoice_keys):
+        from app_stepwise import parse_verdict_response
+
+        for invoice_key, (response, error) in (await self._collect(job_id, "verdict", invoice_keys)).items():
+            if error:
+                self._fail(invoice_key, f"Anomaly detection failed: {error}")
+                continue
+            self.store.save_checkpoint(invoice_key, "verdict", parse_verdict_response(response))
+            self.start_posting(invoice_key)
+
+    # --- posting ---
+
+    def start_posting(self, invoice_key):
+        self.posting_tasks.append(asyncio.create_task(self._post(invoice_key)))
+
+    async def _post(self, invoice_key):
+        from app_stepwise import main
+        from batch_runner import BATCH_PREWARM_POSTING_PAGE, pipeline_error
+
+        record = {"image_path": self.image_paths[invoice_key], "invoice_key": invoice_key}
+        async with self.browser_slots:
+            try:
+                # Every step but posting resumes from its checkpoint
+                results = await main(
+                    image_path=self.image_paths[invoice_key],
+                    store=self.store,
+                    invoice_key=invoice_key,
+                    prewarm_posting=BATCH_PREWARM_POSTING_PAGE,
+                )
+                record["results"] = results
+                error = pipeline_error(results)
+            except Exception as e:
+                error = f"Pipeline failed: {str(e)}"
+        if error:
+            self._fail(invoice_key, error)
+            return
+        self.store.mark_done(invoice_key)
+        self._write_record(record)
+
+    async def run(self):
+        # Failed invoices are retried until they have used up MAX_ATTEMPTS, as in the online queue
+        invoices = self.store.claim_all(f"offline-{os.getpid()}")
+        self.image_paths = dict(invoices)
+        in_flight = set()
+        extraction_jobs = []
+        for job_id, stage, invoice_keys in self.store.open_batch_jobs(self.backend.name):
+            invoice_keys = [key for key in invoice_keys if key in self.image_paths]
+            in_flight.update(invoice_keys)
+            print(f"Resuming {stage} batch job {job_id}")
+            if stage == "extraction":
+                extraction_jobs.append(asyncio.create_task(self.run_extraction_job(job_id, invoice_keys)))
+            else:
+                self.verdict_jobs.append(asyncio.create_task(self.run_verdict_job(job_id, invoice_keys)))
+
+        to_extract = []
+        for invoice_key, _ in invoices:
+            if invoice_key in in_flight:
+                continue
+            checkpoints = self.store.load_checkpoints(invoice_key)
+            if "verdict" in checkpoints:
+                self.start_posting(invoice_key)
+            elif "invoice_data" in checkpoints:
+                self.start_browser_steps(invoice_key)
+            else:
+                to_extract.append(invoice_key)
+        for job_id, chunk in await self.submit_extraction(to_extract):
+            extraction_jobs.append(asyncio.create_task(self.run_extraction_job(job_id, chunk)))
+
+        collector = asyncio.create_task(self.collect_verdicts())
+        await asyncio.gather(*extraction_jobs)
+        # Extraction jobs add browser tasks as they complete; all of them exist once the jobs are done
+        await asyncio.gather(*self.browser_tasks)
+        await self.verdict_queue.put(None)
+        await collector
+        await asyncio.gather(*self.verdict_jobs)
+        await asyncio.gather(*self.posting_tasks)
+        print(f"Offline batch run finished: {self.store.status_counts()}")
+
+
+def run_offline_batch(image_paths, state_db=DEFAULT_STATE_DB, backend=None, batch_size=OFFLINE_BATCH_SIZE,
+                      concurrency=DEFAULT_BROWSER_CONCURRENCY, output_path=None):
+    """
+    Queue the images in the state store and process every open invoice in offline batch mode.
+    Args:
+        image_paths (list[str]): Invoice images to add to the queue.
+        state_db (str): SQLite state store holding the queue, checkpoints and submitted batch jobs.
+        backend (str): Batch backend name (default OFFLINE_BATCH_BACKEND).
+        batch_size (int): Requests per batch job.
+        concurrency (int): Invoices whose browser steps run at the same time.
+        output_path (str): Optional JSONL file receiving one record per finished invoice (exported to
+            RESULTS_PARQUET_DIR when set).
+    """
+    from common.results_sink import ResultsSink
+
+    store = InvoiceStateStore(state_db)
+    sink = ResultsSink(output_path) if output_path else None
+    try:
+        for image_path in image_paths:
+            store.enqueue(image_path)
+        # Offline runs are single-process: invoices still 'running' were left by an interrupted run
+        store.requeue_running()
+
+        async def run():
+            await OfflineBatchRun(store, get_batch_backend(backend), batch_size, concurrency, sink).run()
+
+        asyncio.run(run())
+    finally:
+        if sink is not None:
+            sink.close()
+        store.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Process queued invoices with offline batch jobs for extraction and anomaly detection.')
+    parser.add_argument('--images', nargs='*', default=[], help='Paths to purchase invoice image files')
+    parser.add_argument('--input-dir', type=str, default=None, help='Directory of invoice images (*.png, *.jpg)')
+    parser.add_argument('--state-db', type=str, default=DEFAULT_STATE_DB, help='SQLite state store')
+    parser.add_argument('--backend', type=str, default=None, help='Batch backend: openai or local (default OFFLINE_BATCH_BACKEND)')
+    parser.add_argument('--batch-size', type=int, default=OFFLINE_BATCH_SIZE, help='Requests per batch job')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_BROWSER_CONCURRENCY, help='Invoices in browser steps at the same time')
+    parser.add_argument('--output', type=str, default=None, help='JSONL file receiving one record per finished invoice')
+    args = parser.parse_args()
+
+    image_paths = list(args.images)
+    if args.input_dir:
+        for pattern in ("*.png", "*.jpg", "*.jpeg"):
+            image_paths.extend(sorted(glob.glob(os.path.join(args.input_dir, pattern))))
+    run_offline_batch(image_paths, args.state_db, args.backend, args.batch_size, args.concurrency, args.output)
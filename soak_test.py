@@ -0,0 +1,400 @@
+# Soak test - drives the stepwise pipeline in batch mode for a fixed duration or invoice count against local
+# stand-ins (common/mock_services.py) for the procurement web app and the Responses API, so it needs no Azure
+# resources. Stage latency percentiles, throughput, RSS and open handles are sampled over time and written
+# to a time-series report; with --baseline the run is compared against a stored baseline and regressions
+# are flagged (exit code 1).
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_WORKER_CONCURRENCY", "2"))
+STAGES = ["invoice_data", "contract_data", "business_rules", "verdict", "post_result", "total"]
+PERCENTILES = (50, 95, 99)
+# Relative change against the baseline that counts as a regression
+DEFAULT_TOLERANCE = float(os.getenv("SOAK_TOLERANCE", "0.2"))
+# Invoices processed before growth is measured (imports, browser and connection pools warming up)
+SOAK_WARMUP_INVOICES = int(os.getenv("SOAK_WARMUP_INVOICES", "20"))
+# Growth per 1000 invoices tolerated on top of the baseline's, so small runs don't flag noise
+RSS_SLOPE_ALLOWANCE_MB = 5.0
+FD_SLOPE_ALLOWANCE = 2.0
+MB = 1024 * 1024
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def latency_stats(completions):
+    """Per-stage {"p50", "p95", "p99"} in seconds over a list of completions."""
+    stats = {}
+    for stage in STAGES:
+        values = [c["timings"][stage] for c in completions if stage in c["timings"]]
+        if values:
+            stats[stage] = {f"p{pct}": round(percentile(values, pct), 3) for pct in PERCENTILES}
+    return stats
+
+
+def slope_per_thousand(points, warmup=SOAK_WARMUP_INVOICES):
+    """Least-squares slope of (invoices done, value) points after the warm-up, per 1000 invoices; None with too few points."""
+    points = [(x, y) for x, y in points if y is not None and x >= warmup]
+    if len(points) < 3 or len({x for x, _ in points}) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return round(covariance / variance * 1000, 3)
+
+
+def open_file_descriptors():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def write_invoice_images(directory, count):
+    """Write count distinct synthetic invoice images (the stand-in model derives the invoice from the image)."""
+    from PIL import Image, ImageDraw
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"soak-invoice-{index:04d}.png")
+        if not os.path.exists(path):
+            image = Image.new("RGB", (800, 1000), "white")
+            draw = ImageDraw.Draw(image)
+            draw.text((40, 40), f"PURCHASE INVOICE  SOAK-{index:04d}", fill="black")
+            for line in range(index % 5 + 1):
+                draw.text((40, 120 + 30 * line), f"ITM00{line + 1}   qty {line + index % 7 + 1}", fill="black")
+            image.save(path)
+        paths.append(path)
+    return paths
+
+
+class SoakRun:
+    """Runs invoices through app_stepwise.main in concurrent lanes and samples the process while it runs."""
+
+    def __init__(self, image_paths, concurrency, duration=None, invoices=None, sample_seconds=30.0, log=print):
+        self.image_paths = image_paths
+        self.concurrency = concurrency
+        self.duration = duration
+        self.invoices = invoices
+        self.sample_seconds = sample_seconds
+        self.log = log
+        self.completions = []
+        self.samples = []
+        self._started = None
+        self._next_index = 0
+        self._sampled_upto = 0
+
+    def _take_invoice(self):
+        if self.invoices is not None and self._next_index >= self.invoices:
+            return None
+        if self.duration is not None and time.monotonic() - self._started >= self.duration:
+            return None
+        image_path = self.image_paths[self._next_index % len(self.image_paths)]
+        self._next_index += 1
+        return image_path
+
+    async def _lane(self):
+        from app_stepwise import main
+        from batch_runner import pipeline_error
+
+        while True:
+            image_path = self._take_invoice()
+            if image_path is None:
+                return
+            started = time.perf_counter()
+            try:
+                results = await main(image_path=image_path)
+                error = pipeline_error(results)
+                timings = dict(results.get("timings", {}))
+            except Exception as e:
+                error = f"Pipeline failed: {str(e)}"
+                timings = {}
+            timings["total"] = round(time.perf_counter() - started, 3)
+            self.completions.append({"time": time.monotonic() - self._started, "timings": timings, "error": error})
+
+    def sample(self):
+        """Record one time-series point covering the completions since the previous one."""
+        from common.memory import chromium_rss_bytes, open_browser_objects, process_rss_bytes
+
+        window = self.completions[self._sampled_upto:]
+        self._sampled_upto = len(self.completions)
+        elapsed = time.monotonic() - self._started
+        window_seconds = elapsed - (self.samples[-1]["elapsed_seconds"] if self.samples else 0.0)
+        python_rss = process_rss_bytes()
+        chromium_rss = chromium_rss_bytes()
+        point = {
+            "elapsed_seconds": round(elapsed, 1),
+            "invoices_done": len(self.completions),
+            "errors": sum(1 for c in self.completions if c["error"]),
+            "throughput_per_minute": round(len(window) * 60 / window_seconds, 2) if window_seconds > 0 else None,
+            "latency": latency_stats(window),
+            "python_rss_mb": round(python_rss / MB, 1) if python_rss is not None else None,
+            "chromium_rss_mb": round(chromium_rss / MB, 1) if chromium_rss is not None else None,
+            "open_fds": open_file_descriptors(),
+            "threads": threading.active_count(),
+            **open_browser_objects(),
+        }
+        self.samples.append(point)
+        total_p95 = point["latency"].get("total", {}).get("p95")
+        total_p95 = "-" if total_p95 is None else f"{total_p95}s"
+        self.log(
+            f"[{point['elapsed_seconds']:>7.0f}s] {point['invoices_done']} invoices ({point['errors']} errors), "
+            f"{point['throughput_per_minute']}/min, total p95 {total_p95}, python {point['python_rss_mb']} MB, "
+            f"chromium {point['chromium_rss_mb']} MB, {point['open_fds']} fds, {point['pages']} pages open"
+        )
+        return point
+
+    async def _sampler(self):
+        while True:
+            await asyncio.sleep(self.sample_seconds)
+            self.sample()
+
+    async def run(self):
+        # Import the pipeline up front so its import cost is not counted as growth
+        import app_stepwise
+        import batch_runner
+
+        self._started = time.monotonic()
+        self.sample()
+        sampler = asyncio.create_task(self._sampler())
+        try:
+            await asyncio.gather(*(self._lane() for _ in range(self.concurrency)))
+        finally:
+            sampler.cancel()
+        self.sample()
+        return self.summary()
+
+    def summary(self) -> dict:
+        elapsed = self.samples[-1]["elapsed_seconds"] if self.samples else 0.0
+        done = len(self.completions)
+        quarter = max(1, done // 4)
+        first, last = latency_stats(self.completions[:quarter]), latency_stats(self.completions[-quarter:])
+        drift = {
+            stage: round(last[stage]["p95"] / first[stage]["p95"], 2)
+            for stage in last
+            if stage in first and first[stage]["p95"]
+        }
+        return {
+            "invoices": done,
+            "errors": sum(1 for c in self.completions if c["error"]),
+            "error_rate": round(sum(1 for c in self.completions if c["error"]) / done, 4) if done else None,
+            "elapsed_seconds": elapsed,
+            "throughput_per_minute": round(done * 60 / elapsed, 2) if elapsed else None,
+            "latency": latency_stats(self.completions),
+            # p95 of the last quarter of invoices relative to the first quarter
+            "latency_drift": drift,
+            "python_rss_mb_per_1000": slope_per_thousand([(s["invoices_done"], s["python_rss_mb"]) for s in self.samples]),
+            "chromium_rss_mb_per_1000": slope_per_thousand([(s["invoices_done"], s["chromium_rss_mb"]) for s in self.samples]),
+            "open_fds_per_1000": slope_per_thousand([(s["invoices_done"], s["open_fds"]) for s in self.samples]),
+            "python_rss_mb_end": self.samples[-1]["python_rss_mb"] if self.samples else None,
+            "open_fds_end": self.samples[-1]["open_fds"] if self.samples else None,
+        }
+
+
+def find_regressions(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare a run summary with a baseline summary.
+    Returns:
+        list[str]: One message per regression; empty when the run is within tolerance.
+    """
+    regressions = []
+    for stage, stats in summary.get("latency", {}).items():
+        base = baseline.get("latency", {}).get(stage)
+        for name in ("p95", "p99"):
+            if base and base.get(name) and stats.get(name) is not None and stats[name] > base[name] * (1 + tolerance):
+                regressions.append(f"{stage} {name} {stats[name]}s > baseline {base[name]}s")
+    if baseline.get("throughput_per_minute") and summary.get("throughput_per_minute") is not None:
+        if summary["throughput_per_minute"] < baseline["throughput_per_minute"] * (1 - tolerance):
+            regressions.append(f"throughput {summary['throughput_per_minute']}/min < baseline {baseline['throughput_per_minute']}/min")
+    if summary.get("error_rate") is not None and summary["error_rate"] > (baseline.get("error_rate") or 0) + 0.01:
+        regressions.append(f"error rate {summary['error_rate']:.2%} > baseline {(baseline.get('error_rate') or 0):.2%}")
+    for name, allowance in (("python_rss_mb_per_1000", RSS_SLOPE_ALLOWANCE_MB), ("chromium_rss_mb_per_1000", RSS_SLOPE_ALLOWANCE_MB), ("open_fds_per_1000", FD_SLOPE_ALLOWANCE)):
+        value, base = summary.get(name), baseline.get(name)
+        if value is not None and value > max(base or 0, 0) * (1 + tolerance) + allowance:
+            regressions.append(f"{name} {value} > baseline {base}")
+    return regressions
+
+
+def stand_in_client(model_server, api_version):
+    """
+    Build the model client for the stand-in model server. Requests to any other host are refused before they
+    are sent, so a soak run can never reach a real deployment.
+    Returns:
+        tuple: (client, traffic) where traffic counts the requests "sent" and lists the "refused" URLs.
+    """
+    from urllib.parse import urlparse
+    from openai import AzureOpenAI, DefaultHttpxClient
+
+    stand_in = urlparse(model_server.url)
+    traffic = {"sent": 0, "refused": []}
+    lock = threading.Lock()
+
+    def check_host(request):
+        with lock:
+            if (request.url.host, request.url.port) != (stand_in.hostname, stand_in.port):
+                traffic["refused"].append(str(request.url))
+                raise RuntimeError(f"Soak test request to {request.url} refused; only the stand-in model server may be called")
+            traffic["sent"] += 1
+
+    client = AzureOpenAI(
+        azure_endpoint=model_server.url,
+        api_key="soak-test",
+        api_version=api_version,
+        max_retries=0,
+        http_client=DefaultHttpxClient(event_hooks={"request": [check_host]}),
+    )
+    return client, traffic
+
+
+def stand_in_failures(traffic, received):
+    """Messages for model requests that did not reach the stand-in model server; empty when all of them did."""
+    failures = []
+    if traffic["refused"]:
+        failures.append(f"{len(traffic['refused'])} model requests addressed another host, e.g. {traffic['refused'][0]}")
+    if received < traffic["sent"]:
+        failures.append(f"stand-in model server received {received} of {traffic['sent']} model requests")
+    return failures
+
+
+def run_soak(duration=None, invoices=None, concurrency=DEFAULT_CONCURRENCY, sample_seconds=30.0, report_path="soak_report.json",
+             baseline_path=None, save_baseline=False, tolerance=DEFAULT_TOLERANCE, model_latency_ms=200.0, model_error_rate=0.0,
+             distinct_invoices=25, work_dir=".soak", verbose=False):
+    """
+    Start the stand-ins, point the pipeline at them and run the soak test. The pipeline modules read the
+    stand-ins' addresses when they are first imported, so run one soak test per process.
+    Args:
+        duration (float): Stop starting new invoices after this many seconds.
+        invoices (int): Stop after this many invoices (whichever limit comes first).
+        concurrency (int): Invoices processed concurrently.
+        sample_seconds (float): Interval of the time-series samples.
+        report_path (str): JSON report with the configuration, samples, summary and regressions.
+        baseline_path (str): Baseline summary to compare against (written instead with save_baseline).
+        tolerance (float): Relative change against the baseline that counts as a regression.
+        model_latency_ms (float): Mean latency of the stand-in model server.
+        model_error_rate (float): Fraction of model requests answered with a 429.
+        distinct_invoices (int): Synthetic invoice images to cycle through.
+        work_dir (str): Directory for the synthetic images.
+        verbose (bool): Keep the pipeline's own output; otherwise only the samples are printed.
+    Returns:
+        list[str]: The regressions found (empty without a baseline), plus any model requests that missed the stand-in.
+    """
+    # common.utils loads .env with override=True when first imported; load it now so it cannot
+    # overwrite the stand-in configuration below once the pipeline imports it
+    import common.utils  # noqa: F401
+    from common.clients import pin_client
+    from common.mock_services import FakeResponsesServer, MockProcurementApp
+
+    app = MockProcurementApp().start()
+    model_server = FakeResponsesServer(latency_ms=model_latency_ms, error_rate=model_error_rate).start()
+    # Every model call uses this client, whatever AZURE_OPENAI_ENDPOINT says when the call is made
+    client, traffic = stand_in_client(model_server, os.getenv("AZURE_API_VERSION") or "2025-03-01-preview")
+    pin_client(client)
+    # Set before the pipeline modules are imported, since they read their configuration at import time
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": model_server.url,
+        "AZURE_OPENAI_API_KEY": "soak-test",
+        "AZURE_API_VERSION": os.getenv("AZURE_API_VERSION") or "2025-03-01-preview",
+        "MODEL_NAME": "computer-use-preview",
+        "MODEL_NAME2": "gpt-4o",
+        "vector_store_id": "vs_soak",
+        "contract_data_url": app.contract_data_url,
+        "invoice_data_url": app.invoice_data_url,
+        "invoice_list_url": f"{app.url}/PurchaseInvoiceHeaders",
+        "MODEL_CACHE_MODE": "passthrough",
+        "PERSIST_BROWSER_SESSIONS": "false",
+        "VERIFY_BEFORE_POST": "false",
+    })
+    image_paths = write_invoice_images(os.path.join(work_dir, "invoices"), distinct_invoices)
+
+    report_out = sys.stdout
+    log = lambda message: print(message, file=report_out, flush=True)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        run = SoakRun(image_paths, concurrency, duration, invoices, sample_seconds, log)
+        summary = asyncio.run(run.run())
+    finally:
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = report_out
+        app.stop()
+        model_server.stop()
+        pin_client(None)
+
+    regressions = []
+    if baseline_path and save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as baseline_file:
+            json.dump(summary, baseline_file, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+    elif baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+            regressions = find_regressions(summary, json.load(baseline_file), tolerance)
+    # A run whose model calls went anywhere but the stand-in measured nothing useful (and may have used a real deployment)
+    regressions.extend(stand_in_failures(traffic, model_server.counts["requests"]))
+    report = {
+        "config": {
+            "duration": duration, "invoices": invoices, "concurrency": concurrency, "sample_seconds": sample_seconds,
+            "model_latency_ms": model_latency_ms, "model_error_rate": model_error_rate, "baseline": baseline_path,
+            "tolerance": tolerance,
+        },
+        "stand_ins": {
+            "model_requests": model_server.counts, "model_requests_sent": traffic["sent"], "model_requests_refused": traffic["refused"],
+            "app_requests": app.requests, "posted": len(app.posted),
+        },
+        "samples": run.samples,
+        "summary": summary,
+        "regressions": regressions,
+    }
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    print(f"\n{summary['invoices']} invoices in {summary['elapsed_seconds']:.0f}s ({summary['throughput_per_minute']}/min), {summary['errors']} errors")
+    print(f"{'stage':<16} {'p50':>8} {'p95':>8} {'p99':>8} {'drift':>7}")
+    for stage, stats in summary["latency"].items():
+        drift = summary["latency_drift"].get(stage)
+        print(f"{stage:<16} {stats['p50']:>7.2f}s {stats['p95']:>7.2f}s {stats['p99']:>7.2f}s {drift if drift is not None else '-':>7}")
+    print(f"Growth per 1000 invoices: python RSS {summary['python_rss_mb_per_1000']} MB, "
+          f"chromium RSS {summary['chromium_rss_mb_per_1000']} MB, fds {summary['open_fds_per_1000']}")
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    print(f"Report written to {report_path}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Soak-test the pipeline against local stand-ins for the web app and model server.')
+    parser.add_argument('--duration', type=float, default=None, help='Run for this many seconds')
+    parser.add_argument('--invoices', type=int, default=None, help='Run this many invoices')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Invoices processed concurrently')
+    parser.add_argument('--sample-seconds', type=float, default=30.0, help='Interval of the time-series samples')
+    parser.add_argument('--report', type=str, default="soak_report.json", help='Time-series report file')
+    parser.add_argument('--baseline', type=str, default=None, help='Baseline summary to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Write this run\'s summary to --baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Relative change that counts as a regression')
+    parser.add_argument('--model-latency-ms', type=float, default=200.0, help='Mean latency of the stand-in model server')
+    parser.add_argument('--model-error-rate', type=float, default=0.0, help='Fraction of model requests throttled with a 429')
+    parser.add_argument('--distinct-invoices', type=int, default=25, help='Synthetic invoice images to cycle through')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline output')
+    args = parser.parse_args()
+    if args.duration is None and args.invoices is None:
+        parser.error("Give --duration and/or --invoices.")
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline.")
+    found = run_soak(args.duration, args.invoices, args.concurrency, args.sample_seconds, args.report, args.baseline,
+                     args.save_baseline, args.tolerance, args.model_latency_ms, args.model_error_rate, args.distinct_invoices,
+                     verbose=args.verbose)
+    sys.exit(1 if found else 0)
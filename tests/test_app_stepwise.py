@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import app_stepwise
+from common.results_sink import flatten_record
+from common.state_store import InvoiceStateStore
+
+INVOICE = {"contractId": "C-7", "invoiceNumber": "INV-1", "supplierId": "S-1", "totalInvoiceValue": 300, "invoiceLines": []}
+VERDICT = {"status": "approved", "detailed_verdict": "| Check | Result |", "summary_verdict": "All good"}
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Replace every model and browser call of the workflow; calls counts how often each step ran."""
+    calls = {"extract": 0, "contract": 0, "rules": 0, "verdict": 0, "post": 0}
+
+    def step(name, result):
+        async def run(*args, **kwargs):
+            calls[name] += 1
+            outcome = result() if callable(result) else result
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return run
+
+    def use(name, result):
+        attribute = {
+            "extract": "extract_invoice_data",
+            "contract": "get_contract_details",
+            "rules": "get_business_rules",
+            "verdict": "detect_anomalies",
+            "post": "post_purchase_invoice_header",
+        }[name]
+        monkeypatch.setattr(app_stepwise, attribute, step(name, result))
+
+    use("extract", INVOICE)
+    use("contract", {"contractId": "C-7"})
+    use("rules", "Prices must match the contract.")
+    use("verdict", VERDICT)
+    use("post", None)
+    calls["use"] = use
+    return calls
+
+
+def _run(image_path="invoice.png", **options):
+    return asyncio.run(app_stepwise.main(image_path=image_path, prewarm_posting=False, **options))
+
+
+def test_fresh_post_is_recorded_as_posted(pipeline):
+    results = _run()
+    assert results["post_result"] == {"posted": True, "status": "approved"}
+    assert flatten_record({"results": results})["posted"] is True
+
+
+def test_resumed_post_reads_the_same_as_a_fresh_one(pipeline, tmp_path):
+    image = tmp_path / "invoice.png"
+    image.write_bytes(b"invoice")
+    store = InvoiceStateStore(str(tmp_path / "state.db"))
+    fresh = _run(str(image), store=store)
+    resumed = _run(str(image), store=store)
+    assert pipeline["post"] == 1
+    assert resumed["post_result"] == fresh["post_result"]
+    assert flatten_record({"results": resumed})["posted"] is True
+
+
+def test_failed_posting_session_is_not_posted(pipeline):
+    pipeline["use"]("post", RuntimeError("form did not submit"))
+    results = _run()
+    assert results["post_result"].startswith("Post invoice failed")
+    assert flatten_record({"results": results})["posted"] is False
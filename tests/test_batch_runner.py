@@ -0,0 +1,53 @@
+import pytest
+
+from batch_runner import pipeline_error, shard_invoices
+
+INVOICES = [f"invoice-{index}.png" for index in range(10)]
+
+
+@pytest.mark.parametrize("num_shards", [1, 3, 4, 10])
+def test_shards_are_deterministic_and_evenly_spread(num_shards):
+    shards = shard_invoices(INVOICES, num_shards)
+    assert shards == shard_invoices(list(INVOICES), num_shards)
+    assert sorted(path for shard in shards for path in shard) == sorted(INVOICES)
+    sizes = [len(shard) for shard in shards]
+    assert len(shards) == num_shards
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_shards_keep_the_queue_order_round_robin():
+    assert shard_invoices(INVOICES[:5], 2) == [INVOICES[0:5:2], INVOICES[1:5:2]]
+
+
+@pytest.mark.parametrize("num_shards, expected", [(12, 3), (0, 1)])
+def test_no_empty_shards(num_shards, expected):
+    assert len(shard_invoices(INVOICES[:3], num_shards)) == expected
+    assert shard_invoices([], num_shards) == []
+
+
+OK = {
+    "invoice_data": {"contractId": "C-7"},
+    "contract_data": {"contractId": "C-7"},
+    "business_rules": "Prices must match the contract.",
+    "verdict": {"status": "approved"},
+    "post_result": {"posted": True, "status": "approved"},
+}
+
+
+@pytest.mark.parametrize("step, output, expected", [
+    ("verdict", {"error": "Anomaly detection failed: timeout"}, "Anomaly detection failed: timeout"),
+    ("post_result", {"error": "Posting skipped"}, "Posting skipped"),
+    ("post_result", "Post invoice failed: form did not submit", "Post invoice failed: form did not submit"),
+    ("business_rules", "Post invoice failed: only an error in the posting step", None),
+    ("contract_data", {"error": "No contractId found in invoice data."}, None),
+    ("post_result", None, None),
+    ("verdict", None, None),
+])
+def test_pipeline_error_classifies_step_outputs(step, output, expected):
+    assert pipeline_error({**OK, step: output}) == expected
+
+
+def test_pipeline_error_reports_the_first_failed_step():
+    results = {**OK, "invoice_data": {"error": "Invoice extraction failed: blurry"}, "post_result": {"error": "Posting skipped"}}
+    assert pipeline_error(results) == "Invoice extraction failed: blurry"
+    assert pipeline_error(OK) is None
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from common import clients
+from common.clients import TokenManager
+
+
+class _Credential:
+    """Hands out numbered tokens valid for lifetime seconds; counts get_token calls."""
+
+    def __init__(self, lifetime=3600, delay=0.0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.calls = 0
+
+    def get_token(self, scope):
+        self.calls += 1
+        time.sleep(self.delay)
+        return type("AccessToken", (), {"token": f"token-{self.calls}", "expires_on": time.time() + self.lifetime})
+
+
+@pytest.fixture
+def credential(monkeypatch):
+    fake = _Credential()
+    monkeypatch.setattr(clients, "get_credential", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def manager():
+    managers = []
+
+    def create(**options):
+        managers.append(TokenManager(**options))
+        return managers[-1]
+
+    yield create
+    for token_manager in managers:
+        token_manager.stop()
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_token_is_refreshed_in_the_background_before_it_expires(credential, manager):
+    margin = clients.TOKEN_MIN_VALIDITY_SECONDS + 1
+    tokens = manager(refresh_margin=margin, seed=("seeded", time.time() + margin + 0.3))
+    assert tokens.get_token() == "seeded"
+    _wait_for(lambda: tokens.refreshes == 1)
+    assert tokens.get_token() == "token-1"
+    assert tokens.inline_fetches == 0
+
+
+def test_token_about_to_expire_is_fetched_on_the_request_path(credential, manager):
+    tokens = manager(seed=("stale", time.time() + clients.TOKEN_MIN_VALIDITY_SECONDS - 1))
+    assert tokens.get_token() == "token-1"
+    assert tokens.inline_fetches == 1
+
+
+def test_concurrent_callers_share_one_fetch(credential, manager):
+    credential.delay = 0.05
+    tokens = manager()
+    results = []
+    start = threading.Barrier(8)
+
+    def call():
+        start.wait()
+        results.append(tokens.get_token())
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["token-1"] * 8
+    assert credential.calls == 1
+    assert tokens.inline_fetches == 1
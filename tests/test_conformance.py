@@ -0,0 +1,35 @@
+import os
+import asyncio
+
+import pytest
+
+from common.local_playwright import playwright_key
+
+
+def _browser_available() -> bool:
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        return False
+    with sync_playwright() as playwright:
+        return os.path.exists(playwright.chromium.executable_path)
+
+
+def test_playwright_key_mapping():
+    assert playwright_key("CTRL") == "Control"
+    assert playwright_key("A") == "a"
+    assert playwright_key("enter") == "Enter"
+    assert playwright_key("/") == "Divide"
+    assert playwright_key("F5") == "F5"
+
+
+@pytest.mark.skipif(not _browser_available(), reason="no Chromium installed for Playwright (playwright install chromium)")
+def test_local_playwright_conforms():
+    from common.backends import create_computer
+    from common.conformance import check_conformance
+
+    async def run():
+        async with create_computer("local_playwright", profile="batch") as computer:
+            return await check_conformance(computer)
+
+    assert asyncio.run(run()) == []
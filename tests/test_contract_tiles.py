@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+import call_computer_use
+from call_computer_use import merge_contract_tiles, tiled_height
+
+
+def test_overlapping_rows_are_deduplicated_in_page_order():
+    tiles = [
+        {"header": {"supplier": "Acme"}, "contractLines": [{"itemId": "A1", "price": 1}, {"itemId": "B2", "price": 2}]},
+        {"header": {}, "contractLines": [{"itemId": "b2 ", "price": 2}, {"itemId": "C3", "price": 3}]},
+        {"contractLines": [{"itemId": "D4", "price": 4}]},
+    ]
+    merged = merge_contract_tiles("C-7", tiles)
+    assert [line["itemId"] for line in merged["contractLines"]] == ["A1", "B2", "C3", "D4"]
+
+
+def test_row_cut_at_a_tile_edge_keeps_its_most_complete_version():
+    tiles = [
+        {"contractLines": [{"itemId": "A1"}]},
+        {"contractLines": [{"itemId": "A1", "price": 1, "quantity": 5}]},
+    ]
+    assert merge_contract_tiles("C-7", tiles)["contractLines"] == [{"itemId": "A1", "price": 1, "quantity": 5}]
+
+
+def test_rows_without_item_id_are_deduplicated_by_content():
+    row = {"description": "Freight", "price": 10}
+    tiles = [{"contractLines": [row]}, {"contractLines": [dict(row), {"description": "Handling", "price": 5}]}]
+    assert merge_contract_tiles("C-7", tiles)["contractLines"] == [row, {"description": "Handling", "price": 5}]
+
+
+def test_header_fields_keep_the_first_non_empty_value():
+    tiles = [{"header": {"supplier": "", "currency": "USD"}}, {"header": {"supplier": "Acme", "currency": "EUR"}}]
+    merged = merge_contract_tiles("C-7", tiles)
+    assert merged == {"contractId": "C-7", "supplier": "Acme", "currency": "USD", "contractLines": []}
+
+
+@pytest.mark.parametrize("tiles, expected", [(0, 0), (1, 768), (3, 768 + 2 * 648)])
+def test_tiled_height(tiles, expected):
+    assert tiled_height(tiles, 768, 120) == expected
+
+
+class _Computer:
+    dimensions = (1024, 768)
+
+    def __init__(self, page_height, tiles):
+        self.page_height = page_height
+        self.tiles = tiles
+
+    async def screenshot_tiles(self, overlap, max_tiles):
+        return [b"tile"] * min(self.tiles, max_tiles)
+
+    async def evaluate(self, script, arg=None):
+        return self.page_height
+
+
+@pytest.fixture
+def tile_extraction(monkeypatch):
+    extracted = []
+
+    async def extract(index, count, tile):
+        extracted.append(index)
+        return {"contractLines": [{"itemId": f"L{index}"}]}
+
+    monkeypatch.setattr(call_computer_use, "_extract_tile", extract)
+    monkeypatch.setattr(call_computer_use, "CONTRACT_TILE_OVERLAP", 120)
+    monkeypatch.setattr(call_computer_use, "CONTRACT_MAX_TILES", 2)
+    return extracted
+
+
+def test_page_covered_by_the_tiles_is_extracted(tile_extraction):
+    result = asyncio.run(call_computer_use._extract_contract_tiled(_Computer(page_height=1400, tiles=2), "C-7"))
+    assert json.loads(result)["contractLines"] == [{"itemId": "L0"}, {"itemId": "L1"}]
+
+
+def test_page_longer_than_the_tile_limit_is_not_extracted_partially(tile_extraction):
+    with pytest.raises(ValueError, match="longer than 2 tiles"):
+        asyncio.run(call_computer_use._extract_contract_tiled(_Computer(page_height=5000, tiles=8), "C-7"))
+    assert tile_extraction == []
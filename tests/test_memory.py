@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import call_computer_use
+from common import memory
+from common.memory import CuaMemoryGuard
+
+
+class _Page:
+    async def close(self):
+        pass
+
+
+class _Computer:
+    """Stands in for a browser session whose page views cannot recycle the shared browser."""
+
+    def __init__(self, view_of=None):
+        self.view_of = view_of
+        self.recycles = 0
+        self.active_at_recycle = []
+        self.active = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def open_page(self):
+        return _Page()
+
+    def page_view(self, page):
+        return _Computer(view_of=self)
+
+    async def recycle(self):
+        if self.view_of is not None:
+            return False
+        self.recycles += 1
+        self.active_at_recycle.append(self.active)
+        return True
+
+
+def test_guard_on_a_view_stops_trying_to_recycle(monkeypatch):
+    checks = []
+    monkeypatch.setattr(memory, "browser_over_limit", lambda limit: checks.append(limit) or True)
+    guard = CuaMemoryGuard([], _Computer(view_of=_Computer()), max_browser_rss_mb=100)
+    asyncio.run(guard.after_turn())
+    asyncio.run(guard.after_turn())
+    assert checks == [100]
+
+
+def test_guard_recycles_its_own_session(monkeypatch):
+    monkeypatch.setattr(memory, "browser_over_limit", lambda limit: True)
+    computer = _Computer()
+    guard = CuaMemoryGuard([], computer, max_browser_rss_mb=100)
+    asyncio.run(guard.after_turn())
+    asyncio.run(guard.after_turn(allow_recycle=False))
+    assert computer.recycles == 1
+
+
+def test_retrieve_contracts_recycles_the_session_once_no_page_is_in_use(monkeypatch):
+    session = _Computer()
+    over_limit = iter([False, True])
+    monkeypatch.setattr(call_computer_use, "create_computer", lambda **options: session)
+    monkeypatch.setattr(call_computer_use, "browser_over_limit", lambda: next(over_limit, False))
+
+    async def extract(view, contractid):
+        session.active += 1
+        await asyncio.sleep(0.01)
+        session.active -= 1
+        return json.dumps({"contractId": contractid})
+
+    monkeypatch.setattr(call_computer_use, "_extract_contract", extract)
+    results = asyncio.run(call_computer_use.retrieve_contracts(["C1", "C2", "C3", "C4", "C1"], "", concurrency=2))
+    assert sorted(results) == ["C1", "C2", "C3", "C4"]
+    assert session.recycles == 1
+    assert session.active_at_recycle == [0]
+
+
+def test_retrieve_contracts_does_not_recycle_after_the_last_contract(monkeypatch):
+    session = _Computer()
+    monkeypatch.setattr(call_computer_use, "create_computer", lambda **options: session)
+    monkeypatch.setattr(call_computer_use, "browser_over_limit", lambda: True)
+
+    async def extract(view, contractid):
+        return json.dumps({"contractId": contractid})
+
+    monkeypatch.setattr(call_computer_use, "_extract_contract", extract)
+    asyncio.run(call_computer_use.retrieve_contracts(["C1"], ""))
+    assert session.recycles == 0
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from common import model_calls
+from common.model_calls import StreamFailed, stream_response
+
+
+class _Stream:
+    def __init__(self, events):
+        self.events = events
+
+    def __enter__(self):
+        return iter(self.events)
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Client:
+    """Stands in for the AzureOpenAI client: each streamed call replays the next scripted event list."""
+
+    def __init__(self, *attempts):
+        self.attempts = list(attempts)
+        self.calls = 0
+        self.responses = SimpleNamespace(create=self.create)
+
+    def create(self, stream=False, **request):
+        self.calls += 1
+        return _Stream(self.attempts.pop(0))
+
+
+def _failed(code):
+    error = SimpleNamespace(code=code, message=f"{code} happened")
+    return SimpleNamespace(type="response.failed", response=SimpleNamespace(error=error))
+
+
+def _item_done(item):
+    return SimpleNamespace(type="response.output_item.done", item=item)
+
+
+def _completed(output):
+    return SimpleNamespace(type="response.completed", response=SimpleNamespace(output=output))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(model_calls, "retry_delay", lambda error, attempt: 0)
+
+
+def test_server_error_failure_is_retried():
+    client = _Client([_failed("server_error")], [_item_done("a"), _completed(["a"])])
+    response = asyncio.run(stream_response(client, stage="contract", input="hi"))
+    assert response.output == ["a"]
+    assert client.calls == 2
+
+
+def test_request_error_failure_is_not_retried():
+    client = _Client([_failed("invalid_prompt")])
+    with pytest.raises(StreamFailed) as failure:
+        asyncio.run(stream_response(client, stage="contract", input="hi"))
+    assert failure.value.code == "invalid_prompt"
+    assert client.calls == 1
+
+
+def test_failure_after_an_item_was_handed_out_is_not_retried():
+    client = _Client([_item_done("a"), _failed("server_error")], [_completed([])])
+    handed_out = []
+
+    async def on_item(item):
+        handed_out.append(item)
+
+    with pytest.raises(StreamFailed):
+        asyncio.run(stream_response(client, stage="posting", on_output_item=on_item, input="hi"))
+    assert handed_out == ["a"]
+    assert client.calls == 1
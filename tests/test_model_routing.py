@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from common.model_routing import ModelRouter, rule_violations, score_invoice_extraction, score_verdict, to_number
+
+INVOICE = {
+    "contractId": "C-7",
+    "invoiceNumber": "INV-1",
+    "supplierId": "S-1",
+    "totalInvoiceValue": "USD 1,250.00",
+    "invoiceDate": "2026-01-31",
+    "invoiceLines": [
+        {"itemId": "A1", "quantity": 10, "unitPrice": "100.00", "totalPrice": "1,000.00"},
+        {"itemId": "B2", "quantity": 5, "unitPrice": 50, "totalPrice": 250},
+    ],
+}
+CONTRACT = {"contractId": "C-7", "lines": [{"itemId": "A1"}, {"itemId": "B2"}]}
+
+
+@pytest.mark.parametrize("value, expected", [(12, 12.0), ("1,234.50", 1234.5), ("USD -3.5", -3.5), ("n/a", None), (True, None)])
+def test_to_number(value, expected):
+    assert to_number(value) == expected
+
+
+def test_consistent_invoice_scores_full_confidence():
+    assert score_invoice_extraction(INVOICE) == (1.0, [])
+
+
+def test_rounding_differences_are_tolerated():
+    invoice = dict(INVOICE, totalInvoiceValue="1250.03")
+    assert score_invoice_extraction(invoice)[0] == 1.0
+
+
+def test_arithmetic_and_schema_failures_lower_confidence():
+    lines = [dict(INVOICE["invoiceLines"][0], totalPrice="900.00"), INVOICE["invoiceLines"][1]]
+    invoice = dict(INVOICE, invoiceLines=lines, supplierId="")
+    confidence, failures = score_invoice_extraction(invoice)
+    assert 0 < confidence < 1
+    assert failures == ["missing supplierId", "line 1: 10.0 x 100.0 != 900.0"]
+
+
+def test_extraction_without_lines_or_object_fails():
+    assert score_invoice_extraction("not json") == (0.0, ["extraction is not a JSON object"])
+    assert "no invoice lines" in score_invoice_extraction(dict(INVOICE, invoiceLines=[]))[1]
+
+
+def test_rule_violations_reports_items_missing_from_contract():
+    invoice = dict(INVOICE, invoiceLines=INVOICE["invoiceLines"] + [{"itemId": "Z9"}])
+    assert rule_violations(invoice, CONTRACT) == ["item Z9 does not appear in the contract"]
+    assert rule_violations(INVOICE, {"error": "not found"}) == ["contract data is missing"]
+
+
+def test_verdict_approving_a_violation_is_penalized():
+    verdict = {"status": "approved", "detailed_verdict": "| a |", "summary_verdict": "ok"}
+    assert score_verdict(verdict, INVOICE, CONTRACT) == (1.0, [])
+    confidence, failures = score_verdict(verdict, INVOICE, {"error": "not found"})
+    assert confidence == 0.75
+    assert failures == ["approved despite: contract data is missing"]
+
+
+def _router_run(router, score, fast_result="fast"):
+    calls = []
+
+    async def call(model, fast):
+        calls.append((model, fast))
+        return fast_result if fast else "strong"
+
+    return asyncio.run(router.run("extraction", "strong-model", call, score)), calls
+
+
+def test_router_accepts_a_confident_fast_result():
+    router = ModelRouter(fast_model="fast-model", min_confidence=0.9)
+    result, calls = _router_run(router, lambda result: (1.0, []))
+    assert result == "fast"
+    assert calls == [("fast-model", True)]
+
+
+def test_router_escalates_a_low_confidence_result():
+    router = ModelRouter(fast_model="fast-model", min_confidence=0.9)
+    result, calls = _router_run(router, lambda result: (0.5, ["missing contractId"]))
+    assert result == "strong"
+    assert calls == [("fast-model", True), ("strong-model", False)]
+    assert router.report()["extraction"]["escalation_rate"] == 1.0
+
+
+def test_router_without_fast_model_calls_the_strong_model_only():
+    router = ModelRouter(fast_model=None)
+    result, calls = _router_run(router, lambda result: (1.0, []))
+    assert result == "strong"
+    assert calls == [("strong-model", False)]
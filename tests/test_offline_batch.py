@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import app_stepwise
+from common.state_store import InvoiceStateStore
+from offline_batch import OfflineBatchRun, browser_step_error
+
+INVOICE = {"contractId": "C-7", "invoiceNumber": "INV-1", "supplierId": "S-1", "invoiceLines": []}
+
+
+@pytest.mark.parametrize("results, expected", [
+    ({"contract_data": {"contractId": "C-7"}, "business_rules": "Prices must match."}, None),
+    ({"contract_data": {"error": "No contractId found in invoice data."}, "business_rules": "Rules"}, None),
+    ({"contract_data": {"error": "Contract retrieval failed: timeout"}}, "Contract retrieval failed: timeout"),
+    ({"contract_data": {}, "business_rules": "Business rules retrieval failed: 500"}, "Business rules retrieval failed: 500"),
+])
+def test_browser_step_error(results, expected):
+    assert browser_step_error(results) == expected
+
+
+@pytest.fixture
+def offline_run(tmp_path, monkeypatch):
+    image = tmp_path / "invoice.png"
+    image.write_bytes(b"invoice")
+    store = InvoiceStateStore(str(tmp_path / "state.db"))
+    invoice_key = store.enqueue(str(image))
+    store.save_checkpoint(invoice_key, "invoice_data", INVOICE)
+
+    async def rules():
+        return "Prices must match the contract."
+
+    monkeypatch.setattr(app_stepwise, "get_business_rules", rules)
+    run = OfflineBatchRun(store, backend=None)
+    run.image_paths = {invoice_key: str(image)}
+    return run, invoice_key
+
+
+def _contract(monkeypatch, result):
+    async def get_contract_details(contractid):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(app_stepwise, "get_contract_details", get_contract_details)
+
+
+def test_failed_contract_retrieval_is_left_for_retry(offline_run, monkeypatch):
+    run, invoice_key = offline_run
+    _contract(monkeypatch, RuntimeError("browser crashed"))
+    asyncio.run(run._browser_steps(invoice_key))
+    assert run.verdict_queue.empty()
+    assert run.store.status_counts() == {"failed": 1}
+    assert "contract_data" not in run.store.load_checkpoints(invoice_key)
+
+
+def test_retrieved_contract_is_checkpointed_before_the_verdict(offline_run, monkeypatch):
+    run, invoice_key = offline_run
+    _contract(monkeypatch, {"contractId": "C-7"})
+    asyncio.run(run._browser_steps(invoice_key))
+    assert run.verdict_queue.get_nowait() == invoice_key
+    assert set(run.store.load_checkpoints(invoice_key)) == {"invoice_data", "contract_data", "business_rules"}
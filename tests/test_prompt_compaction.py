@@ -0,0 +1,90 @@
+import pytest
+
+from common import prompt_compaction
+from common.prompt_compaction import MAX_FIELD_VALUE_LENGTH, build_anomaly_prompt, compact_contract, compact_invoice
+
+TEMPLATE = "Invoice:\n{invoice_data}\nContract:\n{contract_data}\nRules:\n{business_rules}"
+
+INVOICE = {
+    "invoiceNumber": "INV-1",
+    "contractId": "C-7",
+    "totalInvoiceValue": 300,
+    "invoiceLines": [{"itemId": "A1", "description": "Bolts", "quantity": 3, "unitPrice": 100, "totalPrice": 300}],
+}
+
+NOTES = "Delivery terms " * 30
+
+CONTRACT = {
+    "contractId": "C-7",
+    "supplierName": "Acme",
+    "buyerContact": "jane@example.com",
+    "notes": NOTES,
+    "actions": "Edit | Details | Delete",
+    "lines": [
+        {"itemId": "A1", "unitPrice": 100, "links": "Edit | Delete"},
+        {"itemId": "B2", "unitPrice": 50, "links": "Edit | Delete"},
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # Use the ~4 characters per token estimate so budgets do not depend on whether tiktoken is installed
+    monkeypatch.setattr(prompt_compaction, "_tokenizer", False)
+
+
+def _tokens(**options):
+    prompt = TEMPLATE.format(
+        invoice_data=compact_invoice(INVOICE),
+        contract_data=compact_contract(CONTRACT, **options),
+        business_rules="Prices must match.",
+    )
+    return prompt_compaction.count_tokens(prompt)
+
+
+def test_compact_invoice_renders_header_and_line_table():
+    text = compact_invoice(INVOICE)
+    assert "invoiceNumber: INV-1" in text
+    assert "itemId | description | quantity | unitPrice | totalPrice" in text
+    assert "A1 | Bolts | 3 | 100 | 300" in text
+
+
+def test_compact_contract_drops_navigation_and_empty_columns():
+    text = compact_contract(CONTRACT)
+    assert "actions" not in text
+    assert "links" not in text
+    assert "A1 | 100" in text and "B2 | 50" in text
+
+
+def test_long_values_are_kept_when_not_over_budget():
+    assert len(NOTES.strip()) > MAX_FIELD_VALUE_LENGTH
+    prompt, stats = build_anomaly_prompt(TEMPLATE, INVOICE, CONTRACT, "Prices must match.", token_budget=0)
+    assert NOTES.strip() in prompt
+    assert not stats["over_budget"]
+
+
+def test_budget_tiers_drop_oversized_values_then_other_items_then_irrelevant_fields():
+    without_oversized = _tokens(drop_oversized=True)
+    invoiced_items_only = _tokens(drop_oversized=True, item_ids=["A1"])
+    assert _tokens() > without_oversized > invoiced_items_only
+
+    prompt, _ = build_anomaly_prompt(TEMPLATE, INVOICE, CONTRACT, "Prices must match.", token_budget=without_oversized)
+    assert NOTES.strip() not in prompt
+    assert "B2 | 50" in prompt
+
+    prompt, _ = build_anomaly_prompt(TEMPLATE, INVOICE, CONTRACT, "Prices must match.", token_budget=invoiced_items_only)
+    assert "B2 | 50" not in prompt
+    assert "buyerContact" in prompt
+
+    prompt, stats = build_anomaly_prompt(TEMPLATE, INVOICE, CONTRACT, "Prices must match.", token_budget=invoiced_items_only - 1)
+    assert "buyerContact" not in prompt
+    assert "contractId: C-7" in prompt and "supplierName: Acme" in prompt
+    assert not stats["over_budget"]
+
+
+def test_business_rules_are_truncated_last():
+    rules = "Rule. " * 200
+    prompt, stats = build_anomaly_prompt(TEMPLATE, INVOICE, CONTRACT, rules, token_budget=200)
+    assert prompt.endswith("[truncated]")
+    assert "A1 | 100" in prompt
+    assert stats["saved_tokens"] > 0
@@ -0,0 +1,80 @@
+import pytest
+
+from common import request_routing
+from common.request_routing import RouteRules, StaticAssetCache, get_route_rules
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(request_routing, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return StaticAssetCache(str(tmp_path / "cache"), ttl_seconds=3600)
+
+
+URL = "https://app.example.com/static/app.js"
+
+
+def test_cached_asset_expires_after_ttl(cache, clock):
+    cache.put(URL, 200, {"Content-Type": "text/javascript"}, b"js")
+    assert cache.get(URL) == (200, {"content-type": "text/javascript"}, b"js")
+    clock.now += 3599
+    assert cache.get(URL) is not None
+    clock.now += 1
+    assert cache.get(URL) is None
+
+
+def test_max_age_shorter_than_ttl_wins(cache, clock):
+    cache.put(URL, 200, {"Cache-Control": "public, max-age=60"}, b"js")
+    clock.now += 59
+    assert cache.get(URL) is not None
+    clock.now += 1
+    assert cache.get(URL) is None
+
+
+def test_max_age_longer_than_ttl_is_capped(cache, clock):
+    cache.put(URL, 200, {"cache-control": "max-age=31536000, immutable"}, b"js")
+    clock.now += 3600
+    assert cache.get(URL) is None
+
+
+@pytest.mark.parametrize("cache_control", ["no-cache", "no-store", "private, max-age=600", "max-age=0"])
+def test_uncacheable_responses_are_not_stored(cache, cache_control):
+    cache.put(URL, 200, {"cache-control": cache_control}, b"js")
+    assert cache.get(URL) is None
+
+
+def test_non_200_responses_are_not_stored(cache):
+    cache.put(URL, 404, {}, b"missing")
+    assert cache.get(URL) is None
+
+
+def test_transfer_headers_are_not_replayed(cache):
+    cache.put(URL, 200, {"Content-Encoding": "gzip", "Content-Length": "12", "ETag": '"v1"'}, b"decoded body")
+    status, headers, body = cache.get(URL)
+    assert headers == {"etag": '"v1"'}
+    assert body == b"decoded body"
+
+
+def test_route_rules_decide():
+    rules = get_route_rules()
+    assert rules.decide("https://app.example.com/page", "document", is_navigation=True)
+    assert not rules.decide("https://www.google-analytics.com/collect", "xhr")
+    assert rules.decide("data:text/html,hi", "document")
+    extraction = get_route_rules("dom_extraction")
+    assert not extraction.decide("https://app.example.com/logo.png", "image", "https://app.example.com/")
+    assert not extraction.decide("https://cdn.other.net/lib.js", "script", "https://app.example.com/")
+    assert extraction.decide("https://app.example.com/app.js", "script", "https://app.example.com/")
+    assert not RouteRules(allow_hosts=("example.com",)).decide("https://evil.test/", "document", is_navigation=True)
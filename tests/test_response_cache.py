@@ -0,0 +1,71 @@
+import pytest
+from openai.types.responses import Response
+
+from common.response_cache import CacheMiss, ResponseCache, request_key
+
+IMAGE = "data:image/png;base64,iVBORw0KGgo="
+REQUEST = {
+    "model": "gpt-4o",
+    "input": [{"role": "user", "content": [{"type": "input_text", "text": "Extract the invoice"}, {"type": "input_image", "image_url": IMAGE}]}],
+    "tools": [{"type": "file_search", "vector_store_ids": ["vs-1"]}],
+}
+
+
+def _response(text="ok"):
+    return Response.model_validate({
+        "id": "resp_1",
+        "created_at": 0,
+        "model": "gpt-4o",
+        "object": "response",
+        "output": [{"type": "message", "id": "msg_1", "role": "assistant", "status": "completed",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    })
+
+
+@pytest.mark.parametrize("variant", [
+    dict(reversed(list(REQUEST.items()))),
+    {**REQUEST, "timeout": 30, "extra_headers": {"x-request-id": "42"}},
+    {**REQUEST, "metadata": {"run": "7"}, "user": "batch", "store": False},
+])
+def test_key_ignores_field_order_and_transport_fields(variant):
+    assert request_key(variant) == request_key(REQUEST)
+
+
+@pytest.mark.parametrize("variant", [
+    {**REQUEST, "model": "gpt-4.1"},
+    {**REQUEST, "tools": []},
+    {**REQUEST, "input": [{"role": "user", "content": [{"type": "input_image", "image_url": IMAGE + "AAAA"}]}]},
+])
+def test_key_changes_with_what_the_model_sees(variant):
+    assert request_key(variant) != request_key(REQUEST)
+
+
+def test_recorded_response_is_replayed(tmp_path):
+    ResponseCache("record", str(tmp_path)).put(REQUEST, _response("Invoice INV-1"))
+    cache = ResponseCache("replay", str(tmp_path))
+    replayed = cache.get({**REQUEST, "timeout": 10})
+    assert replayed.output_text == "Invoice INV-1"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_recorded_entry_does_not_store_image_data(tmp_path):
+    ResponseCache("record", str(tmp_path)).put(REQUEST, _response())
+    entries = list(tmp_path.rglob("*.json"))
+    assert len(entries) == 1
+    assert "base64" not in entries[0].read_text()
+
+
+def test_replay_miss_raises(tmp_path):
+    cache = ResponseCache("replay", str(tmp_path))
+    with pytest.raises(CacheMiss):
+        cache.get(REQUEST)
+    assert cache.misses == 1
+
+
+def test_record_miss_returns_none_and_passthrough_stores_nothing(tmp_path):
+    assert ResponseCache("record", str(tmp_path)).get(REQUEST) is None
+    ResponseCache("passthrough", str(tmp_path)).put(REQUEST, _response())
+    assert not list(tmp_path.rglob("*.json"))
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from common.results_sink import ResultsSink, discrepancy_types, flatten_record, verdict_findings
+
+DETAILED_VERDICT = """| Check | Invoice | Contract | Result |
+|---|---|---|---|
+| Unit price A1 | 110.00 | 100.00 | Mismatch |
+| Currency | USD | USD | OK |
+| Quantity B2 | 12 | 10 | Exceeds contract |"""
+
+RECORD = {
+    "invoice_key": "abc",
+    "image_path": "data_files/Invoice-001.png",
+    "worker": 1,
+    "results": {
+        "invoice_data": {
+            "contractId": "C-7",
+            "invoiceNumber": "INV-1",
+            "supplierId": "S-1",
+            "totalInvoiceValue": "1,250.00",
+            "invoiceLines": [{"itemId": "A1"}, {"itemId": "B2"}],
+        },
+        "contract_data": {"contractId": "C-7", "lines": [{"itemId": "A1"}, {"itemId": "B2"}]},
+        "verdict": {"status": "rejected", "summary_verdict": "Price and quantity mismatch", "detailed_verdict": DETAILED_VERDICT},
+        "post_result": {"posted": True, "status": "rejected"},
+        "timings": {"invoice_data": 1.5, "verdict": 2.25},
+    },
+}
+
+
+def test_verdict_findings_parses_the_markdown_table():
+    findings = verdict_findings(DETAILED_VERDICT)
+    assert len(findings) == 3
+    assert findings[0] == {"Check": "Unit price A1", "Invoice": "110.00", "Contract": "100.00", "Result": "Mismatch"}
+    assert verdict_findings("no table here") == []
+    assert verdict_findings(None) == []
+
+
+def test_discrepancy_types_only_counts_flagged_rows():
+    assert discrepancy_types(verdict_findings(DETAILED_VERDICT)) == ["price", "quantity"]
+    assert discrepancy_types([], ["item Z9 does not appear in the contract"]) == ["item"]
+
+
+def test_flatten_record():
+    row = flatten_record(RECORD)
+    assert row["invoice_key"] == "abc"
+    assert row["worker"] == "1"
+    assert row["contract_id"] == "C-7"
+    assert row["total_invoice_value"] == 1250.0
+    assert row["invoice_line_count"] == 2
+    assert row["contract_found"] is True
+    assert row["verdict_status"] == "rejected"
+    assert row["discrepancy_types"] == ["price", "quantity"]
+    assert row["discrepancy_count"] == 2
+    assert row["posted"] is True
+    assert row["total_seconds"] == 3.75
+    assert json.loads(row["timings"]) == {"invoice_data": 1.5, "verdict": 2.25}
+
+
+def test_fresh_and_resumed_posts_read_the_same():
+    fresh = {"posted": True, "status": "approved"}
+    already = {"posted": True, "status": "approved", "note": "Already posted (verified)"}
+    for post_result in (fresh, already):
+        assert flatten_record({"results": {"post_result": post_result}})["posted"] is True
+    assert flatten_record({"results": {"post_result": None}})["posted"] is False
+    skipped = {"error": "Posting skipped because invoice extraction or anomaly detection failed."}
+    assert flatten_record({"results": {"post_result": skipped}})["posted"] is False
+
+
+def test_flatten_record_of_a_failed_invoice():
+    row = flatten_record({
+        "invoice_key": "abc",
+        "error": "Pipeline failed: boom",
+        "results": {"contract_data": {"error": "not found"}, "post_result": "Post invoice failed: timeout"},
+    })
+    assert row["error"] == "Pipeline failed: boom"
+    assert row["contract_found"] is False
+    assert row["posted"] is False
+    assert row["invoice_data"] is None
+    assert row["total_seconds"] is None
+
+
+def test_flatten_record_without_results():
+    row = flatten_record({"image_path": "x.png", "error": "Pipeline failed: boom"})
+    assert row["image_path"] == "x.png"
+    assert row["discrepancy_types"] == []
+    assert row["posted"] is False
+
+
+def test_sink_buffers_records_until_flushed(tmp_path):
+    path = tmp_path / "results.jsonl"
+    sink = ResultsSink(str(path), parquet_dir=None, buffer_records=2, flush_seconds=3600)
+    sink.write({"invoice_key": "a"})
+    assert path.read_text(encoding="utf-8") == ""
+    sink.write({"invoice_key": "b"})
+    sink.write({"invoice_key": "c"})
+    sink.close()
+    keys = [json.loads(line)["invoice_key"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert keys == ["a", "b", "c"]
+
+
+def test_parquet_export(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.dataset as ds
+
+    parquet_dir = tmp_path / "parquet"
+    with ResultsSink(str(tmp_path / "results.jsonl"), parquet_dir=str(parquet_dir), export_rows=10) as sink:
+        sink.write(json.loads(json.dumps(RECORD)))
+    table = ds.dataset(str(parquet_dir)).to_table()
+    assert table.column("verdict_status").to_pylist() == ["rejected"]
@@ -0,0 +1,102 @@
+import json
+import queue
+import asyncio
+
+import pytest
+
+from common import safety_policy
+from common.safety_policy import SafetyPolicy
+
+POLICY = {
+    "rules": [
+        {"decision": "reject", "codes": ["malicious_instructions"]},
+        {"decision": "allow", "codes": ["irrelevant_domain"], "hosts": ["procurement.example.com"]},
+    ],
+    "default": "escalate",
+    "escalation_timeout": 60,
+}
+
+
+@pytest.fixture
+def policy():
+    return SafetyPolicy.from_dict(POLICY)
+
+
+def test_first_matching_rule_decides(policy):
+    assert policy.decide("malicious_instructions", "https://procurement.example.com/") == ("reject", "rule 0")
+
+
+def test_host_rule_matches_subdomains_only(policy):
+    assert policy.decide("irrelevant_domain", "https://app.procurement.example.com/x") == ("allow", "rule 1")
+    assert policy.decide("irrelevant_domain", "https://procurement.example.com.evil.test/") == ("escalate", "default")
+
+
+def test_unmatched_check_falls_back_to_default(policy):
+    assert policy.decide("sensitive_domain", "https://procurement.example.com/") == ("escalate", "default")
+    assert policy.decide("irrelevant_domain", None) == ("escalate", "default")
+
+
+def test_empty_policy_escalates():
+    assert SafetyPolicy().decide("malicious_instructions", "https://example.com/") == ("escalate", "default")
+
+
+def test_unknown_decisions_are_rejected():
+    with pytest.raises(ValueError):
+        SafetyPolicy.from_dict({"rules": [{"decision": "ignore"}]})
+    with pytest.raises(ValueError):
+        SafetyPolicy.from_dict({"default": "maybe"})
+
+
+def test_load_reads_the_policy_file(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps(POLICY), encoding="utf-8")
+    policy = SafetyPolicy.load(str(path))
+    assert policy.escalation_timeout == 60.0
+    assert len(policy.rules) == 2
+
+
+@pytest.fixture
+def terminal(monkeypatch):
+    answers = queue.Queue()
+    monkeypatch.setattr(safety_policy, "_answers", answers)
+    return answers
+
+
+def _answer(terminal, line):
+    async def ask():
+        answer = asyncio.create_task(safety_policy._ask_operator("check", timeout=1))
+        await asyncio.sleep(0.05)
+        terminal.put(line)
+        return await answer
+
+    return asyncio.run(ask())
+
+
+def test_operator_answer_is_read_from_the_terminal(terminal):
+    assert _answer(terminal, "y\n") is True
+    assert _answer(terminal, "n\n") is False
+
+
+def test_late_answer_is_not_taken_by_the_next_prompt(terminal):
+    assert asyncio.run(safety_policy._ask_operator("first", timeout=0.05)) is None
+    # The operator answers the first question after it timed out
+    terminal.put("y\n")
+
+    assert _answer(terminal, "n\n") is False
+
+
+def test_concurrent_escalations_ask_one_at_a_time(terminal, capsys):
+    async def both():
+        first = asyncio.create_task(safety_policy._ask_operator("first", timeout=1))
+        second = asyncio.create_task(safety_policy._ask_operator("second", timeout=1))
+        await asyncio.sleep(0.05)
+        asked = capsys.readouterr().out
+        terminal.put("y\n")
+        await first
+        await asyncio.sleep(0.05)
+        terminal.put("n\n")
+        return asked, await first, await second
+
+    asked, first, second = asyncio.run(both())
+    assert "first" in asked and "second" not in asked
+    assert (first, second) == (True, False)
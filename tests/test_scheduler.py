@@ -0,0 +1,81 @@
+import time
+import asyncio
+
+from common.scheduler import (
+    SCHEDULER_RESERVED_SLOTS, DeadlineScheduler, InvoiceJob, LocalJobSource, effective_rank, parse_deadline, urgency_order,
+)
+
+
+def _run(jobs, slots, arrivals=None, **options):
+    """Run jobs on a scheduler; arrivals maps a job to jobs queued once it starts. Returns (start order, peak concurrency)."""
+    source = LocalJobSource(jobs)
+    started = []
+    running = []
+    peak = [0]
+
+    async def run_job(job):
+        started.append(job.image_path)
+        source._jobs.extend((arrivals or {}).get(job.image_path, []))
+        running.append(job)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.1)
+        running.remove(job)
+
+    scheduler = DeadlineScheduler(
+        source, run_job, slots, aging_seconds=0, expected_seconds=60, metrics_seconds=0, poll_seconds=0.01, **options
+    )
+    asyncio.run(scheduler.run())
+    return started, peak[0]
+
+
+def test_effective_rank_ages_one_lane_per_interval():
+    assert effective_rank(2, 0, 300) == 2
+    assert effective_rank(2, 299, 300) == 2
+    assert effective_rank(2, 300, 300) == 1
+    assert effective_rank(2, 10_000, 300) == 0
+    assert effective_rank(2, 10_000, 0) == 2
+
+
+def test_parse_deadline_accepts_epoch_and_iso():
+    assert parse_deadline(None) is None
+    assert parse_deadline(1700000000) == 1700000000.0
+    assert parse_deadline("1700000000") == 1700000000.0
+    assert parse_deadline("2023-11-14T22:13:20Z") == 1700000000.0
+    assert parse_deadline("2023-11-14T22:13:20") == 1700000000.0
+
+
+def test_urgency_order_puts_at_risk_then_lanes_first():
+    now = time.time()
+    jobs = [InvoiceJob("low", 2), InvoiceJob("normal", 1), InvoiceJob("due", 2, deadline=now + 10), InvoiceJob("high", 0)]
+    assert [job.image_path for job in urgency_order(jobs, expected_seconds=60)] == ["due", "high", "normal", "low"]
+
+
+def test_no_reservation_by_default_uses_every_slot():
+    assert SCHEDULER_RESERVED_SLOTS == 0
+    started, peak = _run([InvoiceJob(f"normal-{i}") for i in range(4)], slots=2)
+    assert len(started) == 4
+    assert peak == 2
+
+
+def test_reserved_slot_is_held_for_urgent_jobs():
+    started, peak = _run([InvoiceJob(f"normal-{i}") for i in range(3)], slots=2, reserved_slots=1)
+    assert len(started) == 3
+    assert peak == 1
+
+    # A high-lane invoice arriving while the backlog runs starts right away on the reserved slot
+    jobs = [InvoiceJob(f"normal-{i}") for i in range(3)]
+    started, peak = _run(jobs, slots=2, arrivals={"normal-0": [InvoiceJob("high", 0)]}, reserved_slots=1)
+    assert started[:2] == ["normal-0", "high"]
+    assert peak == 2
+
+
+def test_reservation_never_blocks_an_idle_worker():
+    scheduler = DeadlineScheduler(LocalJobSource([]), None, 2, reserved_slots=5)
+    assert scheduler.reserved_slots == 1
+
+
+def test_local_source_urgent_only_skips_normal_jobs():
+    source = LocalJobSource([InvoiceJob("normal")])
+    assert source.next_job(True, 60, 0) is None
+    assert source.next_job(False, 60, 0).image_path == "normal"
+    assert source.next_job(False, 60, 0) is None
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+
+from common.session_state import StorageStateStore, session_app_for
+
+
+class _Context:
+    """Stands in for a Playwright browser context: records where storage state was written."""
+
+    def __init__(self, cookies=()):
+        self.cookies = list(cookies)
+        self.paths = []
+
+    async def storage_state(self, path):
+        self.paths.append(path)
+        # Yield so concurrent saves interleave
+        await asyncio.sleep(0)
+        with open(path, "w", encoding="utf-8") as state_file:
+            json.dump({"cookies": self.cookies, "origins": []}, state_file)
+
+
+def test_session_app_for_uses_host():
+    assert session_app_for("https://procurement.example.com/contracts?id=1") == "procurement.example.com"
+    assert session_app_for("") == ""
+
+
+def test_concurrent_saves_use_distinct_temp_files(tmp_path):
+    store = StorageStateStore(str(tmp_path))
+    contexts = [_Context(), _Context()]
+
+    async def save_both():
+        await asyncio.gather(*(store.save(context, "app.example.com") for context in contexts))
+
+    asyncio.run(save_both())
+    first, second = (context.paths[0] for context in contexts)
+    assert first != second
+    assert os.listdir(tmp_path) == ["app.example.com.json"]
+    assert store.load("app.example.com") == store.path_for("app.example.com")
+
+
+def test_saved_state_is_private(tmp_path):
+    store = StorageStateStore(str(tmp_path))
+    asyncio.run(store.save(_Context(), "app.example.com"))
+    assert os.stat(store.path_for("app.example.com")).st_mode & 0o777 == 0o600
+
+
+def test_expired_cookies_are_not_reused(tmp_path):
+    store = StorageStateStore(str(tmp_path))
+    asyncio.run(store.save(_Context(cookies=[{"name": "sid", "expires": 1}]), "app.example.com"))
+    assert store.load("app.example.com") is None
@@ -0,0 +1,66 @@
+import pytest
+
+from soak_test import find_regressions, percentile, slope_per_thousand
+
+VALUES = [0.5, 0.1, 0.4, 0.2, 0.3, 0.9, 0.7, 0.6, 1.0, 0.8]
+
+
+@pytest.mark.parametrize("values, pct, expected", [
+    ([], 95, None),
+    ([0.4], 99, 0.4),
+    (VALUES, 0, 0.1),
+    (VALUES, 50, 0.5),
+    (VALUES, 95, 1.0),
+    (VALUES, 99, 1.0),
+    ([1, 2, 3, 4], 50, 2),
+    ([1, 2, 3, 4], 75, 3),
+    ([1, 2, 3, 4], 76, 4),
+])
+def test_percentile_is_nearest_rank(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+@pytest.mark.parametrize("points, expected", [
+    ([(0, 10), (100, 20), (200, 30)], 100.0),
+    ([(0, 50), (500, 50), (1000, 50)], 0.0),
+    ([(0, 30), (100, 20), (200, 10)], -100.0),
+    ([(0, 10), (100, None), (200, 30), (300, 40)], 100.0),
+    ([(0, 10), (100, 20)], None),
+    ([(100, 10), (100, 20), (100, 30)], None),
+])
+def test_slope_per_thousand(points, expected):
+    assert slope_per_thousand(points, warmup=0) == expected
+
+
+def test_slope_ignores_the_warmup():
+    points = [(0, 500), (10, 100), (20, 10), (30, 10), (40, 10)]
+    assert slope_per_thousand(points, warmup=20) == 0.0
+
+
+BASELINE = {
+    "latency": {"verdict": {"p50": 1.0, "p95": 2.0, "p99": 3.0}},
+    "throughput_per_minute": 10.0,
+    "error_rate": 0.0,
+    "python_rss_mb_per_1000": 10.0,
+    "chromium_rss_mb_per_1000": None,
+    "open_fds_per_1000": 0.0,
+}
+
+
+@pytest.mark.parametrize("summary, expected", [
+    ({}, []),
+    (BASELINE, []),
+    ({"latency": {"verdict": {"p50": 9.0, "p95": 2.4, "p99": 3.5}}}, []),
+    ({"latency": {"verdict": {"p95": 2.5, "p99": 3.0}}}, ["verdict p95 2.5s > baseline 2.0s"]),
+    ({"latency": {"invoice_data": {"p95": 99.0}}}, []),
+    ({"throughput_per_minute": 8.0}, []),
+    ({"throughput_per_minute": 7.9}, ["throughput 7.9/min < baseline 10.0/min"]),
+    ({"error_rate": 0.01}, []),
+    ({"error_rate": 0.05}, ["error rate 5.00% > baseline 0.00%"]),
+    ({"python_rss_mb_per_1000": 17.0}, []),
+    ({"python_rss_mb_per_1000": 17.5}, ["python_rss_mb_per_1000 17.5 > baseline 10.0"]),
+    ({"chromium_rss_mb_per_1000": 6.0}, ["chromium_rss_mb_per_1000 6.0 > baseline None"]),
+    ({"open_fds_per_1000": 2.5}, ["open_fds_per_1000 2.5 > baseline 0.0"]),
+])
+def test_find_regressions(summary, expected):
+    assert find_regressions(summary, BASELINE, tolerance=0.2) == expected
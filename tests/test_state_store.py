@@ -0,0 +1,104 @@
+import time
+import sqlite3
+
+import pytest
+
+from common.state_store import InvoiceStateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = InvoiceStateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
+
+
+def _image(tmp_path, name):
+    path = tmp_path / f"{name}.png"
+    path.write_bytes(name.encode())
+    return str(path)
+
+
+def _claim_all(store, **options):
+    claimed = []
+    while True:
+        row = store.claim_next("worker", **options)
+        if row is None:
+            return claimed
+        claimed.append(row[1].rsplit("/", 1)[-1][:-4])
+
+
+def test_claim_orders_by_risk_priority_and_deadline(store, tmp_path):
+    now = time.time()
+    store.enqueue(_image(tmp_path, "low"), priority=2)
+    store.enqueue(_image(tmp_path, "normal"), priority=1)
+    store.enqueue(_image(tmp_path, "high-late"), priority=0, deadline=now + 3600)
+    store.enqueue(_image(tmp_path, "high-soon"), priority=0, deadline=now + 600)
+    store.enqueue(_image(tmp_path, "low-due"), priority=2, deadline=now + 60)
+    assert _claim_all(store, risk_before=now + 120) == ["low-due", "high-soon", "high-late", "normal", "low"]
+
+
+def test_claim_ages_waiting_invoices(store, tmp_path):
+    store.enqueue(_image(tmp_path, "normal"), priority=1)
+    old = store.enqueue(_image(tmp_path, "old-low"), priority=2)
+    store._conn.execute("UPDATE invoices SET updated_at = ? WHERE invoice_key = ?", (time.time() - 650, old))
+    assert _claim_all(store) == ["normal", "old-low"]
+    store._conn.execute("UPDATE invoices SET status = 'pending', attempts = 0")
+    store._conn.execute("UPDATE invoices SET updated_at = ? WHERE invoice_key = ?", (time.time() - 650, old))
+    assert _claim_all(store, aging_seconds=300) == ["old-low", "normal"]
+
+
+def test_claim_urgent_only(store, tmp_path):
+    now = time.time()
+    store.enqueue(_image(tmp_path, "normal"), priority=1)
+    assert store.claim_next("worker", urgent_only=True) is None
+    store.enqueue(_image(tmp_path, "due"), priority=2, deadline=now + 30)
+    assert store.claim_next("worker", urgent_only=True, risk_before=now + 60)[1].endswith("due.png")
+
+
+def test_failed_invoices_are_retried_until_max_attempts(store, tmp_path, monkeypatch):
+    monkeypatch.setattr("common.state_store.MAX_ATTEMPTS", 2)
+    key = store.enqueue(_image(tmp_path, "flaky"))
+    for _ in range(2):
+        assert store.claim_next("worker")[0] == key
+        store.mark_failed(key, "boom")
+    assert store.claim_next("worker") is None
+    assert store.claimable_invoices() == []
+
+
+def test_claim_all_counts_attempts(store, tmp_path, monkeypatch):
+    monkeypatch.setattr("common.state_store.MAX_ATTEMPTS", 2)
+    flaky = store.enqueue(_image(tmp_path, "flaky"))
+    done = store.enqueue(_image(tmp_path, "done"))
+    store.mark_done(done)
+    for _ in range(2):
+        assert [key for key, _ in store.claim_all("offline")] == [flaky]
+        assert store.status_counts() == {"running": 1, "done": 1}
+        store.mark_failed(flaky, "boom")
+    assert store.claim_all("offline") == []
+
+
+def test_enqueue_keeps_state_and_updates_priority(store, tmp_path):
+    path = _image(tmp_path, "invoice")
+    key = store.enqueue(path)
+    store.mark_done(key)
+    assert store.enqueue(path, priority=0) == key
+    assert store.status_counts() == {"done": 1}
+    assert store._conn.execute("SELECT priority FROM invoices").fetchone()[0] == 0
+
+
+def test_existing_store_is_migrated(tmp_path):
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE invoices (invoice_key TEXT PRIMARY KEY, image_path TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', "
+        "attempts INTEGER NOT NULL DEFAULT 0, claimed_by TEXT, last_error TEXT, updated_at REAL NOT NULL)"
+    )
+    connection.execute("INSERT INTO invoices (invoice_key, image_path, updated_at) VALUES ('k', 'old.png', ?)", (time.time(),))
+    connection.commit()
+    connection.close()
+    store = InvoiceStateStore(path)
+    try:
+        assert store.claim_next("worker")[:4] == ("k", "old.png", 1, None)
+    finally:
+        store.close()
@@ -0,0 +1,105 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("vector_store", Path(__file__).resolve().parent.parent / "vector-store.py")
+vector_store = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(vector_store)
+
+
+@pytest.fixture
+def rules(tmp_path):
+    """Two rule files plus manifest entries that match their current content."""
+    paths = []
+    for name in ("p2p-rules.txt", "freight-rules.txt"):
+        path = tmp_path / name
+        path.write_text(f"rules of {name}")
+        paths.append(str(path))
+    entries = {path: {"sha256": vector_store.file_sha256(path), "file_id": f"file-{index}"} for index, path in enumerate(paths)}
+    return paths, entries
+
+
+def test_unchanged_files_need_no_sync(rules):
+    paths, entries = rules
+    assert vector_store.plan_sync(paths, entries) == ({}, {})
+
+
+def test_changed_file_is_uploaded_and_its_old_version_removed(rules):
+    paths, entries = rules
+    Path(paths[0]).write_text("new rules")
+    changed, stale = vector_store.plan_sync(paths, entries)
+    assert changed == {paths[0]: vector_store.file_sha256(paths[0])}
+    assert stale == {"file-0": paths[0]}
+
+
+def test_file_no_longer_listed_is_removed(rules):
+    paths, entries = rules
+    assert vector_store.plan_sync(paths[:1], entries) == ({}, {"file-1": paths[1]})
+
+
+def test_force_replaces_every_file(rules):
+    paths, entries = rules
+    changed, stale = vector_store.plan_sync(paths, entries, force=True)
+    assert sorted(changed) == sorted(paths)
+    assert stale == {"file-0": paths[0], "file-1": paths[1]}
+
+
+def test_first_run_removes_uploads_the_manifest_does_not_know(rules):
+    paths, _ = rules
+    store_files = {"file-old-1": "p2p-rules.txt", "file-old-2": "p2p-rules.txt"}
+    changed, stale = vector_store.plan_sync(paths, {}, store_files=store_files)
+    assert sorted(changed) == sorted(paths)
+    assert stale == store_files
+
+
+def test_store_listing_keeps_the_files_of_unchanged_entries(rules):
+    paths, entries = rules
+    Path(paths[1]).write_text("new rules")
+    store_files = {"file-0": "p2p-rules.txt", "file-1": "freight-rules.txt", "file-old": "p2p-rules.txt"}
+    changed, stale = vector_store.plan_sync(paths, entries, store_files=store_files)
+    assert list(changed) == [paths[1]]
+    assert stale == {"file-1": paths[1], "file-old": "p2p-rules.txt"}
+
+
+class _Client:
+    """Vector store client holding the given {file_id: filename}; records uploads and deletions."""
+
+    def __init__(self, store_files):
+        self.store_files = dict(store_files)
+        self.deleted = []
+        self.files = self
+        self.vector_stores = self
+        self.file_batches = self
+
+    def list(self, vector_store_id):
+        return [type("StoreFile", (), {"id": file_id}) for file_id in self.store_files]
+
+    def retrieve(self, file_id):
+        return type("File", (), {"filename": self.store_files[file_id]})
+
+    def create(self, file, purpose):
+        file_id = f"file-new-{len(self.store_files)}"
+        self.store_files[file_id] = Path(file.name).name
+        return type("File", (), {"id": file_id})
+
+    def create_and_poll(self, vector_store_id, file_ids):
+        return type("Batch", (), {"id": "batch-1", "status": "completed", "file_counts": type("Counts", (), {"failed": 0})})
+
+    def delete(self, file_id, vector_store_id=None):
+        if vector_store_id is None:
+            self.deleted.append(file_id)
+            self.store_files.pop(file_id, None)
+
+
+def test_first_sync_leaves_one_copy_of_each_rule_file(rules, tmp_path, monkeypatch):
+    import common.clients
+
+    paths, _ = rules
+    client = _Client({"file-old": "p2p-rules.txt"})
+    monkeypatch.setattr(common.clients, "get_client", lambda *args: client)
+    manifest_path = str(tmp_path / "manifest.json")
+    assert vector_store.sync("vs-1", paths, manifest_path, query=False)
+    assert client.deleted == ["file-old"]
+    assert sorted(client.store_files.values()) == ["freight-rules.txt", "p2p-rules.txt"]
+    assert not vector_store.sync("vs-1", paths, manifest_path, query=False)
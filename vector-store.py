@@ -1,57 +1,217 @@
-from openai import AzureOpenAI
-import json
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+# Business rules vector store sync.
+# Hashes the local rule files, compares them with a manifest of what was last uploaded to the vector store,
+# and uploads only the files whose content changed, in one batch. Replaced versions are removed from the
+# vector store. When nothing changed the run finishes without calling the service.
+# On the first run (no manifest yet) and with --force the vector store's actual files are listed as well, so
+# uploads that the manifest does not know about, e.g. from the old upload script, are removed too.
+
 import os
+import sys
+import json
+import hashlib
+import contextlib
+from dotenv import load_dotenv
 
+load_dotenv()
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 MODEL = os.getenv("MODEL_NAME2")
 API_VERSION = os.getenv("AZURE_API_VERSION")
+VECTOR_STORE_ID = os.getenv("vector_store_id")
+# Rule files kept in the vector store (comma separated)
+RULE_FILES = [path.strip() for path in os.getenv("VECTOR_STORE_FILES", "data_files/p2p-rules.txt").split(",") if path.strip()]
+MANIFEST_PATH = os.getenv("VECTOR_STORE_MANIFEST", ".vector_store_manifest.json")
+SANITY_QUERY = "What are business rules in procure to pay process?"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as rule_file:
+        for chunk in iter(lambda: rule_file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Return the manifest: {vector_store_id: {rule file path: {"sha256": ..., "file_id": ...}}}."""
+    try:
+        with open(path, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan_sync(file_paths, entries, force=False, store_files=None):
+    """
+    Compare local rule files with the manifest entries of one vector store.
+    Args:
+        file_paths (list[str]): Local rule files that should be in the vector store.
+        entries (dict): Manifest entries for the vector store.
+        force (bool): Treat every file as changed.
+        store_files (dict): {file_id: filename} actually in the vector store; files the kept entries do not
+            reference are stale as well. None compares with the manifest only.
+    Returns:
+        tuple: (changed {path: sha256}, stale {file_id: path or filename} of files that are replaced, no longer
+            listed or not in the manifest).
+    """
+    changed = {}
+    stale = {}
+    for path in file_paths:
+        sha256 = file_sha256(path)
+        entry = entries.get(path)
+        if force or entry is None or entry.get("sha256") != sha256:
+            changed[path] = sha256
+            if entry:
+                stale[entry["file_id"]] = path
+    for path, entry in entries.items():
+        if path not in file_paths:
+            stale[entry["file_id"]] = path
+    if store_files:
+        kept = {entry["file_id"] for path, entry in entries.items() if path in file_paths and path not in changed}
+        for file_id, filename in store_files.items():
+            if file_id not in kept:
+                stale.setdefault(file_id, filename)
+    return changed, stale
+
+
+def list_store_files(client, vector_store_id):
+    """Return {file_id: filename} of the files in the vector store."""
+    import openai
+
+    store_files = {}
+    for store_file in client.vector_stores.files.list(vector_store_id=vector_store_id):
+        try:
+            store_files[store_file.id] = client.files.retrieve(store_file.id).filename
+        except openai.NotFoundError:
+            store_files[store_file.id] = store_file.id
+    return store_files
+
+
+def upload_files(client, vector_store_id, changed):
+    """Upload the changed files and add them to the vector store as one file batch. Returns {path: file_id}."""
+    file_ids = {}
+    for path in changed:
+        with open(path, "rb") as rule_file:
+            file_ids[path] = client.files.create(file=rule_file, purpose="assistants").id
+    file_batch = client.vector_stores.file_batches.create_and_poll(
+        vector_store_id=vector_store_id, file_ids=list(file_ids.values())
+    )
+    if file_batch.status != "completed" or file_batch.file_counts.failed:
+        for file_id in file_ids.values():
+            _delete_file(client, vector_store_id, file_id)
+        raise RuntimeError(f"File batch {file_batch.id} ended with status '{file_batch.status}' ({file_batch.file_counts})")
+    return file_ids
+
+
+def _delete_file(client, vector_store_id, file_id):
+    import openai
+
+    # Either object may already be gone, e.g. when it was removed in the portal
+    with contextlib.suppress(openai.NotFoundError):
+        client.vector_stores.files.delete(file_id=file_id, vector_store_id=vector_store_id)
+    with contextlib.suppress(openai.NotFoundError):
+        client.files.delete(file_id)
+
+
+def run_sanity_query(client, vector_store_id):
+    response = client.responses.create(
+        model=MODEL or "gpt-4o",
+        tools=[
+            {
+                "type": "file_search",
+                "vector_store_ids": [vector_store_id],
+                "max_num_results": 20,
+            }
+        ],
+        input=SANITY_QUERY,
+    )
+    print(response.output_text)
+
+
+def sync(vector_store_id=VECTOR_STORE_ID, file_paths=RULE_FILES, manifest_path=MANIFEST_PATH, force=False, dry_run=False, query=True):
+    """
+    Bring the vector store in line with the local rule files.
+    Args:
+        vector_store_id (str): Target vector store.
+        file_paths (list[str]): Local rule files.
+        manifest_path (str): JSON manifest of the files last uploaded per vector store.
+        force (bool): Re-upload every file even if its hash is unchanged.
+        dry_run (bool): Only report what would change.
+        query (bool): Run the file_search sanity query after a change.
+    Returns:
+        bool: True if the vector store was (or, with dry_run, would be) changed.
+    """
+    from common.clients import get_client
+
+    manifest = load_manifest(manifest_path)
+    entries = manifest.get(vector_store_id, {})
+    client = None
+    store_files = None
+    # Without a manifest (or with force) the manifest cannot tell what is already in the vector store
+    if not entries or force:
+        client = get_client(AZURE_ENDPOINT, API_VERSION)
+        store_files = list_store_files(client, vector_store_id)
+    changed, stale = plan_sync(file_paths, entries, force=force, store_files=store_files)
+    if not changed and not stale:
+        print(f"Vector store {vector_store_id} is up to date ({len(entries)} files)")
+        return False
+    for path in changed:
+        print(f"{'Would upload' if dry_run else 'Uploading'} {path}")
+    for file_id, name in stale.items():
+        print(f"{'Would remove' if dry_run else 'Removing'} stale {name} ({file_id})")
+    if dry_run:
+        return True
+
+    client = client or get_client(AZURE_ENDPOINT, API_VERSION)
+    if changed:
+        file_ids = upload_files(client, vector_store_id, changed)
+        for path, file_id in file_ids.items():
+            entries[path] = {"sha256": changed[path], "file_id": file_id}
+        manifest[vector_store_id] = entries
+        save_manifest(manifest, manifest_path)
+    for file_id in stale:
+        _delete_file(client, vector_store_id, file_id)
+    for path in list(entries):
+        if path not in file_paths:
+            entries.pop(path)
+    manifest[vector_store_id] = entries
+    save_manifest(manifest, manifest_path)
+    print(f"Vector store {vector_store_id}: uploaded {len(changed)}, removed {len(stale)} stale files")
+
+    if query:
+        run_sanity_query(client, vector_store_id)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Sync the business rule files into the vector store.')
+    parser.add_argument('--vector-store-id', type=str, default=VECTOR_STORE_ID, help='Target vector store (default: vector_store_id)')
+    parser.add_argument('--files', nargs='*', default=RULE_FILES, help='Rule files to keep in the vector store')
+    parser.add_argument('--manifest', type=str, default=MANIFEST_PATH, help='Manifest of uploaded files')
+    parser.add_argument('--create', type=str, default=None, metavar='NAME', help='Create a new vector store with this name and sync into it')
+    parser.add_argument('--force', action='store_true', help='Re-upload every file even if unchanged')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    parser.add_argument('--no-query', action='store_true', help='Skip the file_search sanity query')
+    args = parser.parse_args()
+
+    vector_store_id = args.vector_store_id
+    if args.create:
+        from common.clients import get_client
 
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
-)
-
-client = AzureOpenAI(
-    azure_endpoint=AZURE_ENDPOINT,
-    azure_ad_token_provider=token_provider,
-    api_version=API_VERSION,
-)
-
-# # This is to create a vector store in OpenAI. Uncomment and run this if you want to create a new vector store.
-# vector_store = client.vector_stores.create(
-#   name="BusinessRules"
-# )
-# print(vector_store)
-
-
-# Ready the files for upload to OpenAI. Run this if you want to upload files (i.e. business rules for anomaly detection) to the vector store.
-file_paths = ["data_files/p2p-rules.txt"]
-file_streams = [open(path, "rb") for path in file_paths]
-
-vector_store = client.vector_stores.retrieve(
-    vector_store_id=os.getenv("vector_store_id")
-)
-# Use the upload and poll SDK helper to upload the files, add them to the vector store,
-# and poll the status of the file batch for completion.
-file_batch = client.vector_stores.file_batches.upload_and_poll(
-    vector_store_id=vector_store.id, files=file_streams
-)
-
-# # You can print the status and the file counts of the batch to see the result of this operation.
-# print(file_batch.status)
-# print(file_batch.file_counts)
-
-# test the vector store
-response = client.responses.create(
-    model="gpt-4o",
-    tools=[
-        {
-            "type": "file_search",
-            "vector_store_ids": [vector_store.id],
-            "max_num_results": 20,
-        }
-    ],
-    input="What are business rules in procure to pay process?",
-)
-
-print(json.dumps(response, default=lambda o: o.__dict__, indent=4))
+        vector_store = get_client(AZURE_ENDPOINT, API_VERSION).vector_stores.create(name=args.create)
+        vector_store_id = vector_store.id
+        print(f"Created vector store {vector_store_id}; set vector_store_id={vector_store_id} in .env")
+    if not vector_store_id:
+        parser.error("No vector store given; set vector_store_id or use --vector-store-id or --create.")
+    try:
+        sync(vector_store_id, args.files, args.manifest, force=args.force, dry_run=args.dry_run, query=not args.no_query)
+    except Exception as e:
+        print(f"Vector store sync failed: {e}")
+        sys.exit(1)